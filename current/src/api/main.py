@@ -1,55 +1,274 @@
-from fastapi import FastAPI, Depends, HTTPException, Query
+from fastapi import FastAPI, Depends, HTTPException, Query, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse, Response
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
-from typing import Optional
-from datetime import datetime
+from contextlib import asynccontextmanager
+from typing import Optional, List, Dict, Any
+from datetime import datetime, date
 
 from sqlalchemy.orm import Session
-import sys, os
+import logging, sys, os
 sys.path.append(os.path.abspath(os.path.join(__file__, "..", "..")))
 
-from core.database import get_db
-from core.services.calc import calculate_bill, upsert_calc_run
+from core.database import get_db, SessionLocal
+from core.notify import start_listener
+from core.services.calc import calculate_bill, fetch_readings, upsert_calc_run
 from core.services.checksum import compute_checksum
+from core.services.compare import compare_tariffs
+from core.services.worker import enqueue_calc_run
+from core.services.billrun import bill_run_progress
+from core.services.revenue import revenue_by_month
+from core.services.curve import iter_cost_curve, ndjson_lines, arrow_stream, NDJSON_MEDIA_TYPE, ARROW_MEDIA_TYPE
+from core.services.history import bill_history, latest_bill, run_checksum, etag_for, MAX_PAGE_SIZE
+from core.services.bundle import config_bundle, bundle_etag
+from core.services.resolve import resolver
+from core.services.tariffs import validate_tariff, validate_tariffs, store_tariff_version
+from core.services.admission import LIMITERS, AdmissionRejected, admission_metrics, estimate_readings
 
 
-app = FastAPI(title="Calculator API")
+logger = logging.getLogger("api")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Evict cached plan indexes (and other tariff/fee caches) as other processes change them
+    start_listener()
+    # Build the effective-date index of every tariff plan up front; plans are otherwise loaded on first use
+    db = SessionLocal()
+    try:
+        logger.info("indexed %d tariff plans", resolver.load(db))
+    except Exception as e:
+        logger.warning("tariff plan index not preloaded: %s", e)
+    finally:
+        db.close()
+    yield
+
+app = FastAPI(title="Calculator API", lifespan=lifespan)
+
+# Recalculations and stored-result reads are admitted separately (core/services/admission.py),
+# so a burst of long recalcs is throttled without starving cheap lookups of pool connections
+calc_limiter = LIMITERS["calc"]
+read_limiter = LIMITERS["read"]
+
+@app.exception_handler(AdmissionRejected)
+def admission_rejected(request: Request, exc: AdmissionRejected):
+    return JSONResponse(status_code=exc.status_code, headers={"Retry-After": str(exc.retry_after)},
+                        content={"detail": f"{exc.limiter} requests are over capacity ({exc.reason})",
+                                 "retry_after": exc.retry_after})
+
+@app.get("/metrics/admission")
+def get_admission_metrics():
+    # In-flight requests, queue depth and rejection counters per endpoint class
+    return admission_metrics()
 
 class CalcStoreRequest(BaseModel):
     customer_id: int
-    tariff_version_id: int
+    # Either the exact version, or the plan whose version in force on `start` is used
+    tariff_version_id: Optional[int] = None
+    tariff_plan_id: Optional[int] = None
     start: datetime
     end: datetime
     force: Optional[bool] = False
+    background: Optional[bool] = False
+
+def resolve_tariff_version(db: Session, req: CalcStoreRequest) -> int:
+    if (req.tariff_version_id is None) == (req.tariff_plan_id is None):
+        raise HTTPException(status_code=422, detail="give exactly one of tariff_version_id and tariff_plan_id")
+    if req.tariff_version_id is not None:
+        return req.tariff_version_id
+    # In-memory effective-date index (core/services/resolve.py); later versions within the period are segments
+    version_id = resolver.resolve(db, req.tariff_plan_id, req.start.date())
+    if version_id is None:
+        raise HTTPException(status_code=404,
+                            detail=f"no version of tariff plan {req.tariff_plan_id} in force on {req.start.date()}")
+    return version_id
 
 @app.post("/calculate")
 def calculate_and_store(req: CalcStoreRequest, db: Session = Depends(get_db)):
-    # Compute checksum to avoid unnecessary recomputation
-    checksum = compute_checksum(db, req.customer_id, req.tariff_version_id, req.start, req.end)
-    result = calculate_bill(db, req.customer_id, req.tariff_version_id, req.start, req.end)
-    run_id = upsert_calc_run(db, req.customer_id, req.tariff_version_id, req.start, req.end, checksum, result)
-    return {"calc_run_id": run_id, **result}
+    tariff_version_id = resolve_tariff_version(db, req)
+    if req.background:
+        # Leave it to the worker pool (core/services/worker.py); poll /calc-runs/{id}
+        with read_limiter.admit():
+            run_id = enqueue_calc_run(db, req.customer_id, tariff_version_id, req.start, req.end)
+        return JSONResponse(status_code=202, content={"calc_run_id": run_id, "tariff_version_id": tariff_version_id,
+                                                      "status": "pending"})
+    with calc_limiter.admit(estimate_readings(req.start, req.end)):
+        # Compute checksum to avoid unnecessary recomputation; both use the same readings
+        readings = fetch_readings(db, req.customer_id, req.start, req.end)
+        checksum = compute_checksum(db, req.customer_id, tariff_version_id, req.start, req.end, readings=readings)
+        result = calculate_bill(db, req.customer_id, tariff_version_id, req.start, req.end, readings=readings)
+        run_id = upsert_calc_run(db, req.customer_id, tariff_version_id, req.start, req.end, checksum, result)
+    return {"calc_run_id": run_id, "tariff_version_id": tariff_version_id, **result}
 
-@app.get("/customers/{customer_id}/bills")
-def get_bill(customer_id: int, start: datetime, end: datetime, tariff_version_id: int, db: Session = Depends(get_db)):
-    # Return last stored calc_run for the inputs if available
-    from sqlalchemy import select
+class CompareRequest(BaseModel):
+    customer_id: int
+    tariff_version_ids: List[int]
+    start: datetime
+    end: datetime
+
+@app.post("/compare")
+def compare(req: CompareRequest, db: Session = Depends(get_db)):
+    # Price one load profile against every requested tariff version, cheapest first
+    if not req.tariff_version_ids:
+        raise HTTPException(status_code=422, detail="tariff_version_ids must not be empty")
+    with calc_limiter.admit(estimate_readings(req.start, req.end)):
+        return compare_tariffs(db, req.customer_id, req.tariff_version_ids, req.start, req.end)
+
+@app.get("/calc-runs/{run_id}")
+def get_calc_run(run_id: int, db: Session = Depends(get_db)):
     from core.models import CalcRun
-    row = db.execute(
-        select(CalcRun).where(
-            CalcRun.customer_id == customer_id,
-            CalcRun.tariff_version_id == tariff_version_id
-        ).order_by(CalcRun.id.desc())
-    ).scalars().first()
+    with read_limiter.admit():
+        row = db.get(CalcRun, run_id)
+    if not row:
+        raise HTTPException(status_code=404, detail="calc run not found")
+    summary = row.result_summary_json or {}
+    return {
+        "calc_run_id": row.id,
+        "status": row.status,
+        "attempts": row.attempts,
+        "started_at": row.started_at,
+        "finished_at": row.finished_at,
+        "last_error": row.last_error,
+        **summary.get("result", {}),
+    }
+
+@app.get("/bill-runs/{bill_run_id}")
+def get_bill_run(bill_run_id: int, db: Session = Depends(get_db)):
+    # Live progress and ETA of a month-end bill run (core/services/billrun.py)
+    with read_limiter.admit():
+        progress = bill_run_progress(db, bill_run_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="bill run not found")
+    return progress
+
+@app.get("/revenue/monthly")
+def revenue_monthly(from_month: Optional[date] = None, to_month: Optional[date] = None,
+                    tariff_plan_id: Optional[int] = None, category: Optional[str] = None,
+                    db: Session = Depends(get_db)):
+    # Served from the revenue_monthly summary (python -m core.services.revenue --refresh)
+    with read_limiter.admit():
+        return revenue_by_month(db, from_month, to_month, tariff_plan_id, category)
+
+class CostCurveRequest(BaseModel):
+    customer_id: int
+    tariff_version_id: int
+    start: datetime
+    end: datetime
+    interval_minutes: Optional[int] = 30
+    format: Optional[str] = "ndjson"
+
+@app.post("/cost-curve")
+def cost_curve(req: CostCurveRequest, db: Session = Depends(get_db)):
+    # Per-interval cost by component, streamed in chunks as NDJSON or Arrow IPC
+    from core.models import TariffVersion
+    if req.format not in ("ndjson", "arrow"):
+        raise HTTPException(status_code=422, detail="format must be 'ndjson' or 'arrow'")
+    if not req.interval_minutes or req.interval_minutes <= 0:
+        raise HTTPException(status_code=422, detail="interval_minutes must be positive")
+    if not db.get(TariffVersion, req.tariff_version_id):
+        raise HTTPException(status_code=404, detail="tariff version not found")
+    if req.format == "arrow":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise HTTPException(status_code=501, detail="Arrow output needs pyarrow installed")
+    # Admit before the response starts so an over-capacity request still gets a 429/503;
+    # the slot is held until the stream finishes. Hand the connection back while queued.
+    db.rollback()
+    release = calc_limiter.hold(estimate_readings(req.start, req.end, interval_minutes=req.interval_minutes))
+
+    def chunks():
+        # The stream outlives the request's session, so it uses its own
+        stream_db = SessionLocal()
+        try:
+            yield from iter_cost_curve(stream_db, req.customer_id, req.tariff_version_id,
+                                       req.start, req.end, req.interval_minutes)
+        finally:
+            stream_db.close()
+            release()
+
+    # The background task frees the slot when the body is never iterated (client gone first)
+    try:
+        body = arrow_stream(chunks()) if req.format == "arrow" else ndjson_lines(chunks())
+        media_type = ARROW_MEDIA_TYPE if req.format == "arrow" else NDJSON_MEDIA_TYPE
+        return StreamingResponse(body, media_type=media_type, background=BackgroundTask(release))
+    except Exception:
+        release()
+        raise
+
+def conditional_json(request: Request, etag: str, content) -> Response:
+    # Polling clients revalidate with If-None-Match and get an empty 304 while nothing changed
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    sent = [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]
+    if etag in sent or "*" in sent:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content=jsonable_encoder(content), headers=headers)
+
+@app.get("/customers/{customer_id}/bills")
+def get_bill(customer_id: int, start: datetime, end: datetime, tariff_version_id: int, request: Request,
+             db: Session = Depends(get_db)):
+    # Return last stored calc_run for exactly these inputs if available
+    with read_limiter.admit():
+        row = latest_bill(db, customer_id, tariff_version_id, start, end)
 
     if not row or not row.result_summary_json:
-        # fallback: compute & store now
-        checksum = compute_checksum(db, customer_id, tariff_version_id, start, end)
-        result = calculate_bill(db, customer_id, tariff_version_id, start, end)
-        run_id = upsert_calc_run(db, customer_id, tariff_version_id, start, end, checksum, result)
-        return {"calc_run_id": run_id, **result}
+        # fallback: compute & store now, admitted as a recalculation
+        db.rollback()  # don't hold a pooled connection while queued
+        with calc_limiter.admit(estimate_readings(start, end)):
+            readings = fetch_readings(db, customer_id, start, end)
+            checksum = compute_checksum(db, customer_id, tariff_version_id, start, end, readings=readings)
+            result = calculate_bill(db, customer_id, tariff_version_id, start, end, readings=readings)
+            run_id = upsert_calc_run(db, customer_id, tariff_version_id, start, end, checksum, result)
+        return conditional_json(request, etag_for(run_id, checksum), {"calc_run_id": run_id, **result})
+
+    return conditional_json(request, etag_for(row.id, run_checksum(row)),
+                            {"calc_run_id": row.id, **row.result_summary_json.get("result", {})})
+
+@app.get("/config-bundle")
+def get_config_bundle(customer_id: int, request: Request, on: Optional[date] = None, db: Session = Depends(get_db)):
+    # Customer, region, plans with versions in force and market fees in one revalidatable response
+    with read_limiter.admit():
+        bundle = config_bundle(db, customer_id, on)
+    if bundle is None:
+        raise HTTPException(status_code=404, detail="customer not found")
+    return conditional_json(request, bundle_etag(bundle), bundle)
+
+@app.get("/customers/{customer_id}/bills/history")
+def get_bill_history(customer_id: int, request: Request, before_id: Optional[int] = None,
+                     limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+                     start: Optional[datetime] = None, end: Optional[datetime] = None,
+                     tariff_version_id: Optional[int] = None, include_breakdown: bool = False,
+                     db: Session = Depends(get_db)):
+    # Newest first; pass next_before_id back as before_id for the next page
+    with read_limiter.admit():
+        page = bill_history(db, customer_id, before_id, limit, start, end, tariff_version_id, include_breakdown)
+    return conditional_json(request, page.pop("etag"), page)
+
+class TariffBatch(BaseModel):
+    tariffs: List[Dict[str, Any]]
+
+class TariffUpload(BaseModel):
+    tariff_plan_id: int
+    uploaded_by: str
+    tariff: Dict[str, Any]
 
-    return {"calc_run_id": row.id, **row.result_summary_json.get("result", {})}
+@app.post("/tariffs/validate")
+def validate_tariff_batch(batch: TariffBatch):
+    # Schema, calculation expressions, tiers and dates for each tariff; nothing is stored
+    return validate_tariffs(batch.tariffs)
 
-# Finalise validate endpoint
-#@app.post("/validate")
-#def validate_tariff(tariff: Tariff, db: Session = Depends(get_db)):
\ No newline at end of file
+@app.post("/tariffs")
+def upload_tariff(upload: TariffUpload, db: Session = Depends(get_db)):
+    errors = validate_tariff(upload.tariff)
+    if errors:
+        raise HTTPException(status_code=422, detail={"errors": errors})
+    version, created = store_tariff_version(db, upload.tariff_plan_id, upload.tariff, upload.uploaded_by)
+    if version is None:
+        raise HTTPException(status_code=404, detail="tariff plan not found")
+    # Re-uploading content already stored for the plan returns that version
+    return JSONResponse(status_code=201 if created else 200, content={
+        "tariff_version_id": version.id, "tariff_plan_id": version.tariff_plan_id, "version": version.version,
+        "effective_from": str(version.effective_from),
+        "effective_to": str(version.effective_to) if version.effective_to else None,
+        "content_hash": version.content_hash, "created": created,
+    })
\ No newline at end of file
@@ -1,8 +1,12 @@
+import numpy as np
 import pandas as pd
 from enum import Enum
 import math
 import calendar
 
+from .readings import ReadingSeries
+from .services.tzindex import wall_to_utc
+
 class Agg(str, Enum):
     MAX = "max"
     MEAN = "mean"
@@ -11,14 +15,16 @@ class Agg(str, Enum):
 # Helper: Resamples meter data into canonical 30-minute buckets.
 # - Demand (kW/kVA) is resampled to a 1-minute grid with forward-fill capped at 5 minutes,
 #   then aggregated via a 30-minute rolling window. No backfill is applied.
-# - Timestamps are localized using ambiguous="infer" and nonexistent="shift_forward"
+# - Naive timestamps are localized with the same ambiguous="infer" / nonexistent="shift_forward"
+#   policy, via the cached per-(timezone, year) transition table in services/tzindex.py,
 #   so daylight-savings transitions are handled safely.
 # - Energy assumption: usage_kwh values are treated as per-interval (not cumulative) kWh readings
 #   and summed into 30-minute buckets.
+# - A ReadingSeries (core/readings.py) may be passed instead of a DataFrame; its kWh become usage_column.
 
 # Resample data into 30-minute intervals, handling timezone localisation and rolling window aggregation for power demand.
 def resample_to_30min(
-    df: pd.DataFrame,
+    df: pd.DataFrame | ReadingSeries,
     tz: str = "Australia/Melbourne",
     kw_column: str = "KW",
     usage_column: str = "usage_kwh",
@@ -26,6 +32,10 @@ def resample_to_30min(
     timestamp_column: str = "timestamp"
 ) -> pd.DataFrame:
 
+    # View a ReadingSeries as a frame of energy readings (the copy below leaves it untouched)
+    if isinstance(df, ReadingSeries):
+        df = df.to_pandas(usage_column).to_frame()
+
     # Ensure the input df is a copy to avoid modifying the original
     df = df.copy()
 
@@ -36,15 +46,23 @@ def resample_to_30min(
         df[timestamp_column] = pd.to_datetime(df[timestamp_column], errors='coerce')
         df.set_index(timestamp_column, inplace=True)
 
-    # Localise or convert the index to the specified timezone
+    # Localise or convert the index to the specified timezone.
+    # Naive wall times go through the cached transition table in tzindex
+    # (same "infer"/"shift_forward" policy) instead of tz_localize.
     if df.index.tz is None:
-        df.index = df.index.tz_localize(tz, ambiguous="infer", nonexistent="shift_forward")
+        wall_ns = df.index.values.astype("datetime64[ns]").astype(np.int64)
+        # Unparseable timestamps (NaT) stay NaT, as with tz_localize, and are left out by resample
+        valid = ~df.index.isna()
+        wall_s = wall_ns[valid] // 1_000_000_000
+        utc_ns = np.full(len(wall_ns), np.iinfo(np.int64).min)
+        utc_ns[valid] = wall_ns[valid] - (wall_s - wall_to_utc(wall_s, tz, ambiguous="infer")) * 1_000_000_000
+        df.index = pd.DatetimeIndex(utc_ns.astype("datetime64[ns]"), name=df.index.name).tz_localize("UTC").tz_convert(tz)
     else:
         df.index = df.index.tz_convert(tz)
 
     # Resample energy column to 30 minute intervals
     if usage_column in df.columns:
-        energy_resampled = df[[usage_column]].resample("30T").sum()
+        energy_resampled = df[[usage_column]].resample("30min").sum()
     else:
         energy_resampled = pd.DataFrame()
 
@@ -52,18 +70,18 @@ def resample_to_30min(
     if kw_column in df.columns:
         
         # Interpolate missing values in the power column
-        power_1min = df[[kw_column]].resample("1T").mean().ffill(limit=5)
+        power_1min = df[[kw_column]].resample("1min").mean().ffill(limit=5)
 
         # Apply rolling window aggregation
         if demand_agg == Agg.MAX:
-            power_rolled = power_1min.rolling("30T", min_periods=1).max()
+            power_rolled = power_1min.rolling("30min", min_periods=1).max()
         elif demand_agg == Agg.MEAN:
-            power_rolled = power_1min.rolling("30T", min_periods=1).mean()
+            power_rolled = power_1min.rolling("30min", min_periods=1).mean()
         else:
             raise ValueError(f"Invalid value for demand_agg: '{demand_agg}'")
 
         # Resample the rolled power data to 30-minute intervals
-        demand_resampled = power_rolled.resample("30T").max()
+        demand_resampled = power_rolled.resample("30min").max()
     else:
         demand_resampled = pd.DataFrame()
 
@@ -98,7 +116,7 @@ def get_incentive_kva(
     kva_series = df[kva_column].astype(float)
     
     # Resample to 1 min intervals with forward-fil capped at 5 minutes
-    kva_1min = kva_series.resample("1T").mean().ffill(limit=5)
+    kva_1min = kva_series.resample("1min").mean().ffill(limit=5)
 
     # rolling average over the specified window
     rolling_avg = kva_1min.rolling(
@@ -0,0 +1,171 @@
+"""
+Non-blocking, structured logging shared by the core engine, its services and
+the legacy billing system.
+
+:func:`configure_logging` puts a single queue handler on the root logger, so
+a logging call only enqueues the record. Formatting and file or stream I/O
+happen on a :class:`logging.handlers.QueueListener` thread. Unlike the
+stock ``QueueHandler``, records are enqueued unformatted, so ``%``-style
+arguments are only rendered by the listener (pass immutable arguments).
+
+Helpers for hot paths, all of which cost one ``isEnabledFor`` check when
+their level is off:
+
+  * :func:`log_event` logs a message with structured ``fields`` (rendered
+    as ``key=value`` pairs, or as JSON lines with ``LOG_FORMAT=json``);
+  * :func:`stage` times a block and logs it at DEBUG;
+  * :class:`Sampler` logs one in ``every`` high-volume events (per reading,
+    per interval...) and how many have been seen.
+
+Configuration defaults come from ``LOG_LEVEL``, ``LOG_FORMAT`` (``text`` or
+``json``) and ``LOG_FILE``. After ``fork`` the child gets its own queue and
+listener, so worker processes keep logging.
+"""
+
+import atexit
+import copy
+import itertools
+import json
+import logging
+import os
+import queue
+import time
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Iterator, List, Optional
+
+DEFAULT_FORMAT = "%(asctime)s %(levelname)s %(name)s %(message)s"
+
+_handler: Optional[QueueHandler] = None
+_listener: Optional[QueueListener] = None
+_targets: List[logging.Handler] = []
+
+
+class KeyValueFormatter(logging.Formatter):
+    """The usual text format with any structured fields appended as ``key=value``."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            line += ' ' + ' '.join(f"{k}={v}" for k, v in fields.items())
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message and fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        doc = {
+            'ts': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        doc.update(getattr(record, 'fields', None) or {})
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            doc['exc'] = record.exc_text
+        return json.dumps(doc, default=str)
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """Enqueue records unformatted; the listener thread renders them."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        if record.exc_info:
+            # Tracebacks can't wait: the frames may be gone by the time the listener runs
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _start_listener() -> None:
+    global _listener
+    _handler.queue = queue.SimpleQueue()
+    _listener = QueueListener(_handler.queue, *_targets, respect_handler_level=True)
+    _listener.start()
+
+
+def stop_logging() -> None:
+    """Flush queued records and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def configure_logging(level: Optional[str] = None, fmt: Optional[str] = None, filename: Optional[str] = None,
+                      structured: Optional[bool] = None) -> None:
+    """
+    Route all logging through a queue to a stream (or ``filename``) handler.
+
+    Safe to call more than once; later calls replace the targets.
+    """
+    global _handler
+    level = level or os.getenv("LOG_LEVEL", "INFO")
+    filename = filename or os.getenv("LOG_FILE")
+    if structured is None:
+        structured = os.getenv("LOG_FORMAT", "text").lower() == "json"
+
+    target = logging.FileHandler(filename) if filename else logging.StreamHandler()
+    target.setFormatter(JsonFormatter() if structured else KeyValueFormatter(fmt or DEFAULT_FORMAT))
+    stop_logging()
+    for old in _targets:
+        old.close()
+    _targets[:] = [target]
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    if _handler is None:
+        _handler = _DeferredQueueHandler(queue.SimpleQueue())
+        root.addHandler(_handler)
+        atexit.register(stop_logging)
+        os.register_at_fork(after_in_child=lambda: _handler and _listener and _start_listener())
+    _start_listener()
+
+
+def log_event(logger: logging.Logger, level: int, message: str, *args: Any, **fields: Any) -> None:
+    """Log ``message % args`` with structured ``fields``, if ``level`` is enabled."""
+    if logger.isEnabledFor(level):
+        logger.log(level, message, *args, extra={'fields': fields})
+
+
+@contextmanager
+def stage(logger: logging.Logger, name: str, **fields: Any) -> Iterator[dict]:
+    """
+    Time a block and log it at DEBUG with ``fields``. The yielded dict can
+    collect more fields inside the block. Costs nothing when DEBUG is off.
+    """
+    if not logger.isEnabledFor(logging.DEBUG):
+        yield fields
+        return
+    started = time.perf_counter()
+    try:
+        yield fields
+    finally:
+        fields['ms'] = round((time.perf_counter() - started) * 1000, 3)
+        logger.debug("stage %s", name, extra={'fields': fields})
+
+
+class Sampler:
+    """Log one in ``every`` events of a kind, with the number seen so far."""
+
+    def __init__(self, logger: logging.Logger, every: int = 1000, level: int = logging.DEBUG):
+        self.logger = logger
+        self.every = every
+        self.level = level
+        self._count = itertools.count()
+
+    def enabled(self) -> bool:
+        return self.logger.isEnabledFor(self.level)
+
+    def log(self, message: str, *args: Any, **fields: Any) -> None:
+        if not self.logger.isEnabledFor(self.level):
+            return
+        n = next(self._count)
+        if n % self.every == 0:
+            fields.update(sampled_every=self.every, seen=n + 1)
+            self.logger.log(self.level, message, *args, extra={'fields': fields})
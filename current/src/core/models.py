@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, Text, Date, DateTime, Numeric, ForeignKey, JSON
+from sqlalchemy import Column, Integer, BigInteger, Text, Date, DateTime, Numeric, ForeignKey, Index, JSON
 from sqlalchemy.orm import declarative_base, relationship
 from sqlalchemy.dialects.postgresql import JSONB
 
@@ -46,6 +46,7 @@ class TariffVersion(Base):
     effective_from = Column(Date, nullable=False)
     effective_to = Column(Date)
     created_at = Column(DateTime)
+    content_hash = Column(Text)
 
     plan = relationship("TariffPlan", back_populates="versions")
     calc_runs = relationship("CalcRun", back_populates="tariff_version")
@@ -69,6 +70,22 @@ class MeterReading(Base):
 
     customer = relationship("Customer", back_populates="meter_readings")
 
+    # Ingestion upserts on it (data/load_sample_meter_data.py)
+    __table_args__ = (Index("ix_meter_readings_customer_ts", "customer_id", "timestamp", unique=True),)
+
+class MeterReadingChange(Base):
+    __tablename__ = "meter_reading_change"
+    id = Column(BigInteger, primary_key=True)
+    customer_id = Column(Integer, ForeignKey("customer.id", ondelete="CASCADE"), nullable=False)
+    day_from = Column(Date, nullable=False)
+    day_to = Column(Date, nullable=False)  # inclusive
+    recorded_at = Column(DateTime)
+    claimed_at = Column(DateTime)
+    # Ingestion inserts change rows with plain SQL
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    last_error = Column(Text)
+    processed_at = Column(DateTime)
+
 class CalcRun(Base):
     __tablename__ = "calc_runs"
     id = Column(Integer, primary_key=True)
@@ -78,6 +95,11 @@ class CalcRun(Base):
     finished_at = Column(DateTime)
     status = Column(Text)
     result_summary_json = Column(JSONB)  # will store breakdown and checksum
+    attempts = Column(Integer, nullable=False, default=0)
+    available_at = Column(DateTime)  # earliest time a pending run may be claimed
+    last_error = Column(Text)
+    period_start = Column(DateTime)
+    period_end = Column(DateTime)
 
     tariff_version = relationship("TariffVersion", back_populates="calc_runs")
     customer = relationship("Customer", back_populates="calc_runs")
@@ -92,3 +114,62 @@ class Invoice(Base):
     total_amount = Column(Numeric(12,2), nullable=False)
 
     customer = relationship("Customer", back_populates="invoices")
+
+class BillRun(Base):
+    __tablename__ = "bill_run"
+    id = Column(Integer, primary_key=True)
+    period_start = Column(DateTime, nullable=False)
+    period_end = Column(DateTime, nullable=False)
+    shard_count = Column(Integer, nullable=False)
+    status = Column(Text)
+    created_at = Column(DateTime)
+    finished_at = Column(DateTime)
+
+    shards = relationship("BillRunShard", back_populates="bill_run")
+
+class BillRunShard(Base):
+    __tablename__ = "bill_run_shard"
+    id = Column(Integer, primary_key=True)
+    bill_run_id = Column(Integer, ForeignKey("bill_run.id", ondelete="CASCADE"), nullable=False)
+    shard_no = Column(Integer, nullable=False)
+    hash_from = Column(BigInteger, nullable=False)  # inclusive
+    hash_to = Column(BigInteger, nullable=False)  # exclusive
+    status = Column(Text)
+    lease_owner = Column(Text)
+    lease_expires_at = Column(DateTime)
+    last_customer_id = Column(Integer, nullable=False, default=0)  # checkpoint
+    customers_total = Column(Integer, nullable=False, default=0)
+    customers_done = Column(Integer, nullable=False, default=0)
+    bills_done = Column(Integer, nullable=False, default=0)
+    bills_failed = Column(Integer, nullable=False, default=0)
+    started_at = Column(DateTime)
+    updated_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    last_error = Column(Text)
+
+    bill_run = relationship("BillRun", back_populates="shards")
+
+class CalcRunLine(Base):
+    __tablename__ = "calc_run_line"
+    id = Column(BigInteger, primary_key=True)
+    calc_run_id = Column(Integer, ForeignKey("calc_runs.id", ondelete="CASCADE"), nullable=False)
+    component_id = Column(Text, nullable=False)
+    category = Column(Text)
+    units_used = Column(Numeric(14,4))
+    unit_label = Column(Text)
+    cost = Column(Numeric(14,4), nullable=False)
+
+class RevenueMonthly(Base):
+    __tablename__ = "revenue_monthly"
+    month = Column(Date, primary_key=True)
+    tariff_plan_id = Column(Integer, primary_key=True)
+    category = Column(Text, primary_key=True)
+    component_id = Column(Text, primary_key=True)
+    bills = Column(Integer, nullable=False)
+    units_used = Column(Numeric(16,4))
+    cost = Column(Numeric(16,4), nullable=False)
+
+class RevenueDirtyMonth(Base):
+    __tablename__ = "revenue_dirty_month"
+    month = Column(Date, primary_key=True)
+    marked_at = Column(DateTime)
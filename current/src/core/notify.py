@@ -0,0 +1,139 @@
+"""
+Cross-process cache invalidation over PostgreSQL ``LISTEN``/``NOTIFY``.
+
+Triggers on ``tariff_plan``, ``tariff_versions`` and ``market_op_fees``
+(``docker/db/initdb/01_schema.sql``) send a small JSON payload on the
+``cache_invalidation`` channel for every changed row, in the committing
+transaction, so listeners never see uncommitted changes:
+
+    {"table": "tariff_versions", "op": "INSERT", "id": 42, "tariff_plan_ids": [3]}
+
+``tariff_plan_ids`` lists the plan before and after the change (the row's
+own id for ``tariff_plan``). ``TRUNCATE`` sends ``op`` only.
+
+Caches register a handler per table with :func:`subscribe`. A
+:class:`CacheListener` thread per process holds one dedicated connection to
+the primary (replicas do not relay notifications) and calls the handlers.
+When the connection is lost, and again once it is re-established, handlers
+get ``op="RESET"``: anything may have changed in between, so they drop
+everything for that table.
+"""
+
+import json
+import logging
+import select
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+CHANNEL = "cache_invalidation"
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[Dict[str, Any]], None]
+
+_handlers: Dict[str, List[Handler]] = {}
+_listener: Optional["CacheListener"] = None
+_listener_lock = threading.Lock()
+
+
+def subscribe(table: str, handler: Handler) -> None:
+    """Call ``handler(event)`` for every change notified for ``table``."""
+    _handlers.setdefault(table, []).append(handler)
+
+
+def dispatch(event: Dict[str, Any]) -> None:
+    """Pass one event to the handlers of its table; a failing handler doesn't stop the others."""
+    for handler in _handlers.get(event.get('table'), []):
+        try:
+            handler(event)
+        except Exception:
+            logger.exception("cache invalidation handler %r failed for %s", handler, event)
+
+
+def reset_all() -> None:
+    """Tell every handler to drop everything."""
+    for table in list(_handlers):
+        dispatch({'table': table, 'op': 'RESET'})
+
+
+class CacheListener(threading.Thread):
+    """Daemon thread that LISTENs on :data:`CHANNEL` and dispatches notifications."""
+
+    def __init__(self, engine, poll_timeout: float = 5.0, max_backoff: float = 30.0):
+        super().__init__(name="cache-listener", daemon=True)
+        self.engine = engine
+        self.poll_timeout = poll_timeout
+        self.max_backoff = max_backoff
+        self.connected = threading.Event()
+        self._stopped = threading.Event()
+
+    def _connect(self):
+        fairy = self.engine.raw_connection()
+        # Take the connection out of the pool: it stays open, in autocommit, for this thread only
+        fairy.detach()
+        conn = fairy.connection
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(f"LISTEN {CHANNEL}")
+        return conn
+
+    def _drain(self, conn) -> None:
+        conn.poll()
+        while conn.notifies:
+            note = conn.notifies.pop(0)
+            try:
+                event = json.loads(note.payload)
+            except ValueError:
+                logger.warning("ignoring malformed %s payload: %r", CHANNEL, note.payload)
+                continue
+            dispatch(event)
+
+    def run(self) -> None:
+        backoff = 1.0
+        while not self._stopped.is_set():
+            conn = None
+            try:
+                conn = self._connect()
+                # Changes committed before LISTEN took effect were never notified
+                reset_all()
+                self.connected.set()
+                backoff = 1.0
+                logger.info("listening on %s", CHANNEL)
+                while not self._stopped.is_set():
+                    if select.select([conn], [], [], self.poll_timeout)[0]:
+                        self._drain(conn)
+            except Exception as e:
+                if self._stopped.is_set():
+                    break
+                logger.warning("%s listener lost its connection: %s; retrying in %.0fs", CHANNEL, e, backoff)
+                self.connected.clear()
+                reset_all()
+                self._stopped.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+        self.connected.clear()
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+
+def start_listener(engine=None) -> CacheListener:
+    """Start this process's listener (once); ``engine`` defaults to the primary."""
+    global _listener
+    with _listener_lock:
+        if _listener is None or not _listener.is_alive():
+            if engine is None:
+                from .database import engine
+            _listener = CacheListener(engine)
+            _listener.start()
+        return _listener
+
+
+def listening() -> bool:
+    """True while this process's listener holds a connection, so notifications arrive."""
+    return _listener is not None and _listener.connected.is_set()
@@ -0,0 +1,158 @@
+"""
+Compact, array-backed meter readings shared by the engine, its services and
+ingestion.
+
+A :class:`ReadingSeries` holds one customer's ``(timestamp, kwh)`` readings
+as two contiguous arrays: int64 local wall-clock seconds since the epoch
+(``meter_reading.timestamp`` is a naive local ``TIMESTAMP``) and float64 kWh,
+16 bytes a reading instead of a tuple with a ``datetime`` and a ``Decimal``.
+Readings are kept ordered by timestamp, so:
+
+  * :meth:`ReadingSeries.between` and slicing return views, without copying;
+  * :attr:`ReadingSeries.timestamps`, :meth:`ReadingSeries.wall_minutes` and
+    :meth:`ReadingSeries.to_pandas` share the arrays' memory;
+  * :meth:`ReadingSeries.to_bytes` is a small header followed by the raw
+    little-endian arrays, which :meth:`ReadingSeries.from_bytes` wraps in
+    place. Pickling (e.g. to and from a process pool) uses the same format.
+
+Iterating still yields ``(datetime, kwh)`` pairs, so code written against
+query rows keeps working; :func:`as_series` lets consumers take either.
+"""
+
+import struct
+from datetime import datetime
+from typing import Iterable, Optional, Sequence
+
+import numpy as np
+
+from .services.tzindex import DEFAULT_TZ, utc_to_wall
+
+# magic, reading count, customer id (-1 for none)
+_HEADER = struct.Struct('<4sqq')
+_MAGIC = b'RDS1'
+_EPOCH = np.dtype('<i8')
+_KWH = np.dtype('<f8')
+
+
+def _seconds(ts: datetime) -> int:
+    """Wall-clock epoch seconds of a naive (local) datetime."""
+    return int(np.datetime64(ts, 's').astype(np.int64))
+
+
+class ReadingSeries:
+    """Readings as epoch-second and kWh arrays; a bill's are one customer's, ordered by timestamp."""
+
+    __slots__ = ('epoch', 'kwh', 'customer_id')
+
+    def __init__(self, epoch, kwh, customer_id: Optional[int] = None) -> None:
+        # Already int64/float64 and contiguous (e.g. views from a slice) is not copied
+        self.epoch = np.ascontiguousarray(epoch, dtype=np.int64)
+        self.kwh = np.ascontiguousarray(kwh, dtype=np.float64)
+        if self.epoch.ndim != 1 or self.epoch.shape != self.kwh.shape:
+            raise ValueError(f"epoch and kwh must be 1-D and the same length, "
+                             f"got {self.epoch.shape} and {self.kwh.shape}")
+        self.customer_id = customer_id
+
+    @classmethod
+    def from_rows(cls, rows: Iterable, customer_id: Optional[int] = None,
+                  tz_name: str = DEFAULT_TZ) -> 'ReadingSeries':
+        """
+        Build from ``(timestamp, kwh)`` rows. Naive timestamps are local wall
+        time; tz-aware ones are converted into ``tz_name``.
+        """
+        rows = list(rows)
+        if not rows:
+            return cls(np.zeros(0, dtype=np.int64), np.zeros(0), customer_id)
+        stamps = [r[0] for r in rows]
+        if getattr(stamps[0], 'tzinfo', None) is None:
+            epoch = np.array(stamps, dtype='datetime64[s]').astype(np.int64)
+        else:
+            utc = np.fromiter((int(ts.timestamp()) for ts in stamps), dtype=np.int64, count=len(stamps))
+            epoch = utc_to_wall(utc, tz_name)
+        kwh = np.fromiter((float(r[1]) for r in rows), dtype=np.float64, count=len(rows))
+        return cls(epoch, kwh, customer_id)
+
+    @classmethod
+    def from_frame(cls, frame, timestamp_column: str = 'timestamp', kwh_column: str = 'kwh',
+                   customer_id: Optional[int] = None, tz_name: str = DEFAULT_TZ) -> 'ReadingSeries':
+        """Build from a DataFrame's timestamp and kWh columns, keeping the frame's row order."""
+        stamps = frame[timestamp_column]
+        if getattr(stamps.dtype, 'tz', None) is not None:
+            stamps = stamps.dt.tz_convert(tz_name).dt.tz_localize(None)
+        return cls(stamps.to_numpy(dtype='datetime64[s]').view(np.int64),
+                   frame[kwh_column].to_numpy(dtype=np.float64), customer_id)
+
+    @classmethod
+    def concat(cls, parts: Sequence['ReadingSeries'], customer_id: Optional[int] = None) -> 'ReadingSeries':
+        """Join series end to end (a copy); ordering across parts is the caller's."""
+        if not parts:
+            return cls(np.zeros(0, dtype=np.int64), np.zeros(0), customer_id)
+        return cls(np.concatenate([p.epoch for p in parts]), np.concatenate([p.kwh for p in parts]), customer_id)
+
+    def __len__(self) -> int:
+        return len(self.epoch)
+
+    def __iter__(self):
+        return zip(self.timestamps.tolist(), self.kwh.tolist())
+
+    def __getitem__(self, key):
+        """A reading as ``(datetime, kwh)``, or a view of the series for a slice."""
+        if isinstance(key, slice):
+            if key.step not in (None, 1):
+                raise ValueError("ReadingSeries slices must be contiguous")
+            return ReadingSeries(self.epoch[key], self.kwh[key], self.customer_id)
+        return self.timestamps[key].item(), float(self.kwh[key])
+
+    def __repr__(self) -> str:
+        span = f"{self.timestamps[0]}..{self.timestamps[-1]}" if len(self) else "empty"
+        return f"ReadingSeries(customer_id={self.customer_id}, n={len(self)}, {span})"
+
+    def __reduce__(self):
+        return ReadingSeries.from_bytes, (self.to_bytes(),)
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        """The epoch array viewed as ``datetime64[s]`` (no copy)."""
+        return self.epoch.view('datetime64[s]')
+
+    def wall_minutes(self) -> np.ndarray:
+        """Local wall-clock minutes since the epoch, as expected by :mod:`timeband`."""
+        return self.epoch // 60
+
+    def between(self, start: datetime, end: datetime) -> 'ReadingSeries':
+        """The readings in [start, end), as a view."""
+        lo, hi = np.searchsorted(self.epoch, [_seconds(start), _seconds(end)], side='left')
+        return self[lo:hi]
+
+    def to_pandas(self, name: str = 'kwh'):
+        """A kWh Series on a naive DatetimeIndex, sharing this series' memory."""
+        import pandas as pd
+
+        index = pd.DatetimeIndex(self.timestamps, copy=False, name='timestamp')
+        return pd.Series(self.kwh, index=index, name=name, copy=False)
+
+    def to_bytes(self) -> bytes:
+        """Header, then the epoch and kWh arrays as little-endian int64/float64."""
+        cid = -1 if self.customer_id is None else self.customer_id
+        return b''.join((_HEADER.pack(_MAGIC, len(self), cid),
+                         self.epoch.astype(_EPOCH, copy=False).tobytes(),
+                         self.kwh.astype(_KWH, copy=False).tobytes()))
+
+    @classmethod
+    def from_bytes(cls, data) -> 'ReadingSeries':
+        """Read :meth:`to_bytes` output; the arrays are read-only views of ``data``."""
+        magic, n, cid = _HEADER.unpack_from(data)
+        if magic != _MAGIC:
+            raise ValueError("not a serialised ReadingSeries")
+        if len(data) != _HEADER.size + 16 * n:
+            raise ValueError(f"serialised ReadingSeries truncated: {len(data)} bytes for {n} readings")
+        epoch = np.frombuffer(data, dtype=_EPOCH, count=n, offset=_HEADER.size)
+        kwh = np.frombuffer(data, dtype=_KWH, count=n, offset=_HEADER.size + 8 * n)
+        return cls(epoch, kwh, None if cid == -1 else cid)
+
+
+def as_series(readings, tz_name: str = DEFAULT_TZ) -> ReadingSeries:
+    """``readings`` if already a :class:`ReadingSeries`, else built from ``(timestamp, kwh)`` rows."""
+    if isinstance(readings, ReadingSeries):
+        return readings
+    return ReadingSeries.from_rows(readings, tz_name=tz_name)
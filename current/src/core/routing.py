@@ -0,0 +1,183 @@
+"""
+Read/write routing between the primary database and a read replica.
+
+:class:`RoutingSession` sends a statement to the replica only when all of
+the following hold:
+
+  * it is a plain SELECT (no ``FOR UPDATE``) touching only the pricing
+    input tables in ``REPLICA_TABLES`` (meter readings, tariffs, customers,
+    regions, market fees). Queue, bill-run and calc_runs state always
+    comes from the primary;
+  * the session has not written in its current transaction, so a
+    transaction reads its own writes;
+  * the replica has replayed the primary's WAL up to the session's
+    freshness mark, if it has one. The mark is set automatically when a
+    transaction that wrote commits, and explicitly with
+    :func:`require_fresh_reads` before reads that must see data written
+    elsewhere, such as readings that another process has just ingested;
+  * the replica's replay lag is at most ``max_lag`` seconds, checked at
+    most once per ``LAG_CHECK_SECONDS`` per replica.
+
+Everything else, including every statement when no replica is configured,
+goes to the primary. Lag checks only apply to PostgreSQL. Another backend
+counts as caught up, as does a PostgreSQL server that is not in recovery,
+for example a second standalone instance used in tests.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.util import find_tables
+
+REPLICA_TABLES = frozenset({
+    'meter_reading', 'tariff_versions', 'tariff_plan', 'customer', 'region', 'market_op_fees',
+})
+DEFAULT_MAX_LAG = 5.0
+LAG_CHECK_SECONDS = 1.0
+
+_REPLAY_LAG = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() THEN 0 "
+    "WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+_REPLAYED = text("SELECT NOT pg_is_in_recovery() OR pg_last_wal_replay_lsn() >= CAST(:lsn AS pg_lsn)")
+_CURRENT_LSN = text("SELECT CAST(pg_current_wal_lsn() AS text)")
+
+# engine -> (checked_at, lag seconds or None if the replica was unreachable)
+_lag_cache: Dict[Engine, tuple] = {}
+_lag_lock = threading.Lock()
+
+
+def _is_postgres(engine: Engine) -> bool:
+    return engine.dialect.name == 'postgresql'
+
+
+def replica_lag(replica: Engine) -> Optional[float]:
+    """Replay lag in seconds, cached for ``LAG_CHECK_SECONDS``; None if the replica is unreachable."""
+    if not _is_postgres(replica):
+        return 0.0
+    now = time.monotonic()
+    with _lag_lock:
+        cached = _lag_cache.get(replica)
+        if cached and now - cached[0] < LAG_CHECK_SECONDS:
+            return cached[1]
+    try:
+        with replica.connect() as conn:
+            lag = float(conn.execute(_REPLAY_LAG).scalar_one())
+    except Exception:
+        lag = None
+    with _lag_lock:
+        _lag_cache[replica] = (now, lag)
+    return lag
+
+
+def primary_lsn(primary: Engine) -> Optional[str]:
+    """The primary's current WAL position, or None when not on PostgreSQL."""
+    if not _is_postgres(primary):
+        return None
+    with primary.connect() as conn:
+        return conn.execute(_CURRENT_LSN).scalar_one()
+
+
+def replica_replayed(replica: Engine, lsn: str) -> bool:
+    """Whether the replica has replayed the primary's WAL up to ``lsn``."""
+    if not _is_postgres(replica):
+        return True
+    try:
+        with replica.connect() as conn:
+            return bool(conn.execute(_REPLAYED, {'lsn': lsn}).scalar_one())
+    except Exception:
+        return False
+
+
+class RoutingSession(Session):
+    """Session that sends eligible reads to ``replica`` and everything else to ``primary``."""
+
+    def __init__(self, primary: Engine, replica: Optional[Engine] = None,
+                 max_lag: float = DEFAULT_MAX_LAG, **kwargs):
+        super().__init__(**kwargs)
+        self.primary_engine = primary
+        self.replica_engine = replica if replica is not primary else None
+        self.max_lag = max_lag
+        self._force_primary = 0
+        # Wrote in the current transaction
+        self._wrote = False
+        # WAL position the replica must reach before this session reads from it
+        self._min_lsn: Optional[str] = None
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self._wants_replica(clause):
+            return self.replica_engine
+        if clause is None or not getattr(clause, 'is_select', False):
+            # Flushes and DML
+            self._wrote = True
+        return self.primary_engine
+
+    def _wants_replica(self, clause) -> bool:
+        if self.replica_engine is None or self._force_primary or self._wrote or clause is None:
+            return False
+        if not getattr(clause, 'is_select', False) or getattr(clause, '_for_update_arg', None) is not None:
+            return False
+        tables = {t.name for t in find_tables(clause, include_joins=True, include_aliases=True)}
+        if not tables or not tables <= REPLICA_TABLES:
+            return False
+        lag = replica_lag(self.replica_engine)
+        if lag is None or lag > self.max_lag:
+            return False
+        if self._min_lsn is not None:
+            if not replica_replayed(self.replica_engine, self._min_lsn):
+                return False
+            self._min_lsn = None
+        return True
+
+    @contextmanager
+    def primary(self) -> Iterator['RoutingSession']:
+        """Send every statement in the block to the primary."""
+        self._force_primary += 1
+        try:
+            yield self
+        finally:
+            self._force_primary -= 1
+
+    def require_fresh_reads(self) -> None:
+        """Make later replica reads wait for everything committed on the primary so far."""
+        if self.replica_engine is not None:
+            self._min_lsn = primary_lsn(self.primary_engine) or self._min_lsn
+
+    def commit(self) -> None:
+        # Flush first: objects only added so far are written by the commit
+        self.flush()
+        wrote = self._wrote
+        super().commit()
+        self._wrote = False
+        if wrote:
+            self.require_fresh_reads()
+
+    def rollback(self) -> None:
+        super().rollback()
+        self._wrote = False
+
+    def close(self) -> None:
+        super().close()
+        self._wrote = False
+
+
+@contextmanager
+def use_primary(db: Session) -> Iterator[Session]:
+    """Route ``db`` to the primary inside the block; a no-op for plain sessions."""
+    if isinstance(db, RoutingSession):
+        with db.primary():
+            yield db
+    else:
+        yield db
+
+
+def require_fresh_reads(db: Session) -> None:
+    """See :meth:`RoutingSession.require_fresh_reads`; a no-op for plain sessions."""
+    if isinstance(db, RoutingSession):
+        db.require_fresh_reads()
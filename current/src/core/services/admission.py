@@ -0,0 +1,200 @@
+"""
+Admission control for API endpoints, per endpoint class.
+
+Each class ("calc" for recalculations, "read" for stored-result lookups)
+has an :class:`AdmissionLimiter`. A limiter admits a request when it has a
+free slot and enough cost budget, where cost is the estimated number of
+meter readings the request will scan (:func:`estimate_readings`). Requests
+that cannot run yet wait in a bounded FIFO queue. A request is rejected
+straight away with 429 when the queue is full, and with 503 when it
+waited ``max_wait`` seconds without being admitted. Both rejections carry
+a ``retry_after`` estimated from recent service times.
+
+The calc limit defaults to less than the SQLAlchemy pool size, so a burst
+of long recalculations leaves connections (and threadpool workers) for
+cheap reads. Limits come from the environment:
+
+    ADMISSION_<CLASS>_CONCURRENCY, ADMISSION_<CLASS>_QUEUE,
+    ADMISSION_<CLASS>_MAX_WAIT, ADMISSION_<CLASS>_MAX_COST
+"""
+
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Dict, Iterator, Optional
+
+DEFAULT_INTERVAL_MINUTES = 30
+# Smoothing for the seconds-per-reading estimate behind Retry-After
+EWMA_ALPHA = 0.2
+MIN_RETRY_AFTER = 1
+MAX_RETRY_AFTER = 60
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is not admitted; maps to 429 or 503 with Retry-After."""
+
+    def __init__(self, limiter: str, status_code: int, retry_after: int, reason: str):
+        super().__init__(f"{limiter}: {reason}")
+        self.limiter = limiter
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+def estimate_readings(start: datetime, end: datetime, customers: int = 1,
+                      interval_minutes: int = DEFAULT_INTERVAL_MINUTES) -> int:
+    """Expected reading count for ``customers`` over [start, end) at one reading per interval."""
+    minutes = max((end - start).total_seconds() / 60.0, 0.0)
+    return max(1, math.ceil(minutes / interval_minutes)) * max(1, customers)
+
+
+class AdmissionLimiter:
+    """Bounded-concurrency, cost-budgeted limiter with a bounded FIFO wait queue."""
+
+    def __init__(self, name: str, max_concurrent: int, max_queue: int, max_wait: float,
+                 max_cost: Optional[int] = None):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.max_cost = max_cost
+        self._cond = threading.Condition()
+        self._queue: deque = deque()
+        self._in_flight = 0
+        self._cost_in_flight = 0
+        self._queued_cost = 0
+        self._seconds_per_reading = None
+        self._counters = {'admitted': 0, 'queued': 0, 'rejected_queue_full': 0, 'rejected_timeout': 0}
+
+    def _fits(self, cost: int) -> bool:
+        if self._in_flight >= self.max_concurrent:
+            return False
+        # An oversized request still runs, alone
+        return self.max_cost is None or self._in_flight == 0 or self._cost_in_flight + cost <= self.max_cost
+
+    def _retry_after(self, cost: int) -> int:
+        per_reading = self._seconds_per_reading or 0.0
+        backlog = self._cost_in_flight + self._queued_cost + cost
+        seconds = per_reading * backlog / max(self.max_concurrent, 1)
+        return int(min(max(math.ceil(seconds), MIN_RETRY_AFTER), MAX_RETRY_AFTER))
+
+    def acquire(self, cost: int = 1) -> None:
+        """Block until admitted, or raise :class:`AdmissionRejected`."""
+        with self._cond:
+            if not self._queue and self._fits(cost):
+                self._admit(cost)
+                return
+            if len(self._queue) >= self.max_queue:
+                self._counters['rejected_queue_full'] += 1
+                raise AdmissionRejected(self.name, 429, self._retry_after(cost), "queue full")
+            ticket = object()
+            self._queue.append(ticket)
+            self._queued_cost += cost
+            self._counters['queued'] += 1
+            deadline = time.monotonic() + self.max_wait
+            try:
+                # FIFO: only the head of the queue may take a free slot
+                while not (self._queue[0] is ticket and self._fits(cost)):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._counters['rejected_timeout'] += 1
+                        raise AdmissionRejected(self.name, 503, self._retry_after(cost), "timed out waiting")
+                    self._cond.wait(remaining)
+            finally:
+                self._queue.remove(ticket)
+                self._queued_cost -= cost
+                # The new head may fit now that this ticket has gone
+                self._cond.notify_all()
+            self._admit(cost)
+
+    def _admit(self, cost: int) -> None:
+        self._in_flight += 1
+        self._cost_in_flight += cost
+        self._counters['admitted'] += 1
+
+    def release(self, cost: int = 1, elapsed: Optional[float] = None) -> None:
+        """Free the slot taken by :meth:`acquire`; ``elapsed`` feeds the Retry-After estimate."""
+        with self._cond:
+            self._in_flight -= 1
+            self._cost_in_flight -= cost
+            if elapsed is not None:
+                sample = elapsed / max(cost, 1)
+                if self._seconds_per_reading is None:
+                    self._seconds_per_reading = sample
+                else:
+                    self._seconds_per_reading += EWMA_ALPHA * (sample - self._seconds_per_reading)
+            self._cond.notify_all()
+
+    @contextmanager
+    def admit(self, cost: int = 1) -> Iterator[None]:
+        """Hold a slot for the duration of the block."""
+        self.acquire(cost)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(cost, time.monotonic() - started)
+
+    def hold(self, cost: int = 1) -> Callable[[], None]:
+        """
+        :meth:`acquire` for work that outlives the call, such as a streamed
+        response. Returns a release function that is safe to call from
+        several cleanup paths; only the first call frees the slot.
+        """
+        self.acquire(cost)
+        started = time.monotonic()
+        once = threading.Lock()
+
+        def release() -> None:
+            if once.acquire(blocking=False):
+                self.release(cost, time.monotonic() - started)
+
+        return release
+
+    def snapshot(self) -> Dict[str, object]:
+        """Current gauges and cumulative counters."""
+        with self._cond:
+            return {
+                'max_concurrent': self.max_concurrent,
+                'max_queue': self.max_queue,
+                'max_cost': self.max_cost,
+                'in_flight': self._in_flight,
+                'cost_in_flight': self._cost_in_flight,
+                'queue_depth': len(self._queue),
+                'queued_cost': self._queued_cost,
+                'seconds_per_reading': self._seconds_per_reading,
+                **self._counters,
+            }
+
+
+def _limiter_from_env(name: str, concurrency: int, queue: int, max_wait: float,
+                      max_cost: Optional[int] = None) -> AdmissionLimiter:
+    prefix = f"ADMISSION_{name.upper()}_"
+    env_cost = os.getenv(prefix + "MAX_COST")
+    return AdmissionLimiter(
+        name,
+        max_concurrent=int(os.getenv(prefix + "CONCURRENCY", concurrency)),
+        max_queue=int(os.getenv(prefix + "QUEUE", queue)),
+        max_wait=float(os.getenv(prefix + "MAX_WAIT", max_wait)),
+        max_cost=int(env_cost) if env_cost else max_cost,
+    )
+
+
+# Defaults fit SQLAlchemy's default pool (5 connections + 10 overflow) and
+# keep running plus queued requests under the 40 threads FastAPI runs sync
+# endpoints on: recalculations get at most 4 connections, so reads always
+# find one.
+LIMITERS: Dict[str, AdmissionLimiter] = {
+    # About two customer-years of half-hourly readings in flight
+    'calc': _limiter_from_env('calc', concurrency=4, queue=8, max_wait=10.0, max_cost=2 * 17520),
+    'read': _limiter_from_env('read', concurrency=10, queue=16, max_wait=2.0),
+}
+
+
+def admission_metrics() -> Dict[str, Dict[str, object]]:
+    """Snapshot of every limiter, keyed by endpoint class."""
+    return {name: limiter.snapshot() for name, limiter in LIMITERS.items()}
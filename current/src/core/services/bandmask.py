@@ -0,0 +1,144 @@
+"""
+Period-level band masks shared across customers.
+
+Every customer on the same tariff in the same billing period shares one
+interval -> usage bucket mapping. :func:`period_band_mask` computes it once
+per (band-set hash, period start, period end, interval length) and keeps it
+in a bounded in-process cache, together with a one-hot matrix so a
+customer's usage buckets are a single dot product against their interval
+vector (and a whole batch is one matrix product).
+
+Slots are labelled by their start, which matches per-reading assignment
+whenever band boundaries fall on the interval grid.
+"""
+
+import hashlib
+import logging
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Any, Tuple, Sequence
+
+import numpy as np
+
+from ..log import Sampler
+from ..readings import as_series
+from .timeband import BUCKETS, band_set_key, bucket_indices_wall
+from .tzindex import DEFAULT_TZ, to_wall_minutes
+
+MAX_CACHED_MASKS = 256
+
+logger = logging.getLogger(__name__)
+# Readings that fall outside the period grid (or belong to no requested customer)
+_dropped = Sampler(logger, every=1000)
+
+_MASKS: "OrderedDict[tuple, Tuple[np.ndarray, np.ndarray]]" = OrderedDict()
+
+
+def _wall_minute(ts: datetime) -> int:
+    return int(np.datetime64(ts, 'm').astype(np.int64))
+
+
+def slot_count(start: datetime, end: datetime, interval_minutes: int = 30) -> int:
+    """Number of interval slots covering [start, end)."""
+    span = _wall_minute(end) - _wall_minute(start)
+    return max(0, -(-span // interval_minutes))
+
+
+def band_set_hash(canonical: Dict[str, Any]) -> str:
+    """Short content hash of a tariff's ``time_bands``."""
+    return hashlib.sha1(band_set_key(canonical).encode()).hexdigest()
+
+
+def period_band_mask(canonical: Dict[str, Any], start: datetime, end: datetime,
+                     interval_minutes: int = 30) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Return ``(bucket_index, one_hot)`` for every slot of [start, end).
+
+    ``bucket_index`` is an int64 array of :data:`timeband.BUCKETS` indices;
+    ``one_hot`` is the matching (slots x len(BUCKETS)) float64 matrix. Both
+    are cached and must be treated as read-only.
+    """
+    key = (band_set_hash(canonical), start, end, interval_minutes)
+    cached = _MASKS.get(key)
+    if cached is not None:
+        _MASKS.move_to_end(key)
+        return cached
+    n_slots = slot_count(start, end, interval_minutes)
+    wall = _wall_minute(start) + np.arange(n_slots, dtype=np.int64) * interval_minutes
+    bucket_index = bucket_indices_wall(wall, canonical)
+    one_hot = np.zeros((n_slots, len(BUCKETS)), dtype=np.float64)
+    one_hot[np.arange(n_slots), bucket_index] = 1.0
+    bucket_index.setflags(write=False)
+    one_hot.setflags(write=False)
+    _MASKS[key] = (bucket_index, one_hot)
+    if len(_MASKS) > MAX_CACHED_MASKS:
+        _MASKS.popitem(last=False)
+    return bucket_index, one_hot
+
+
+def _slot_indices(timestamps, start: datetime, interval_minutes: int, tz_name: str) -> np.ndarray:
+    return (to_wall_minutes(timestamps, tz_name) - _wall_minute(start)) // interval_minutes
+
+
+def _log_dropped(readings, keep: np.ndarray) -> None:
+    if _dropped.enabled() and not keep.all():
+        for i in np.flatnonzero(~keep):
+            _dropped.log("reading outside period grid dropped", reading=readings[i])
+
+
+def interval_vector(readings, start: datetime, end: datetime, interval_minutes: int = 30,
+                    tz_name: str = DEFAULT_TZ) -> np.ndarray:
+    """
+    Sum ``(timestamp, kwh)`` readings (or a :class:`~core.readings.ReadingSeries`)
+    into a per-slot kWh vector for [start, end).
+    """
+    series = as_series(readings, tz_name)
+    n_slots = slot_count(start, end, interval_minutes)
+    if not len(series):
+        return np.zeros(n_slots, dtype=np.float64)
+    slots = (series.wall_minutes() - _wall_minute(start)) // interval_minutes
+    keep = (slots >= 0) & (slots < n_slots)
+    _log_dropped(series, keep)
+    return np.bincount(slots[keep], weights=series.kwh[keep], minlength=n_slots)
+
+
+def interval_matrix(readings, customer_ids: Sequence[int], start: datetime, end: datetime,
+                    interval_minutes: int = 30, tz_name: str = DEFAULT_TZ) -> np.ndarray:
+    """
+    Sum ``(customer_id, timestamp, kwh)`` readings into a (customers x slots)
+    kWh matrix whose rows follow ``customer_ids``. Unknown customers are ignored.
+    """
+    readings = list(readings)
+    n_slots = slot_count(start, end, interval_minutes)
+    n = len(customer_ids)
+    if not readings or n == 0:
+        return np.zeros((n, n_slots), dtype=np.float64)
+    row_of = {cid: i for i, cid in enumerate(customer_ids)}
+    rows = np.fromiter((row_of.get(r[0], -1) for r in readings), dtype=np.int64, count=len(readings))
+    slots = _slot_indices([r[1] for r in readings], start, interval_minutes, tz_name)
+    kwh = np.fromiter((float(r[2]) for r in readings), dtype=np.float64, count=len(readings))
+    keep = (rows >= 0) & (slots >= 0) & (slots < n_slots)
+    _log_dropped(readings, keep)
+    flat = rows[keep] * n_slots + slots[keep]
+    return np.bincount(flat, weights=kwh[keep], minlength=n * n_slots).reshape(n, n_slots)
+
+
+def segment_slots(start: datetime, seg_start: datetime, seg_end: datetime, interval_minutes: int = 30) -> slice:
+    """Return the slice of a period's slots (starting at ``start``) covering one segment."""
+    lo = (_wall_minute(seg_start) - _wall_minute(start)) // interval_minutes
+    return slice(lo, lo + slot_count(seg_start, seg_end, interval_minutes))
+
+
+def usage_from_vectors(vectors: np.ndarray, one_hot: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Turn interval vectors into usage buckets with one matrix product.
+
+    ``vectors`` is (slots,) for one customer or (customers x slots) for a
+    batch; values in the result are floats or arrays accordingly.
+    """
+    sums = vectors @ one_hot
+    usage = {'total_usage': vectors.sum(axis=-1)}
+    usage.update({name: sums[..., i] for i, name in enumerate(BUCKETS)})
+    if np.ndim(vectors) == 1:
+        return {name: float(value) for name, value in usage.items()}
+    return usage
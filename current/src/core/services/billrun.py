@@ -0,0 +1,350 @@
+"""
+Sharded, resumable month-end bill runs.
+
+A bill run prices every customer against every tariff plan active in their
+region for one period. Customers are split into ``shard_count`` hash ranges
+over ``hashint4(customer.id)``, recorded as ``bill_run_shard`` rows. Any
+number of worker processes (on any number of hosts) lease shards with
+``SELECT ... FOR UPDATE SKIP LOCKED``; a lease that is not renewed before
+``lease_expires_at`` may be taken over by another worker.
+
+Within a shard customers are processed in id order and the shard row is
+checkpointed every ``batch_size`` customers (``last_customer_id`` plus
+counters), renewing the lease at the same time. A crashed worker therefore
+loses at most one batch, and re-pricing that batch is harmless because
+:func:`calc.upsert_calc_run` returns the existing row when the checksum and
+period match.
+
+Usage (from ``current/src``):
+
+    python -m core.services.billrun create --start 2025-07-01 --end 2025-08-01 --shards 64
+    python -m core.services.billrun work --run-id 1 --processes 4
+    python -m core.services.billrun status --run-id 1 --watch 10
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import socket
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import select, func, and_, or_, BigInteger
+from sqlalchemy.orm import Session
+
+from ..log import configure_logging
+from ..notify import start_listener
+from ..models import BillRun, BillRunShard, Customer
+from .calc import calculate_bill, fetch_readings, upsert_calc_run
+from .checksum import compute_checksum
+from .revenue import refresh_revenue_summary
+from .resolve import resolver, versions_by_region
+from .worker import now_plus
+
+logger = logging.getLogger(__name__)
+
+# hashint4 returns a signed 32-bit integer
+HASH_MIN = -2 ** 31
+HASH_SPACE = 2 ** 32
+
+DEFAULT_LEASE_SECONDS = 300
+DEFAULT_BATCH_SIZE = 100
+
+
+def _customer_hash():
+    return func.hashint4(Customer.id).cast(BigInteger)
+
+
+def shard_bounds(shard_count: int) -> List[tuple]:
+    """Return ``(hash_from, hash_to)`` half-open ranges covering the hash space."""
+    edges = [HASH_MIN + -(-i * HASH_SPACE // shard_count) for i in range(shard_count + 1)]
+    return list(zip(edges, edges[1:]))
+
+
+def create_bill_run(db: Session, start: datetime, end: datetime, shard_count: int = 64) -> int:
+    """Record a bill run and its shards (with customer counts); returns the run id."""
+    run = BillRun(period_start=start, period_end=end, shard_count=shard_count, status='running',
+                  created_at=func.now())
+    db.add(run)
+    db.flush()
+    shard_no = ((_customer_hash() - HASH_MIN) * shard_count / HASH_SPACE).label('shard_no')
+    counts = dict(db.execute(select(shard_no, func.count()).group_by(shard_no)).all())
+    for i, (hash_from, hash_to) in enumerate(shard_bounds(shard_count)):
+        db.add(BillRunShard(
+            bill_run_id=run.id, shard_no=i, hash_from=hash_from, hash_to=hash_to, status='pending',
+            last_customer_id=0, customers_total=int(counts.get(i, 0)),
+            customers_done=0, bills_done=0, bills_failed=0,
+        ))
+    db.commit()
+    return run.id
+
+
+def active_versions_by_region(db: Session, start: datetime, end: datetime) -> Dict[int, List[int]]:
+    """
+    Map region id -> tariff version ids to bill, one per plan with a version
+    overlapping the period: the version in force on the first day, else the
+    first to take effect. Later versions within the period are picked up by
+    :func:`segments.plan_segments`.
+    """
+    # Rebuilt once per run so a tariff uploaded just before month end is billed
+    resolver.load(db)
+    return versions_by_region(db, start.date(), end.date())
+
+
+def claim_shard(db: Session, bill_run_id: int, owner: str,
+                lease_seconds: int = DEFAULT_LEASE_SECONDS) -> Optional[BillRunShard]:
+    """Lease the next pending shard, or one whose lease has expired."""
+    shard = db.execute(
+        select(BillRunShard).where(
+            BillRunShard.bill_run_id == bill_run_id,
+            or_(
+                BillRunShard.status == 'pending',
+                and_(BillRunShard.status == 'leased', BillRunShard.lease_expires_at < func.now()),
+            ),
+        ).order_by(BillRunShard.shard_no).limit(1).with_for_update(skip_locked=True)
+    ).scalars().first()
+    if shard is None:
+        db.rollback()
+        return None
+    shard.status = 'leased'
+    shard.lease_owner = owner
+    shard.lease_expires_at = now_plus(db, lease_seconds)
+    shard.started_at = func.coalesce(BillRunShard.started_at, func.now())
+    shard.updated_at = func.now()
+    db.commit()
+    db.refresh(shard)
+    return shard
+
+
+def _checkpoint(db: Session, shard_id: int, owner: str, lease_seconds: int, **values) -> bool:
+    """Write shard progress if ``owner`` still holds the lease; returns False if it was lost."""
+    shard = db.execute(
+        select(BillRunShard).where(BillRunShard.id == shard_id).with_for_update()
+    ).scalars().first()
+    if shard is None or shard.status != 'leased' or shard.lease_owner != owner:
+        db.rollback()
+        return False
+    for name, value in values.items():
+        setattr(shard, name, value)
+    shard.updated_at = func.now()
+    if shard.status == 'leased':
+        shard.lease_expires_at = now_plus(db, lease_seconds)
+    db.commit()
+    return True
+
+
+def process_shard(db: Session, shard: BillRunShard, versions: Dict[int, List[int]], owner: str,
+                  batch_size: int = DEFAULT_BATCH_SIZE, lease_seconds: int = DEFAULT_LEASE_SECONDS) -> bool:
+    """
+    Bill the shard's customers from its checkpoint onwards.
+
+    Returns True when the shard is finished, False if the lease was lost to
+    another worker.
+    """
+    run = db.get(BillRun, shard.bill_run_id)
+    start, end = run.period_start, run.period_end
+    run_id, shard_id, shard_no = run.id, shard.id, shard.shard_no
+    hash_from, hash_to = shard.hash_from, shard.hash_to
+    last_id = shard.last_customer_id
+    customers_done, bills_done, bills_failed = shard.customers_done, shard.bills_done, shard.bills_failed
+    last_error = shard.last_error
+    customer_hash = _customer_hash()
+    while True:
+        batch = db.execute(
+            select(Customer.id, Customer.region_id).where(
+                customer_hash >= hash_from, customer_hash < hash_to, Customer.id > last_id,
+            ).order_by(Customer.id).limit(batch_size)
+        ).all()
+        if not batch:
+            return _checkpoint(db, shard_id, owner, lease_seconds, status='completed',
+                               finished_at=func.now(), lease_expires_at=None)
+        for customer_id, region_id in batch:
+            for tariff_version_id in versions.get(region_id, []):
+                try:
+                    readings = fetch_readings(db, customer_id, start, end)
+                    checksum = compute_checksum(db, customer_id, tariff_version_id, start, end, readings=readings)
+                    result = calculate_bill(db, customer_id, tariff_version_id, start, end, readings=readings)
+                    upsert_calc_run(db, customer_id, tariff_version_id, start, end, checksum, result)
+                    bills_done += 1
+                except Exception as exc:
+                    db.rollback()
+                    bills_failed += 1
+                    last_error = f"customer {customer_id} tariff_version {tariff_version_id}: {type(exc).__name__}: {exc}"
+                    logger.warning("bill run %s shard %s: %s", run_id, shard_no, last_error)
+            last_id = customer_id
+            customers_done += 1
+        if not _checkpoint(db, shard_id, owner, lease_seconds, last_customer_id=last_id,
+                           customers_done=customers_done, bills_done=bills_done,
+                           bills_failed=bills_failed, last_error=last_error):
+            logger.warning("bill run %s shard %s: lease lost, stopping", run_id, shard_no)
+            return False
+
+
+def _finish_run_if_done(db: Session, bill_run_id: int) -> None:
+    remaining = db.execute(
+        select(func.count()).select_from(BillRunShard).where(
+            BillRunShard.bill_run_id == bill_run_id, BillRunShard.status != 'completed'
+        )
+    ).scalar_one()
+    if remaining == 0:
+        run = db.get(BillRun, bill_run_id)
+        if run.status != 'completed':
+            run.status = 'completed'
+            run.finished_at = func.now()
+            db.commit()
+            # Month-end totals are wanted as soon as the run is done
+            refresh_revenue_summary(db)
+
+
+def bill_run_progress(db: Session, bill_run_id: int) -> Optional[dict]:
+    """
+    Summarise a run's shards: counts, customers and bills done, throughput
+    since the first lease and an ETA from that throughput.
+    """
+    run = db.get(BillRun, bill_run_id)
+    if run is None:
+        return None
+    until = func.max(BillRunShard.finished_at) if run.status == 'completed' else func.localtimestamp()
+    row = db.execute(
+        select(
+            func.count(),
+            func.count().filter(BillRunShard.status == 'completed'),
+            func.count().filter(BillRunShard.status == 'leased'),
+            func.coalesce(func.sum(BillRunShard.customers_total), 0),
+            func.coalesce(func.sum(BillRunShard.customers_done), 0),
+            func.coalesce(func.sum(BillRunShard.bills_done), 0),
+            func.coalesce(func.sum(BillRunShard.bills_failed), 0),
+            func.extract('epoch', until - func.min(BillRunShard.started_at)),
+        ).where(BillRunShard.bill_run_id == bill_run_id)
+    ).one()
+    shards, completed, leased, total, done, bills, failed, elapsed = row
+    elapsed = float(elapsed or 0.0)
+    rate = done / elapsed if elapsed > 0 else 0.0
+    remaining = max(0, int(total) - int(done))
+    return {
+        'bill_run_id': run.id,
+        'status': run.status,
+        'period_start': str(run.period_start),
+        'period_end': str(run.period_end),
+        'shards': shards,
+        'shards_completed': completed,
+        'shards_leased': leased,
+        'customers_total': int(total),
+        'customers_done': int(done),
+        'bills_done': int(bills),
+        'bills_failed': int(failed),
+        'elapsed_seconds': round(elapsed, 1),
+        'customers_per_second': round(rate, 2),
+        'eta_seconds': round(remaining / rate, 1) if rate > 0 else None,
+    }
+
+
+def run_bill_run_worker(bill_run_id: int, batch_size: int = DEFAULT_BATCH_SIZE,
+                        lease_seconds: int = DEFAULT_LEASE_SECONDS, poll_interval: float = 5.0) -> None:
+    """
+    Lease and process shards of a run until none are left. While other
+    workers still hold leases, keep polling so an expired lease is taken over.
+    """
+    from ..database import engine, read_engine, SessionLocal
+    # Connections inherited across fork must not be shared with the parent
+    engine.dispose()
+    if read_engine is not None:
+        read_engine.dispose()
+    # One cache invalidation listener per process; threads don't survive fork
+    start_listener()
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    db = SessionLocal()
+    try:
+        run = db.get(BillRun, bill_run_id)
+        if run is None:
+            raise SystemExit(f"bill run {bill_run_id} not found")
+        versions = active_versions_by_region(db, run.period_start, run.period_end)
+        while True:
+            shard = claim_shard(db, bill_run_id, owner, lease_seconds)
+            if shard is not None:
+                logger.info("bill run %s: leased shard %s from customer %s",
+                            bill_run_id, shard.shard_no, shard.last_customer_id)
+                process_shard(db, shard, versions, owner, batch_size, lease_seconds)
+                continue
+            _finish_run_if_done(db, bill_run_id)
+            leased = db.execute(
+                select(func.count()).select_from(BillRunShard).where(
+                    BillRunShard.bill_run_id == bill_run_id, BillRunShard.status == 'leased'
+                )
+            ).scalar_one()
+            db.rollback()
+            if leased == 0:
+                return
+            time.sleep(poll_interval)
+    finally:
+        db.close()
+
+
+def _format_progress(p: dict) -> str:
+    eta = f"{p['eta_seconds']:.0f}s" if p['eta_seconds'] is not None else "-"
+    return (f"run {p['bill_run_id']} [{p['status']}] shards {p['shards_completed']}/{p['shards']} "
+            f"({p['shards_leased']} leased), customers {p['customers_done']}/{p['customers_total']}, "
+            f"bills {p['bills_done']} ok / {p['bills_failed']} failed, "
+            f"{p['customers_per_second']}/s, ETA {eta}")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Sharded, resumable month-end bill runs")
+    sub = parser.add_subparsers(dest='command', required=True)
+    create = sub.add_parser('create', help="Create a bill run and its shards")
+    create.add_argument('--start', required=True, help="Period start (YYYY-MM-DD)")
+    create.add_argument('--end', required=True, help="Period end, exclusive (YYYY-MM-DD)")
+    create.add_argument('--shards', type=int, default=64)
+    work = sub.add_parser('work', help="Lease and process shards of a run")
+    work.add_argument('--run-id', type=int, required=True)
+    work.add_argument('--processes', type=int, default=1)
+    work.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help="Customers per checkpoint")
+    work.add_argument('--lease-seconds', type=int, default=DEFAULT_LEASE_SECONDS)
+    status = sub.add_parser('status', help="Show progress and ETA")
+    status.add_argument('--run-id', type=int, required=True)
+    status.add_argument('--watch', type=float, help="Refresh every N seconds until the run completes")
+    args = parser.parse_args(argv)
+
+    configure_logging(fmt="%(asctime)s %(processName)s %(levelname)s %(message)s")
+    from ..database import SessionLocal
+
+    if args.command == 'create':
+        db = SessionLocal()
+        try:
+            run_id = create_bill_run(db, datetime.fromisoformat(args.start), datetime.fromisoformat(args.end),
+                                     args.shards)
+        finally:
+            db.close()
+        print(f"Created bill run {run_id} with {args.shards} shards")
+    elif args.command == 'work':
+        worker_args = (args.run_id, args.batch_size, args.lease_seconds)
+        if args.processes <= 1:
+            run_bill_run_worker(*worker_args)
+            return
+        procs = [
+            multiprocessing.Process(target=run_bill_run_worker, args=worker_args, name=f"bill-run-{i}")
+            for i in range(args.processes)
+        ]
+        for proc in procs:
+            proc.start()
+        for proc in procs:
+            proc.join()
+    else:
+        while True:
+            db = SessionLocal()
+            try:
+                progress = bill_run_progress(db, args.run_id)
+            finally:
+                db.close()
+            if progress is None:
+                raise SystemExit(f"bill run {args.run_id} not found")
+            print(_format_progress(progress), flush=True)
+            if not args.watch or progress['status'] == 'completed':
+                return
+            time.sleep(args.watch)
+
+
+if __name__ == '__main__':
+    main()
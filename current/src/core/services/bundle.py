@@ -0,0 +1,86 @@
+"""
+Configuration bundle for billing clients.
+
+Everything a client needs before pricing a customer's bill, in one
+response: the customer, its region, the region's tariff plans with the
+versions in force on the given day, and the market operator fees in
+force. Clients cache it and revalidate with the ETag from
+:func:`bundle_etag`, which changes whenever any of the content does.
+"""
+
+import hashlib
+import json
+from datetime import date
+from typing import Any, Dict, Optional
+
+from sqlalchemy import select, or_
+from sqlalchemy.orm import Session
+
+from ..models import Customer, Region, TariffPlan, TariffVersion, MarketOpFee
+
+
+def _in_force(model, on: date):
+    return (
+        or_(model.effective_from.is_(None), model.effective_from <= on),
+        or_(model.effective_to.is_(None), model.effective_to >= on),
+    )
+
+
+def config_bundle(db: Session, customer_id: int, on: Optional[date] = None) -> Optional[Dict[str, Any]]:
+    """Return the bundle for ``customer_id`` as of ``on`` (today by default), or None if unknown."""
+    on = on or date.today()
+    customer = db.get(Customer, customer_id)
+    if customer is None:
+        return None
+    region = db.get(Region, customer.region_id) if customer.region_id is not None else None
+    plans = []
+    if region is not None:
+        rows = db.execute(
+            select(TariffPlan, TariffVersion)
+            .join(TariffVersion, TariffVersion.tariff_plan_id == TariffPlan.id)
+            .where(TariffPlan.region_id == region.id, *_in_force(TariffVersion, on))
+            .order_by(TariffPlan.id, TariffVersion.effective_from, TariffVersion.version)
+        ).all()
+        by_plan: Dict[int, Dict[str, Any]] = {}
+        for plan, version in rows:
+            entry = by_plan.setdefault(plan.id, {
+                'id': plan.id, 'name': plan.name, 'description': plan.description, 'versions': [],
+            })
+            entry['versions'].append({
+                'id': version.id,
+                'version': version.version,
+                'effective_from': str(version.effective_from),
+                'effective_to': str(version.effective_to) if version.effective_to else None,
+                'canonical_json': version.canonical_json,
+            })
+        plans = list(by_plan.values())
+    fees = db.execute(
+        select(MarketOpFee).where(*_in_force(MarketOpFee, on)).order_by(MarketOpFee.id)
+    ).scalars().all()
+    return {
+        'as_of': str(on),
+        'customer': {
+            'id': customer.id, 'name': customer.name, 'address': customer.address, 'region_id': customer.region_id,
+        },
+        # Keys as the legacy /regions endpoint names them; its summer_months and network_peak_hours
+        # are legacy-only columns, which clients still read from /regions
+        'region': {
+            'region_id': region.id, 'region_name': region.name,
+            'loss_factor': float(region.loss_factor) if region.loss_factor is not None else None,
+        } if region is not None else None,
+        'tariff_plans': plans,
+        'market_op_fees': [
+            {
+                'id': fee.id, 'name': fee.name, 'amount': float(fee.amount), 'unit': fee.unit,
+                'effective_from': str(fee.effective_from) if fee.effective_from else None,
+                'effective_to': str(fee.effective_to) if fee.effective_to else None,
+            }
+            for fee in fees
+        ],
+    }
+
+
+def bundle_etag(bundle: Dict[str, Any]) -> str:
+    """Strong ETag over the bundle's canonical JSON encoding."""
+    body = json.dumps(bundle, sort_keys=True, separators=(',', ':'), default=str)
+    return f'"{hashlib.sha256(body.encode()).hexdigest()[:32]}"'
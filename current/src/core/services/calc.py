@@ -9,7 +9,8 @@ It supports the canonical schema defined in docs/tariff_schema.json, including
 the following:
   * Time bands and date ranges to assign peak/offpeak/shoulder labels
   * Components with units like c/kWh, c/day, $/kVA/Mth, $/meter/year
-  * Multi-tier rate schedules (selects the applicable tier based on usage)
+  * Multi-tier rate schedules (selects the applicable tier based on usage,
+    or prices progressive blocks when ``tier_mode`` is ``progressive``)
   * Seasonal applicability via the "season" property
   * Loss factors per component (default 1.0 if absent)
   * Safe evaluation of arithmetic expressions using allowed variables and
@@ -27,20 +28,47 @@ Usage variables available for expressions:
   - days: integer number of days in billing period
   - billing_period_start, billing_period_end: strings YYYY-MM-DD
 
+Market operator fees in force during the period (``market_op_fees``) are
+added to every bill by :mod:`fees`, prorated where they change.
+
+With ``PRICING_MODE=fixed`` (or ``mode='fixed'``) readings are fetched as
+integer energy units and every line is rounded once to integer
+micro-dollars under its component's rounding policy (:mod:`fixedpoint`);
+results then also carry ``total_micros`` and per-line ``cost_micros``.
+
 The engine persists a summary in calc_runs table via upsert_calc_run.
 """
 
-from datetime import datetime, date
-import math
-import ast
+from datetime import datetime, date, timedelta
 import calendar
-from typing import Dict, Any, Optional, Callable
+import logging
+import os
+from typing import Dict, Any, Optional, Tuple, Sequence
 
-from sqlalchemy import select, and_
+from sqlalchemy import select, and_, cast, func, BigInteger
 from sqlalchemy.orm import Session
 
-from ..models import TariffVersion, MeterReading, CalcRun
-from .timeband import assign_band
+from ..log import stage
+from ..models import MeterReading, CalcRun
+from ..readings import ReadingSeries, as_series
+from .timeband import bucket_totals
+from .tzindex import DEFAULT_TZ
+from .expr import compile_expression
+from .tiers import compile_tiers
+from .segments import plan_segments, aggregate_segments
+from .bandmask import interval_matrix, period_band_mask, segment_slots, usage_from_vectors
+from .revenue import mark_revenue_month, write_calc_run_lines
+from .fees import add_fee_lines, batch_fee_lines, bill_fee_lines
+from .fixedpoint import ENERGY_SCALE, component_rounding, energy_units, round_money, to_dollars, units_to_kwh
+
+logger = logging.getLogger(__name__)
+
+# 'float' (default) or 'fixed': integer energy units and micro-dollar lines, see fixedpoint.py
+PRICING_MODE = os.getenv("PRICING_MODE", "float")
+FIXED = 'fixed'
+
+# meter_reading.kwh_used as whole energy units, converted by the database instead of per Decimal
+_KWH_UNITS = cast(func.round(MeterReading.kwh_used * ENERGY_SCALE), BigInteger)
 
 
 def _safe_eval(expr: str, variables: Dict[str, Any]) -> float:
@@ -48,101 +76,10 @@ def _safe_eval(expr: str, variables: Dict[str, Any]) -> float:
 
     Only allows basic arithmetic operations, comparison, boolean operators,
     names corresponding to variables in `variables`, and functions from math,
-    min, max, and round.
+    min, max, and round. The parsed expression is cached by
+    :func:`compile_expression`, so repeated bills do not re-parse it.
     """
-    # Prepare allowed names
-    allowed_funcs: Dict[str, Callable] = {
-        'min': min,
-        'max': max,
-        'round': round,
-    }
-    # Add math functions
-    for fname in dir(math):
-        if not fname.startswith('_'):
-            func = getattr(math, fname)
-            if callable(func):
-                allowed_funcs[fname] = func
-
-    allowed_names = set(variables.keys()) | set(allowed_funcs.keys()) | {'math'}
-
-    def _eval(node):
-        if isinstance(node, ast.Expression):
-            return _eval(node.body)
-        if isinstance(node, ast.Num):  # type: ignore
-            return node.n
-        if isinstance(node, ast.Constant):  # for Python3.8+
-            return node.value
-        if isinstance(node, ast.BinOp):
-            left = _eval(node.left)
-            right = _eval(node.right)
-            if isinstance(node.op, ast.Add):
-                return left + right
-            elif isinstance(node.op, ast.Sub):
-                return left - right
-            elif isinstance(node.op, ast.Mult):
-                return left * right
-            elif isinstance(node.op, ast.Div):
-                return left / right
-            elif isinstance(node.op, ast.Mod):
-                return left % right
-            elif isinstance(node.op, ast.Pow):
-                return left ** right
-        if isinstance(node, ast.UnaryOp):
-            operand = _eval(node.operand)
-            if isinstance(node.op, ast.UAdd):
-                return +operand
-            elif isinstance(node.op, ast.USub):
-                return -operand
-        if isinstance(node, ast.Name):
-            if node.id in variables:
-                return variables[node.id]
-            if node.id in allowed_funcs:
-                return allowed_funcs[node.id]
-            if node.id == 'math':
-                return math
-            raise ValueError(f"Use of name {node.id} not allowed")
-        if isinstance(node, ast.Call):
-            func = _eval(node.func)
-            args = [_eval(arg) for arg in node.args]
-            kwargs = {kw.arg: _eval(kw.value) for kw in node.keywords}
-            return func(*args, **kwargs)
-        if isinstance(node, ast.IfExp):
-            cond = _eval(node.test)
-            return _eval(node.body) if cond else _eval(node.orelse)
-        if isinstance(node, ast.Compare):
-            left = _eval(node.left)
-            results = []
-            for op, comparator in zip(node.ops, node.comparators):
-                right = _eval(comparator)
-                if isinstance(op, ast.Lt):
-                    results.append(left < right)
-                elif isinstance(op, ast.LtE):
-                    results.append(left <= right)
-                elif isinstance(op, ast.Gt):
-                    results.append(left > right)
-                elif isinstance(op, ast.GtE):
-                    results.append(left >= right)
-                elif isinstance(op, ast.Eq):
-                    results.append(left == right)
-                elif isinstance(op, ast.NotEq):
-                    results.append(left != right)
-                else:
-                    raise ValueError(f"Comparison operator {op} not allowed")
-                left = right
-            return all(results)
-        if isinstance(node, ast.BoolOp):
-            values = [_eval(v) for v in node.values]
-            if isinstance(node.op, ast.And):
-                return all(values)
-            elif isinstance(node.op, ast.Or):
-                return any(values)
-        raise ValueError(f"Unsupported expression: {ast.dump(node)}")
-
-    try:
-        parsed = ast.parse(expr, mode='eval')
-    except Exception as e:
-        raise ValueError(f"Invalid expression: {expr}: {e}")
-    return float(_eval(parsed))
+    return float(compile_expression(expr)(variables))
 
 
 def _parse_rate(unit: str, value: float, days: int, billing_start: date) -> float:
@@ -223,118 +160,161 @@ def _select_rate_value(rate_schedule: list, usage: float) -> float:
     return float(rate_schedule[-1].get('value', 0.0))
 
 
-def calculate_bill(db: Session, customer_id: int, tariff_version_id: int, start: datetime, end: datetime):
+def _rate_value(comp: Dict[str, Any], usage: float) -> float:
     """
-    Calculate a bill for a customer using the specified tariff version within
-    a billing period. Returns a dict with total cost, a breakdown per component,
-    and the units of currency.
+    Return the published rate value for a component at the given usage.
+
+    Components with ``tier_mode: "progressive"`` use a blended value from
+    their compiled tier table; all others select a single tier.
     """
-    tv = db.get(TariffVersion, tariff_version_id)
-    if not tv:
-        return {"total_cost": 0.0, "breakdown": {}, "units": "AUD"}
-    canonical = tv.canonical_json or {}
-    components = canonical.get("components", [])
-    time_bands = canonical.get("time_bands", [])
+    rate_schedule = comp.get('rate_schedule', [])
+    if comp.get('tier_mode') == 'progressive' and rate_schedule:
+        return compile_tiers(rate_schedule).blended_value(usage)
+    return _select_rate_value(rate_schedule, usage)
+
+
+def _is_fixed(mode: Optional[str]) -> bool:
+    return (mode or PRICING_MODE) == FIXED
+
 
-    # Fetch meter readings for the period
-    readings = db.execute(
-        select(MeterReading).where(
+def fetch_readings(db: Session, customer_id: int, start: datetime, end: datetime,
+                   fixed: bool = False) -> ReadingSeries:
+    """
+    Return a customer's readings within [start, end) as a :class:`ReadingSeries`;
+    with ``fixed``, its values are whole :data:`fixedpoint.ENERGY_SCALE` units.
+    """
+    rows = db.execute(
+        select(MeterReading.timestamp, _KWH_UNITS if fixed else MeterReading.kwh_used).where(
             MeterReading.customer_id == customer_id,
             MeterReading.timestamp >= start,
             MeterReading.timestamp < end
         ).order_by(MeterReading.timestamp.asc())
-    ).scalars().all()
+    ).all()
+    return ReadingSeries.from_rows(rows, customer_id)
 
-    # Compute days in period (inclusive of start date but not end date)
-    days = max(1, (end.date() - start.date()).days)
 
-    # Aggregate usage (kWh) by band
-    total_usage: float = 0.0
-    peak_usage: float = 0.0
-    off_peak_usage: float = 0.0
-    shoulder_usage: float = 0.0
-    # Additional buckets for potential network usage (approximate using retail usage)
-    for r in readings:
-        total_usage += float(r.kwh_used)
-        # Determine which time band this reading falls into
-        band_id = assign_band(r.timestamp, canonical)
-        b = (band_id or '').lower()
-        # Treat variations of peak / offpeak / shoulder identically
-        if b in ('peak', 'usage_peak', 'retail_peak', 'network_peak'):
-            peak_usage += float(r.kwh_used)
-        elif b in ('shoulder', 'usage_shoulder', 'retail_shoulder', 'network_shoulder'):
-            shoulder_usage += float(r.kwh_used)
-        else:
-            # offpeak or any other band falls into off_peak_usage by default
-            off_peak_usage += float(r.kwh_used)
-    # Approximate network usage as equal to retail usage (we have no separate network meter)
-    network_peak_usage: float = peak_usage
-    network_off_peak_usage: float = off_peak_usage
+def aggregate_usage(readings, canonical: Dict[str, Any]) -> Dict[str, float]:
+    """
+    Sum ``(timestamp, kwh)`` pairs into the usage buckets used by expressions.
 
-    # Demand metrics (placeholder: assume no kva data available)
-    # If future meter data includes kva readings, these should be computed here.
-    max_kva: float = 0.0
-    incentive_kva: float = 0.0
+    Returns a dict with total_usage, peak_usage, off_peak_usage and
+    shoulder_usage in kWh. Bands are assigned to all readings at once via
+    :func:`timeband.bucket_totals`.
+    """
+    series = as_series(readings, canonical.get("time_zones") or DEFAULT_TZ)
+    return bucket_totals(series.wall_minutes(), series.kwh, canonical)
 
-    # Loss factor default
-    default_loss_factor = 1.0
 
-    breakdown: Dict[str, dict] = {}
-    total_cost = 0.0
+# applies_to tokens -> (usage variable, unit label), checked in order
+_APPLIES_USAGE = (
+    (('usage_peak', 'network_peak'), 'peak_usage', 'kWh'),
+    (('usage_offpeak', 'usage_off_peak', 'network_offpeak', 'network_off_peak'), 'off_peak_usage', 'kWh'),
+    (('usage_shoulder', 'shoulder_usage', 'network_shoulder'), 'shoulder_usage', 'kWh'),
+    (('usage_total', 'total_usage', 'usage_all'), 'total_usage', 'kWh'),
+    (('demand',), 'max_kva', 'kVA'),
+    (('incentive_demand',), 'incentive_kva', 'kVA'),
+)
+_FIXED_TAGS = ('fixed', 'meter', 'metering', 'ancillary')
 
-    # Determine billing start date for proration
-    billing_start_date = start.date()
 
-    # Variables common across all components
+def _usage_var(applies: list) -> Tuple[Optional[str], Optional[str]]:
+    """Return the usage variable and unit label a component's applies_to maps to."""
+    for tags, var, label in _APPLIES_USAGE:
+        if any(tag in applies for tag in tags):
+            return var, label
+    return None, None
+
+
+def _in_season(comp: Dict[str, Any], start: datetime, end: datetime) -> bool:
+    """
+    Return False if the component's season does not overlap [start, end) at all.
+
+    Season dates are inclusive; ``end`` is exclusive, so a period ending at
+    midnight on the season's first day is out of season.
+    """
+    season = comp.get('season')
+    if season:
+        try:
+            from_date = datetime.strptime(season.get('from'), "%Y-%m-%d").date()
+            to_date = datetime.strptime(season.get('to'), "%Y-%m-%d").date()
+            last_day = (end - timedelta(microseconds=1)).date() if end > start else end.date()
+            # If billing period ends before season start or starts after season end, skip
+            if last_day < from_date or start.date() > to_date:
+                return False
+        except Exception:
+            pass
+    return True
+
+
+def _loss_factor(comp: Dict[str, Any]) -> float:
+    """Return the component loss factor, defaulting to 1.0 if absent."""
+    return comp.get('loss_factor') if comp.get('loss_factor') not in (None, '') else 1.0
+
+
+def _base_vars(usage: Dict[str, Any], start: datetime, end: datetime) -> Dict[str, Any]:
+    """
+    Build the variables common to every component expression.
+
+    Usage values may be floats (one bill) or NumPy arrays (many customers).
+    """
+    # Compute days in period (inclusive of start date but not end date)
+    days = max(1, (end.date() - start.date()).days)
+    total_usage = usage.get('total_usage', 0.0)
+    peak_usage = usage.get('peak_usage', 0.0)
+    off_peak_usage = usage.get('off_peak_usage', 0.0)
     # Note: network_* variables mirror retail usage, as separate network readings are not available.
-    base_vars = {
+    # Demand metrics (placeholder: assume no kva data available)
+    # If future meter data includes kva readings, these should be computed here.
+    return {
         'total_usage': total_usage,
         'peak_usage': peak_usage,
         'off_peak_usage': off_peak_usage,
-        'shoulder_usage': shoulder_usage,
-        'network_peak_usage': network_peak_usage,
-        'network_off_peak_usage': network_off_peak_usage,
+        'shoulder_usage': usage.get('shoulder_usage', 0.0),
+        'network_peak_usage': peak_usage,
+        'network_off_peak_usage': off_peak_usage,
         'network_total_usage': total_usage,
-        'max_kva': max_kva,
-        'incentive_kva': incentive_kva,
+        'max_kva': usage.get('max_kva', 0.0),
+        'incentive_kva': usage.get('incentive_kva', 0.0),
         'days': days,
-        'billing_period_start': billing_start_date.strftime("%Y-%m-%d"),
+        'billing_period_start': start.date().strftime("%Y-%m-%d"),
         'billing_period_end': (end.date()).strftime("%Y-%m-%d"),
     }
 
+
+def price_usage(canonical: Dict[str, Any], usage: Dict[str, float], start: datetime, end: datetime,
+                fixed: bool = False) -> dict:
+    """
+    Price aggregated usage against a canonical tariff for a billing period.
+
+    ``usage`` holds the buckets produced by :func:`aggregate_usage`. Returns a
+    dict with total cost, a breakdown per component and the units of currency.
+    With ``fixed``, each line is rounded to micro-dollars by its component's
+    policy and the total is their exact sum.
+    """
+    components = canonical.get("components", [])
+    base_vars = _base_vars(usage, start, end)
+    days = base_vars['days']
+
+    breakdown: Dict[str, dict] = {}
+    total_cost = 0.0
+    total_micros = 0
+
+    # Determine billing start date for proration
+    billing_start_date = start.date()
+
     for comp in components:
         comp_id = comp.get('id')
         if not comp_id:
             continue
         # Check season applicability
-        season = comp.get('season')
-        if season:
-            try:
-                from_date = datetime.strptime(season.get('from'), "%Y-%m-%d").date()
-                to_date = datetime.strptime(season.get('to'), "%Y-%m-%d").date()
-                # If billing period end date before season start or start date after season end, skip
-                if end.date() < from_date or start.date() > to_date:
-                    continue
-            except Exception:
-                pass
+        if not _in_season(comp, start, end):
+            continue
         # Determine usage variable to use for tier selection
         applies = [a.lower() for a in comp.get('applies_to', [])]
-        usage_for_tier: float = 0.0
-        # Map applies_to tokens to usage buckets
-        if any(tag in applies for tag in ('usage_peak', 'network_peak')):
-            usage_for_tier = peak_usage
-        elif any(tag in applies for tag in ('usage_offpeak', 'usage_off_peak', 'network_offpeak', 'network_off_peak')):
-            usage_for_tier = off_peak_usage
-        elif any(tag in applies for tag in ('usage_shoulder', 'shoulder_usage', 'network_shoulder')):
-            usage_for_tier = shoulder_usage
-        elif any(tag in applies for tag in ('usage_total', 'total_usage', 'usage_all')):
-            usage_for_tier = total_usage
-        elif 'demand' in applies:
-            usage_for_tier = max_kva
-        elif 'incentive_demand' in applies:
-            usage_for_tier = incentive_kva
+        usage_name, unit_label = _usage_var(applies)
+        usage_for_tier: float = base_vars[usage_name] if usage_name else 0.0
         # Select rate value from schedule
-        rate_val = _select_rate_value(comp.get('rate_schedule', []), usage_for_tier)
+        rate_val = _rate_value(comp, usage_for_tier)
         # Convert rate to dollars per unit (prorated where needed)
         unit = comp.get('unit')
         rate_dollars = _parse_rate(unit, rate_val, days, billing_start_date)
@@ -342,7 +322,7 @@ def calculate_bill(db: Session, customer_id: int, tariff_version_id: int, start:
         vars_for_expr = base_vars.copy()
         vars_for_expr.update({
             'rate': rate_dollars,
-            'loss_factor': comp.get('loss_factor') if comp.get('loss_factor') not in (None, '') else default_loss_factor
+            'loss_factor': _loss_factor(comp)
         })
         # Evaluate calculation expression
         expr = comp.get('calculation')
@@ -350,8 +330,10 @@ def calculate_bill(db: Session, customer_id: int, tariff_version_id: int, start:
             continue
         try:
             cost = _safe_eval(expr, vars_for_expr)
-        except Exception:
+        except Exception as e:
             # If expression fails, skip this component
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("component %s skipped: %s", comp_id, e)
             continue
         # Only include if positive cost
         if cost is None:
@@ -360,46 +342,34 @@ def calculate_bill(db: Session, customer_id: int, tariff_version_id: int, start:
             cost_float = float(cost)
         except Exception:
             continue
-        # Determine units used and label
-        units_used: Optional[float] = None
-        unit_label: Optional[str] = None
         # Determine units used and label based on applies_to
-        if any(tag in applies for tag in ('usage_peak', 'network_peak')):
-            units_used = peak_usage
-            unit_label = 'kWh'
-        elif any(tag in applies for tag in ('usage_offpeak', 'usage_off_peak', 'network_offpeak', 'network_off_peak')):
-            units_used = off_peak_usage
-            unit_label = 'kWh'
-        elif any(tag in applies for tag in ('usage_shoulder', 'shoulder_usage', 'network_shoulder')):
-            units_used = shoulder_usage
-            unit_label = 'kWh'
-        elif any(tag in applies for tag in ('usage_total', 'total_usage', 'usage_all')):
-            units_used = total_usage
-            unit_label = 'kWh'
-        elif 'demand' in applies:
-            units_used = max_kva
-            unit_label = 'kVA'
-        elif 'incentive_demand' in applies:
-            units_used = incentive_kva
-            unit_label = 'kVA'
-        elif any(tag in applies for tag in ('fixed', 'meter', 'metering', 'ancillary')):
-            # Per-day or per-meter charges use days as units
-            units_used = days
-            unit_label = 'days'
-        else:
-            # For unknown categories, use the usage selected for tiering
-            units_used = usage_for_tier
-            unit_label = 'unit'
+        units_used: Optional[float] = usage_for_tier
+        if usage_name is None:
+            if any(tag in applies for tag in _FIXED_TAGS):
+                # Per-day or per-meter charges use days as units
+                units_used = days
+                unit_label = 'days'
+            else:
+                # For unknown categories, use the usage selected for tiering
+                unit_label = 'unit'
         # If units_used is None, skip
         if units_used is None:
             continue
         breakdown[comp_id] = {
             'units_used': round(units_used, 4) if isinstance(units_used, float) else int(units_used),
             'unit_label': unit_label,
+            'category': comp.get('category'),
             'cost': round(cost_float, 4)
         }
         total_cost += cost_float
-
+        if fixed:
+            micros = round_money(cost_float, *component_rounding(comp, canonical))
+            breakdown[comp_id].update(cost=to_dollars(micros), cost_micros=micros)
+            total_micros += micros
+
+    if fixed:
+        return {'total_cost': to_dollars(total_micros), 'total_micros': total_micros, 'breakdown': breakdown,
+                'units': 'AUD'}
     return {
         'total_cost': round(total_cost, 4),
         'breakdown': breakdown,
@@ -407,10 +377,148 @@ def calculate_bill(db: Session, customer_id: int, tariff_version_id: int, start:
     }
 
 
+def _combine_segments(segments: list, priced: list) -> dict:
+    """Sum per-segment results into one bill, listing the segments used."""
+    if len(priced) == 1:
+        result = dict(priced[0])
+    else:
+        breakdown: Dict[str, dict] = {}
+        for part in priced:
+            for comp_id, line in part['breakdown'].items():
+                merged = breakdown.get(comp_id)
+                if merged is None:
+                    breakdown[comp_id] = dict(line)
+                    continue
+                merged['units_used'] = round(merged['units_used'] + line['units_used'], 4)
+                if 'cost_micros' in line:
+                    merged['cost_micros'] += line['cost_micros']
+                    merged['cost'] = to_dollars(merged['cost_micros'])
+                else:
+                    merged['cost'] = round(merged['cost'] + line['cost'], 4)
+        if all('total_micros' in part for part in priced):
+            total_micros = sum(part['total_micros'] for part in priced)
+            result = {'total_cost': to_dollars(total_micros), 'total_micros': total_micros, 'breakdown': breakdown,
+                      'units': 'AUD'}
+        else:
+            result = {
+                'total_cost': round(sum(part['total_cost'] for part in priced), 4),
+                'breakdown': breakdown,
+                'units': 'AUD'
+            }
+    result['segments'] = [
+        {
+            'start': str(seg['start']),
+            'end': str(seg['end']),
+            'tariff_version_id': seg['tariff_version_id'],
+            'total_cost': part['total_cost'],
+            'breakdown': part['breakdown'],
+        }
+        for seg, part in zip(segments, priced)
+    ]
+    return result
+
+
+def calculate_bill(db: Session, customer_id: int, tariff_version_id: int, start: datetime, end: datetime,
+                   mode: Optional[str] = None, readings: Optional[ReadingSeries] = None):
+    """
+    Calculate a bill for a customer using the specified tariff version within
+    a billing period. Returns a dict with total cost, a breakdown per component,
+    the units of currency and the segments the period was priced in.
+
+    The period is split wherever another version of the same tariff plan
+    takes effect or a component's season starts or ends (see
+    :mod:`segments`); each segment is priced with the version in force.
+    ``mode`` overrides ``PRICING_MODE`` (``'float'`` or ``'fixed'``).
+    ``readings`` (kWh, e.g. already fetched for :func:`checksum.compute_checksum`)
+    saves fetching them again.
+    """
+    fixed = _is_fixed(mode)
+    with stage(logger, 'plan_segments', tariff_version_id=tariff_version_id) as fields:
+        segments = plan_segments(db, tariff_version_id, start, end)
+        fields['segments'] = len(segments)
+    if not segments:
+        return {"total_cost": 0.0, "breakdown": {}, "units": "AUD"}
+
+    # Fetch meter readings once and aggregate usage (kWh) by band per segment
+    with stage(logger, 'fetch_readings', customer_id=customer_id) as fields:
+        if readings is None:
+            readings = fetch_readings(db, customer_id, start, end, fixed)
+        elif fixed:
+            # kwh_used has 4 decimals, so its float64 values convert to whole units exactly
+            readings = ReadingSeries(readings.epoch, energy_units(readings.kwh), readings.customer_id)
+        fields['readings'] = len(readings)
+    with stage(logger, 'price', customer_id=customer_id):
+        usages = aggregate_segments(readings, segments)
+        if fixed:
+            usages = [units_to_kwh(usage) for usage in usages]
+        priced = [
+            price_usage(seg['canonical'], usage, seg['start'], seg['end'], fixed)
+            for seg, usage in zip(segments, usages)
+        ]
+    with stage(logger, 'market_fees', customer_id=customer_id):
+        fee_lines = bill_fee_lines(db, segments, start, end, readings, ENERGY_SCALE if fixed else 1)
+    result = _combine_segments(segments, priced)
+    add_fee_lines(result, fee_lines)
+    return result
+
+
+def calculate_bills(db: Session, customer_ids: Sequence[int], tariff_version_id: int, start: datetime,
+                    end: datetime, interval_minutes: int = 30, mode: Optional[str] = None) -> Dict[int, dict]:
+    """
+    Calculate bills for many customers on one tariff version and period.
+
+    Readings for every customer are fetched in one query and summed into a
+    (customers x slots) interval matrix. Each segment's band mask comes from
+    the shared :func:`bandmask.period_band_mask` cache, so the usage buckets
+    of the whole batch are one matrix product per segment. Slots are labelled
+    by their start, which matches :func:`calculate_bill` whenever band
+    boundaries fall on the interval grid. Returns results keyed by customer id.
+    """
+    ids = list(dict.fromkeys(customer_ids))
+    fixed = _is_fixed(mode)
+    segments = plan_segments(db, tariff_version_id, start, end)
+    if not segments:
+        return {cid: {"total_cost": 0.0, "breakdown": {}, "units": "AUD"} for cid in ids}
+
+    with stage(logger, 'fetch_readings', customers=len(ids)) as fields:
+        readings = db.execute(
+            select(MeterReading.customer_id, MeterReading.timestamp,
+                   _KWH_UNITS if fixed else MeterReading.kwh_used).where(
+                MeterReading.customer_id.in_(ids),
+                MeterReading.timestamp >= start,
+                MeterReading.timestamp < end
+            )
+        ).all() if ids else []
+        fields['readings'] = len(readings)
+    tz_name = segments[0]['canonical'].get('time_zones') or DEFAULT_TZ
+    with stage(logger, 'interval_matrix', customers=len(ids)):
+        vectors = interval_matrix(readings, ids, start, end, interval_minutes, tz_name)
+
+    priced_by_segment = []
+    for seg in segments:
+        with stage(logger, 'price_segment', customers=len(ids), tariff_version_id=seg['tariff_version_id']):
+            _, one_hot = period_band_mask(seg['canonical'], seg['start'], seg['end'], interval_minutes)
+            usage = usage_from_vectors(vectors[:, segment_slots(start, seg['start'], seg['end'], interval_minutes)], one_hot)
+            if fixed:
+                usage = units_to_kwh(usage)
+            priced_by_segment.append([
+                price_usage(seg['canonical'], {name: float(values[i]) for name, values in usage.items()},
+                            seg['start'], seg['end'], fixed)
+                for i in range(len(ids))
+            ])
+    with stage(logger, 'market_fees', customers=len(ids)):
+        fee_lines = batch_fee_lines(db, segments, start, end, vectors, interval_minutes, ENERGY_SCALE if fixed else 1)
+    results = {}
+    for i, cid in enumerate(ids):
+        results[cid] = _combine_segments(segments, [priced[i] for priced in priced_by_segment])
+        add_fee_lines(results[cid], fee_lines, i)
+    return results
+
+
 def upsert_calc_run(db: Session, customer_id: int, tariff_version_id: int, start: datetime, end: datetime, checksum: str, result: dict) -> int:
     """
     Upsert a CalcRun record: return existing row ID if the checksum and period
-    match, otherwise create a new row.
+    match, otherwise create a new row together with its calc_run_line rows.
     """
     row = db.execute(
         select(CalcRun).where(
@@ -426,12 +534,18 @@ def upsert_calc_run(db: Session, customer_id: int, tariff_version_id: int, start
         customer_id=customer_id,
         tariff_version_id=tariff_version_id,
         status='completed',
+        period_start=start,
+        period_end=end,
         result_summary_json={
             '_meta': {'start': str(start), 'end': str(end), 'checksum': checksum},
             'result': result
         }
     )
     db.add(newrow)
+    db.flush()
+    # Normalised copy of the breakdown for revenue reporting
+    write_calc_run_lines(db, newrow.id, result)
+    mark_revenue_month(db, start)
     db.commit()
     db.refresh(newrow)
     return newrow.id
@@ -1,21 +1,41 @@
 import hashlib
-from sqlalchemy import select
-from ..models import MeterReading, TariffVersion
+import numpy as np
+from ..models import TariffVersion
+from ..readings import ReadingSeries
+from .segments import plan_segments
+from .fees import fee_cache
+from .calc import PRICING_MODE, FIXED, fetch_readings
 
-def compute_checksum(db, customer_id: int, tariff_version_id: int, start, end) -> str:
+def reading_text(readings: ReadingSeries) -> bytes:
+    # str(timestamp) + str(kwh_used) per reading, as hashed from query rows (NUMERIC(10,4) kWh)
+    if not len(readings):
+        return b''
+    stamps = np.char.replace(np.datetime_as_string(readings.timestamps, unit='s'), 'T', ' ')
+    return ''.join(np.char.add(stamps, np.char.mod('%.4f', readings.kwh)).tolist()).encode()
+
+def compute_checksum(db, customer_id: int, tariff_version_id: int, start, end, mode=None, readings=None) -> str:
     tv = db.get(TariffVersion, tariff_version_id)
     h = hashlib.sha256()
     h.update(str(tariff_version_id).encode())
-    if tv and tv.canonical_json:
+    if tv and tv.content_hash:
+        # Uploaded through POST /tariffs: the stored hash already covers the content
+        h.update(tv.content_hash.encode())
+    elif tv and tv.canonical_json:
         h.update(repr(tv.canonical_json).encode())
-    rows = db.execute(
-        select(MeterReading.timestamp, MeterReading.kwh_used)
-        .where(MeterReading.customer_id == customer_id,
-               MeterReading.timestamp >= start,
-               MeterReading.timestamp < end)
-        .order_by(MeterReading.timestamp.asc())
-    ).all()
-    for ts, kwh in rows:
-        h.update(str(ts).encode()); h.update(str(kwh).encode())
+    # Other plan versions in force during the period also price the bill
+    for seg in plan_segments(db, tariff_version_id, start, end):
+        if seg['tariff_version_id'] != tariff_version_id:
+            h.update(str(seg['tariff_version_id']).encode()); h.update(repr(seg['canonical']).encode())
+    # Pass the kWh readings the bill is priced from to fetch them only once
+    if readings is None:
+        readings = fetch_readings(db, customer_id, start, end)
+    h.update(reading_text(readings))
     h.update(str(start).encode()); h.update(str(end).encode())
+    # Fixed-point results differ in rounding, so they are stored apart from float ones
+    if (mode or PRICING_MODE) == FIXED:
+        h.update(FIXED.encode())
+    # Market fees charged in the period; bills without any keep their previous checksum
+    fees = fee_cache.schedule(db).fingerprint(start, end)
+    if fees:
+        h.update(fees.encode())
     return h.hexdigest()
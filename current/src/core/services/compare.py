@@ -0,0 +1,85 @@
+"""
+Price one customer's load profile against several tariff versions.
+
+Readings for the period are fetched once. Each tariff version's period is
+split like a bill (:func:`segments.plan_segments`: sibling versions and
+season edges), and readings are summed into each segment's usage buckets by
+:func:`segments.aggregate_segments`. Tariffs whose segments share band sets,
+time zones and bounds (the usual case: one segment per tariff, published
+tariffs sharing a handful of band sets) reuse the same buckets. Each segment
+is priced via :func:`price_usage` and the market operator fees a bill would
+carry are added (:func:`fees.bill_fee_lines`), so every result is the bill
+``calculate_bill`` would produce and rankings compare bill totals.
+"""
+
+from datetime import datetime
+from typing import Dict, List
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from ..models import TariffVersion
+from .bandmask import band_set_hash
+from .calc import _combine_segments, fetch_readings, price_usage
+from .fees import add_fee_lines, bill_fee_lines
+from .segments import aggregate_segments, plan_segments
+from .tzindex import DEFAULT_TZ
+
+
+def compare_tariffs(db: Session, customer_id: int, tariff_version_ids: List[int],
+                    start: datetime, end: datetime) -> dict:
+    """
+    Price a customer's readings for a period against each tariff version.
+
+    Returns a dict with a ``results`` list ranked by total cost (cheapest
+    first) and a ``missing`` list of tariff version ids that do not exist.
+    """
+    # Preserve caller order while dropping duplicate ids
+    wanted = list(dict.fromkeys(tariff_version_ids))
+    versions = db.execute(
+        select(TariffVersion).where(TariffVersion.id.in_(wanted))
+    ).scalars().all()
+    by_id = {tv.id: tv for tv in versions}
+
+    readings = fetch_readings(db, customer_id, start, end)
+
+    # Bucket readings once per distinct segmentation
+    usages_by_key: Dict[tuple, List[Dict[str, float]]] = {}
+    results = []
+    for tv_id in wanted:
+        tv = by_id.get(tv_id)
+        if tv is None:
+            continue
+        canonical = tv.canonical_json or {}
+        segments = plan_segments(db, tv_id, start, end)
+        key = tuple(
+            (band_set_hash(seg['canonical']), seg['canonical'].get('time_zones') or DEFAULT_TZ, seg['start'], seg['end'])
+            for seg in segments
+        )
+        usages = usages_by_key.get(key)
+        if usages is None:
+            usages = usages_by_key[key] = aggregate_segments(readings, segments)
+        priced = _combine_segments(segments, [
+            price_usage(seg['canonical'], usage, seg['start'], seg['end']) for seg, usage in zip(segments, usages)
+        ])
+        add_fee_lines(priced, bill_fee_lines(db, segments, start, end, readings))
+        results.append({
+            'tariff_version_id': tv_id,
+            'tariff_plan_id': tv.tariff_plan_id,
+            'tariff_code': canonical.get('tariff_code'),
+            'version': canonical.get('version'),
+            **priced,
+        })
+
+    results.sort(key=lambda r: r['total_cost'])
+    for rank, row in enumerate(results, start=1):
+        row['rank'] = rank
+
+    return {
+        'customer_id': customer_id,
+        'start': str(start),
+        'end': str(end),
+        'band_sets': len(usages_by_key),
+        'results': results,
+        'missing': [tv_id for tv_id in wanted if tv_id not in by_id],
+    }
@@ -0,0 +1,161 @@
+"""
+Compiled forms of tariff ``calculation`` expressions.
+
+:func:`compile_expression` parses and checks an expression once and returns
+a callable taking the variables dict, so the same component can be evaluated
+for many bills without re-parsing. The accepted grammar is the one
+``calc._safe_eval`` has always accepted: arithmetic, comparisons, boolean
+operators, conditional expressions, names from the variables dict and calls
+to ``min``, ``max``, ``round`` and the public ``math`` functions. Anything
+else (attribute access, subscripts, lambdas, comprehensions...) is rejected
+when the expression is compiled.
+
+With ``vectorized=True`` the variables may be NumPy arrays (one element per
+customer, interval, ...) and the whole array is evaluated in one call:
+``min``/``max`` become element-wise, conditionals become ``np.where`` and
+math functions use their NumPy equivalent where one exists.
+"""
+
+import ast
+import math
+import operator
+from functools import lru_cache, reduce
+from typing import Dict, Any, Callable
+
+import numpy as np
+
+
+Compiled = Callable[[Dict[str, Any]], Any]
+
+_BIN_OPS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+}
+
+_UNARY_OPS = {
+    ast.UAdd: operator.pos,
+    ast.USub: operator.neg,
+}
+
+_CMP_OPS = {
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+}
+
+
+def _scalar_funcs() -> Dict[str, Callable]:
+    funcs: Dict[str, Callable] = {'min': min, 'max': max, 'round': round}
+    for fname in dir(math):
+        if not fname.startswith('_'):
+            func = getattr(math, fname)
+            if callable(func):
+                funcs[fname] = func
+    return funcs
+
+
+def _vector_funcs() -> Dict[str, Callable]:
+    funcs: Dict[str, Callable] = {}
+    for fname, func in _scalar_funcs().items():
+        np_func = getattr(np, fname, None)
+        if isinstance(np_func, np.ufunc):
+            funcs[fname] = np_func
+        else:
+            funcs[fname] = np.vectorize(func, otypes=[float])
+    funcs['min'] = lambda *args: reduce(np.minimum, args)
+    funcs['max'] = lambda *args: reduce(np.maximum, args)
+    funcs['round'] = lambda x, ndigits=0: np.round(x, ndigits)
+    # math.pow/fabs/log are not exposed as ufuncs under the same name
+    funcs['pow'] = np.power
+    funcs['fabs'] = np.fabs
+    funcs['log'] = lambda x, base=None: np.log(x) if base is None else np.log(x) / np.log(base)
+    return funcs
+
+
+_SCALAR_FUNCS = _scalar_funcs()
+_VECTOR_FUNCS = _vector_funcs()
+
+
+def _build(node, funcs: Dict[str, Callable], vectorized: bool) -> Compiled:
+    """Translate an AST node into a closure evaluating it against variables."""
+    if isinstance(node, ast.Expression):
+        return _build(node.body, funcs, vectorized)
+    if isinstance(node, ast.Constant):
+        value = node.value
+        return lambda v: value
+    if isinstance(node, ast.BinOp) and type(node.op) in _BIN_OPS:
+        op = _BIN_OPS[type(node.op)]
+        left = _build(node.left, funcs, vectorized)
+        right = _build(node.right, funcs, vectorized)
+        return lambda v: op(left(v), right(v))
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_OPS:
+        op = _UNARY_OPS[type(node.op)]
+        operand = _build(node.operand, funcs, vectorized)
+        return lambda v: op(operand(v))
+    if isinstance(node, ast.Name):
+        name = node.id
+        func = funcs.get(name)
+
+        def _lookup(v):
+            if name in v:
+                return v[name]
+            if func is not None:
+                return func
+            raise ValueError(f"Use of name {name} not allowed")
+        return _lookup
+    if isinstance(node, ast.Call):
+        if not isinstance(node.func, ast.Name) or node.func.id not in funcs:
+            raise ValueError(f"Call to {ast.dump(node.func)} not allowed")
+        func = _build(node.func, funcs, vectorized)
+        args = [_build(arg, funcs, vectorized) for arg in node.args]
+        kwargs = {kw.arg: _build(kw.value, funcs, vectorized) for kw in node.keywords}
+        return lambda v: func(v)(*[a(v) for a in args], **{k: a(v) for k, a in kwargs.items()})
+    if isinstance(node, ast.IfExp):
+        test = _build(node.test, funcs, vectorized)
+        body = _build(node.body, funcs, vectorized)
+        orelse = _build(node.orelse, funcs, vectorized)
+        if vectorized:
+            return lambda v: np.where(test(v), body(v), orelse(v))
+        return lambda v: body(v) if test(v) else orelse(v)
+    if isinstance(node, ast.Compare):
+        for op in node.ops:
+            if type(op) not in _CMP_OPS:
+                raise ValueError(f"Comparison operator {op} not allowed")
+        ops = [_CMP_OPS[type(op)] for op in node.ops]
+        operands = [_build(n, funcs, vectorized) for n in [node.left, *node.comparators]]
+        combine = np.logical_and.reduce if vectorized else all
+
+        def _compare(v):
+            values = [o(v) for o in operands]
+            return combine([op(values[i], values[i + 1]) for i, op in enumerate(ops)])
+        return _compare
+    if isinstance(node, ast.BoolOp):
+        values = [_build(n, funcs, vectorized) for n in node.values]
+        if isinstance(node.op, ast.And):
+            combine = np.logical_and.reduce if vectorized else all
+        else:
+            combine = np.logical_or.reduce if vectorized else any
+        return lambda v: combine([f(v) for f in values])
+    raise ValueError(f"Unsupported expression: {ast.dump(node)}")
+
+
+@lru_cache(maxsize=1024)
+def compile_expression(expr: str, vectorized: bool = False) -> Compiled:
+    """Parse and check ``expr`` once, returning a callable over a variables dict.
+
+    Raises ValueError if the expression is syntactically invalid or uses a
+    construct outside the whitelist. Unknown variable names are reported when
+    the compiled expression is called, as the variables are only known then.
+    """
+    try:
+        parsed = ast.parse(expr, mode='eval')
+    except Exception as e:
+        raise ValueError(f"Invalid expression: {expr}: {e}")
+    return _build(parsed, _VECTOR_FUNCS if vectorized else _SCALAR_FUNCS, vectorized)
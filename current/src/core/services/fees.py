@@ -0,0 +1,324 @@
+"""
+Market operator fees applied to every bill.
+
+``market_op_fees`` rows (name, amount, unit, effective_from/to) are loaded
+once into a :class:`FeeSchedule`: the sorted days on which the set of fees
+in force changes, and that set from each of those days. A billing period
+is cut at those days with ``bisect`` (:meth:`FeeSchedule.pieces`), and
+each piece is charged at the fees in force during it, so a fee that changes
+mid-period is prorated. Rows with the same name that overlap are resolved
+like tariff versions: the latest ``effective_from`` wins.
+
+Units (``c/`` amounts are cents):
+
+  * per energy (``$/MWh``, ``c/kWh``...): the kWh read within the piece;
+  * ``/day``: the days of the piece (fractional at the period's ends);
+  * ``/month``, ``/mth``: the piece's share of its calendar month;
+  * ``/year``: days / 365.
+
+A fee whose name is the ``id`` of a component of the tariff is left to the
+tariff, so tariffs that still carry AEMO fees as components are not
+charged twice. Fees appear in the breakdown under their name with the
+category ``market_op_fee``.
+
+Tariff comparisons, cost curves (per interval) and the portfolio cost
+matrix add the same fees, so their totals are bill totals.
+
+The process-wide schedule is rebuilt when ``market_op_fees`` changes are
+notified (:mod:`core.notify`), or after ``MARKET_FEES_MAX_AGE`` seconds
+when no listener is connected.
+"""
+
+import calendar
+import hashlib
+import logging
+import os
+import threading
+import time
+from bisect import bisect_right
+from datetime import date, datetime, time as dtime, timedelta
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from ..models import MarketOpFee
+from ..notify import listening, subscribe
+from ..readings import as_series
+from ..routing import use_primary
+from .bandmask import segment_slots
+from .fixedpoint import round_money, to_dollars
+from .tzindex import DEFAULT_TZ
+
+DEFAULT_MAX_AGE = float(os.getenv("MARKET_FEES_MAX_AGE", "300"))
+CATEGORY = 'market_op_fee'
+
+logger = logging.getLogger(__name__)
+
+
+class Fee(NamedTuple):
+    id: int
+    name: str
+    amount: float
+    unit: str
+    effective_from: Optional[date]
+    effective_to: Optional[date]
+
+
+def _basis(unit: Optional[str]) -> Optional[Tuple[str, float]]:
+    """Return (basis, factor to dollars per basis unit) for a fee unit, or None if unsupported."""
+    unit = (unit or '').strip().lower().replace(' ', '')
+    scale = 1.0
+    if unit.startswith('c/'):
+        scale, unit = 0.01, unit[2:]
+    elif unit.startswith('$/'):
+        unit = unit[2:]
+    if unit.endswith('mwh'):
+        return 'energy', scale / 1000.0
+    if unit.endswith('kwh'):
+        return 'energy', scale
+    if unit.endswith('day'):
+        return 'day', scale
+    if unit.endswith('month') or unit.endswith('mth'):
+        return 'month', scale
+    if unit.endswith('year'):
+        return 'year', scale
+    return None
+
+
+def _midnight(day: date) -> datetime:
+    return datetime.combine(day, dtime())
+
+
+def _as_fee(row) -> Fee:
+    if isinstance(row, Fee):
+        return row
+    return Fee(row.id, row.name, float(row.amount), row.unit, row.effective_from, row.effective_to)
+
+
+class FeeSchedule:
+    """Effective-date interval index over all market operator fees."""
+
+    __slots__ = ('starts', 'in_force', 'built_at')
+
+    def __init__(self, rows: Iterable) -> None:
+        """``rows`` are :class:`Fee` tuples or ``MarketOpFee`` rows."""
+        fees = []
+        for fee in map(_as_fee, rows):
+            if _basis(fee.unit) is None:
+                logger.warning("market fee %s (id %s) has unsupported unit %r; not applied", fee.name, fee.id, fee.unit)
+                continue
+            fees.append(fee)
+        bounds = {date.min.toordinal()}
+        for fee in fees:
+            if fee.effective_from is not None:
+                bounds.add(fee.effective_from.toordinal())
+            if fee.effective_to is not None and fee.effective_to < date.max:
+                bounds.add(fee.effective_to.toordinal() + 1)
+        self.starts: List[int] = sorted(bounds)
+        self.in_force: List[Tuple[Fee, ...]] = []
+        for ordinal in self.starts:
+            day = date.fromordinal(ordinal)
+            by_name: Dict[str, Fee] = {}
+            for fee in fees:
+                if (fee.effective_from is None or fee.effective_from <= day) \
+                        and (fee.effective_to is None or day <= fee.effective_to):
+                    current = by_name.get(fee.name)
+                    if current is None or (current.effective_from or date.min, current.id) \
+                            < (fee.effective_from or date.min, fee.id):
+                        by_name[fee.name] = fee
+            self.in_force.append(tuple(sorted(by_name.values(), key=lambda f: f.name)))
+        self.built_at = time.monotonic()
+
+    def at(self, day: date) -> Tuple[Fee, ...]:
+        """The fees in force on ``day``."""
+        return self.in_force[bisect_right(self.starts, day.toordinal()) - 1]
+
+    def pieces(self, start: datetime, end: datetime) -> List[Tuple[datetime, datetime, Tuple[Fee, ...]]]:
+        """Cut [start, end) where the fees in force change; pieces without fees are left out."""
+        if end <= start:
+            return []
+        first = bisect_right(self.starts, start.date().toordinal()) - 1
+        last_day = (end - timedelta(microseconds=1)).date()
+        stop = bisect_right(self.starts, last_day.toordinal())
+        pieces = []
+        for i in range(first, stop):
+            piece_start = max(start, _midnight(date.fromordinal(self.starts[i])))
+            piece_end = min(end, _midnight(date.fromordinal(self.starts[i + 1]))) if i + 1 < len(self.starts) else end
+            if self.in_force[i] and piece_end > piece_start:
+                pieces.append((piece_start, piece_end, self.in_force[i]))
+        return pieces
+
+    def fingerprint(self, start: datetime, end: datetime) -> Optional[str]:
+        """Digest of the fees charged in [start, end), or None when there are none (for checksums)."""
+        pieces = self.pieces(start, end)
+        if not pieces:
+            return None
+        h = hashlib.sha256()
+        for piece_start, piece_end, fees in pieces:
+            h.update(f"{piece_start}|{piece_end}".encode())
+            for fee in fees:
+                h.update(repr(tuple(fee)).encode())
+        return h.hexdigest()
+
+
+class FeeCache:
+    """Per-process :class:`FeeSchedule`, rebuilt after notified changes."""
+
+    def __init__(self, max_age: Optional[float] = DEFAULT_MAX_AGE) -> None:
+        self.max_age = max_age
+        self._schedule: Optional[FeeSchedule] = None
+        self._lock = threading.Lock()
+        self._generation = 0
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._schedule = None
+
+    def load(self, rows: Iterable) -> FeeSchedule:
+        """Replace the cached schedule with one built from ``rows`` (see :class:`FeeSchedule`)."""
+        built = FeeSchedule(rows)
+        with self._lock:
+            self._generation += 1
+            self._schedule = built
+        return built
+
+    def schedule(self, db: Session) -> FeeSchedule:
+        """The current schedule, loading every fee row (from the primary) if needed."""
+        current = self._schedule
+        if current is not None and (listening() or self.max_age is None
+                                    or time.monotonic() - current.built_at < self.max_age):
+            return current
+        generation = self._generation
+        with use_primary(db):
+            rows = db.execute(select(MarketOpFee)).scalars().all()
+        built = FeeSchedule(rows)
+        with self._lock:
+            if generation == self._generation:
+                self._schedule = built
+        return built
+
+
+# Shared by every bill priced in this process
+fee_cache = FeeCache()
+
+subscribe('market_op_fees', lambda event: fee_cache.invalidate())
+
+
+def _piece_units(basis: str, piece_start: datetime, piece_end: datetime, kwh) -> Any:
+    days = (piece_end - piece_start).total_seconds() / 86400.0
+    if basis == 'energy':
+        return kwh
+    if basis == 'day':
+        return days
+    if basis == 'month':
+        return days / calendar.monthrange(piece_start.year, piece_start.month)[1]
+    return days / 365.0
+
+
+def price_fees(pieces: Sequence[Tuple[datetime, datetime, Tuple[Fee, ...]]], kwh_by_piece: Sequence[Any],
+               skip: Iterable[str] = ()) -> Dict[str, Dict[str, Any]]:
+    """
+    Charge every fee over the pieces. ``kwh_by_piece`` holds the energy read
+    in each piece (a float for one bill, an array for a batch). Returns
+    ``{name: {'units_used', 'unit_label', 'cost'}}``.
+    """
+    skip = set(skip)
+    lines: Dict[str, Dict[str, Any]] = {}
+    for (piece_start, piece_end, fees), kwh in zip(pieces, kwh_by_piece):
+        for fee in fees:
+            if fee.name in skip:
+                continue
+            basis, factor = _basis(fee.unit)
+            units = _piece_units(basis, piece_start, piece_end, kwh)
+            line = lines.setdefault(fee.name, {
+                'units_used': 0.0, 'unit_label': 'kWh' if basis == 'energy' else basis + 's', 'cost': 0.0})
+            line['units_used'] = line['units_used'] + units
+            line['cost'] = line['cost'] + units * fee.amount * factor
+    return lines
+
+
+def _component_ids(segments: Sequence[Dict[str, Any]]) -> set:
+    return {comp.get('id') for seg in segments for comp in seg['canonical'].get('components', [])}
+
+
+def bill_fee_lines(db: Session, segments: Sequence[Dict[str, Any]], start: datetime, end: datetime,
+                   readings: Sequence, energy_scale: float = 1) -> Dict[str, Dict[str, Any]]:
+    """
+    Fee lines for one bill from its ``(timestamp, kwh)`` readings (or
+    :class:`~core.readings.ReadingSeries`), ordered by timestamp; readings in
+    fixed-point energy units pass their ``energy_scale``.
+    """
+    pieces = fee_cache.schedule(db).pieces(start, end)
+    if not pieces:
+        return {}
+    series = as_series(readings, segments[0]['canonical'].get('time_zones') or DEFAULT_TZ)
+    wall = series.wall_minutes()
+    cumulative = np.concatenate(([0.0], np.cumsum(series.kwh)))
+    bounds = np.array([p[0] for p in pieces] + [pieces[-1][1]], dtype='datetime64[m]').astype(np.int64)
+    idx = np.searchsorted(wall, bounds, side='left')
+    kwh_by_piece = [float(cumulative[idx[i + 1]] - cumulative[idx[i]]) / energy_scale for i in range(len(pieces))]
+    return price_fees(pieces, kwh_by_piece, skip=_component_ids(segments))
+
+
+def batch_fee_lines(db: Session, segments: Sequence[Dict[str, Any]], start: datetime, end: datetime,
+                    vectors: np.ndarray, interval_minutes: int, energy_scale: float = 1) -> Dict[str, Dict[str, Any]]:
+    """Fee lines for a batch from its (customers x slots) interval matrix; energy lines hold arrays."""
+    pieces = fee_cache.schedule(db).pieces(start, end)
+    if not pieces:
+        return {}
+    kwh_by_piece = [vectors[:, segment_slots(start, a, b, interval_minutes)].sum(axis=1) / energy_scale
+                    for a, b, _ in pieces]
+    return price_fees(pieces, kwh_by_piece, skip=_component_ids(segments))
+
+
+def interval_fee_costs(db: Session, segments: Sequence[Dict[str, Any]], start: datetime, end: datetime,
+                       vector: np.ndarray, interval_minutes: int, energy_scale: float = 1) -> Dict[str, np.ndarray]:
+    """
+    Per-interval fee costs over the period's slots, for cost curves. Energy
+    fees follow each interval's kWh and time-based fees are spread evenly
+    over their piece, so the intervals add up to :func:`batch_fee_lines`.
+    """
+    skip = _component_ids(segments)
+    costs: Dict[str, np.ndarray] = {}
+    for piece_start, piece_end, fees in fee_cache.schedule(db).pieces(start, end):
+        slots = segment_slots(start, piece_start, piece_end, interval_minutes)
+        kwh = vector[slots] / energy_scale
+        for fee in fees:
+            if fee.name in skip:
+                continue
+            basis, factor = _basis(fee.unit)
+            cost = costs.setdefault(fee.name, np.zeros(len(vector)))
+            if basis == 'energy':
+                cost[slots] += kwh * fee.amount * factor
+            elif len(kwh):
+                cost[slots] += _piece_units(basis, piece_start, piece_end, None) * fee.amount * factor / len(kwh)
+    return costs
+
+
+def add_fee_lines(result: Dict[str, Any], lines: Dict[str, Dict[str, Any]], index: Optional[int] = None) -> None:
+    """
+    Add fee lines (element ``index`` of batch lines) to a bill's breakdown and
+    total; fixed-point bills (with ``total_micros``) get micro-dollar lines.
+    """
+    for name, line in lines.items():
+        units, cost = line['units_used'], line['cost']
+        if index is not None:
+            # Energy-based lines are per customer; time-based ones are the same for everyone
+            units = units[index] if np.ndim(units) else units
+            cost = cost[index] if np.ndim(cost) else cost
+        result['breakdown'][name] = {
+            'units_used': round(float(units), 4),
+            'unit_label': line['unit_label'],
+            'category': CATEGORY,
+            'cost': round(float(cost), 4),
+        }
+        if 'total_micros' in result:
+            micros = round_money(float(cost))
+            result['breakdown'][name].update(cost=to_dollars(micros), cost_micros=micros)
+            result['total_micros'] += micros
+            result['total_cost'] = to_dollars(result['total_micros'])
+        else:
+            result['total_cost'] = round(result['total_cost'] + float(cost), 4)
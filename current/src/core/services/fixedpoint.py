@@ -0,0 +1,94 @@
+"""
+Fixed-point amounts for the ``fixed`` pricing mode.
+
+Energy is an integer count of :data:`ENERGY_SCALE` units per kWh. Those
+units are 0.1 Wh, the resolution of ``meter_reading.kwh_used``
+(``NUMERIC(10,4)``), so readings convert without loss. Readings are cast
+in SQL, so no ``Decimal`` reaches Python, and the sums of int64 arrays are
+exact.
+
+Money is an integer count of micro-dollars. Each component's cost is rounded
+once, to whole micro-dollars, under that component's rounding policy:
+
+    "rounding": {"mode": "half_up", "decimals": 2}
+
+``mode`` is one of :data:`ROUNDING_MODES`. ``decimals`` (0-6) is the
+precision the line is rounded to before it is stored in micro-dollars. A
+tariff may set a default in ``meta.rounding``. Otherwise, or where a stored
+policy is invalid (uploads are checked against the schema), lines are
+rounded half-even to the micro-dollar. Bill totals are exact sums of the
+rounded lines, so the total always reconciles with its breakdown.
+"""
+
+import logging
+from typing import Any, Dict, Tuple, Union
+
+import numpy as np
+
+ENERGY_SCALE = 10_000
+MONEY_SCALE = 1_000_000
+ROUNDING_MODES = ('half_even', 'half_up', 'half_down', 'down', 'up')
+DEFAULT_ROUNDING = ('half_even', 6)
+
+logger = logging.getLogger(__name__)
+
+
+def energy_units(kwh) -> np.ndarray:
+    """kWh (floats) as int64 energy units."""
+    return np.rint(np.asarray(kwh, dtype=np.float64) * ENERGY_SCALE).astype(np.int64)
+
+
+def round_money(amount, mode: str = 'half_even', decimals: int = 6) -> Union[int, np.ndarray]:
+    """
+    Round dollar amounts to ``decimals`` places under ``mode`` and return
+    micro-dollars: an int for a scalar, an int64 array for an array.
+    ``half_up``/``half_down`` and ``up``/``down`` are relative to zero.
+    """
+    if mode not in ROUNDING_MODES:
+        raise ValueError(f"Unknown rounding mode: {mode}")
+    if not 0 <= decimals <= 6:
+        raise ValueError(f"Rounding decimals must be between 0 and 6, got {decimals}")
+    # Drop binary representation noise first (2.675 * 100 == 267.49999999999997)
+    scaled = np.round(np.asarray(amount, dtype=np.float64) * 10 ** decimals, 6)
+    magnitude = np.abs(scaled)
+    if mode == 'half_even':
+        rounded = np.rint(scaled)
+    elif mode == 'half_up':
+        rounded = np.sign(scaled) * np.floor(magnitude + 0.5)
+    elif mode == 'half_down':
+        rounded = np.sign(scaled) * np.ceil(magnitude - 0.5)
+    elif mode == 'down':
+        rounded = np.trunc(scaled)
+    else:
+        rounded = np.sign(scaled) * np.ceil(magnitude)
+    micros = rounded.astype(np.int64) * 10 ** (6 - decimals)
+    return int(micros) if micros.ndim == 0 else micros
+
+
+def to_dollars(micros) -> Any:
+    """Micro-dollars as float dollars (for display; keep the integers for sums)."""
+    return micros / MONEY_SCALE
+
+
+def component_rounding(comp: Dict[str, Any], canonical: Dict[str, Any]) -> Tuple[str, int]:
+    """The (mode, decimals) a component's cost is rounded with."""
+    policy = comp.get('rounding') or (canonical.get('meta') or {}).get('rounding') or {}
+    mode = policy.get('mode', DEFAULT_ROUNDING[0])
+    try:
+        decimals = int(policy.get('decimals', DEFAULT_ROUNDING[1]))
+    except (TypeError, ValueError):
+        decimals = None
+    if mode not in ROUNDING_MODES or decimals is None or not 0 <= decimals <= 6:
+        logger.warning("component %s has invalid rounding %r; using %s to %s decimals",
+                       comp.get('id'), policy, *DEFAULT_ROUNDING)
+        return DEFAULT_ROUNDING
+    return mode, decimals
+
+
+def units_to_kwh(usage: Dict[str, Any]) -> Dict[str, Any]:
+    """Usage buckets summed in energy units (floats or arrays of whole units) as kWh."""
+    converted = {}
+    for name, value in usage.items():
+        units = np.rint(np.asarray(value, dtype=np.float64)).astype(np.int64)
+        converted[name] = float(units) / ENERGY_SCALE if units.ndim == 0 else units / ENERGY_SCALE
+    return converted
@@ -0,0 +1,97 @@
+"""
+Bill history for a customer with keyset pagination and checksum ETags.
+
+Pages are ordered newest first and continue from the last ``calc_runs.id``
+seen (``before_id``), so each page is an index range scan on
+``ix_calc_runs_customer_id`` regardless of how deep the client has paged.
+ETags are derived from the checksums stored with each run, which change
+whenever the tariff, readings or period behind a bill change.
+"""
+
+import hashlib
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from ..models import CalcRun
+
+MAX_PAGE_SIZE = 500
+
+
+def run_checksum(row: CalcRun) -> Optional[str]:
+    """Return the checksum stored with a calc run, if any."""
+    meta = (row.result_summary_json or {}).get('_meta', {})
+    return meta.get('checksum')
+
+
+def etag_for(*parts: Any) -> str:
+    """Build a quoted strong ETag from the given parts."""
+    digest = hashlib.sha256('|'.join(str(p) for p in parts).encode()).hexdigest()[:32]
+    return f'"{digest}"'
+
+
+def _history_item(row: CalcRun, include_breakdown: bool) -> Dict[str, Any]:
+    result = (row.result_summary_json or {}).get('result', {})
+    item = {
+        'calc_run_id': row.id,
+        'tariff_version_id': row.tariff_version_id,
+        'status': row.status,
+        'period_start': str(row.period_start) if row.period_start else None,
+        'period_end': str(row.period_end) if row.period_end else None,
+        'finished_at': str(row.finished_at) if row.finished_at else None,
+        'checksum': run_checksum(row),
+        'total_cost': result.get('total_cost'),
+        'units': result.get('units'),
+    }
+    if include_breakdown:
+        item['breakdown'] = result.get('breakdown', {})
+    return item
+
+
+def bill_history(db: Session, customer_id: int, before_id: Optional[int] = None, limit: int = 50,
+                 start: Optional[datetime] = None, end: Optional[datetime] = None,
+                 tariff_version_id: Optional[int] = None, include_breakdown: bool = False) -> Dict[str, Any]:
+    """
+    Return one page of a customer's calc runs, newest first.
+
+    ``start``/``end`` keep runs whose period overlaps [start, end). The
+    result carries ``next_before_id`` (None on the last page) and an ``etag``
+    covering the ids and checksums on the page.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    stmt = select(CalcRun).where(CalcRun.customer_id == customer_id)
+    if before_id is not None:
+        stmt = stmt.where(CalcRun.id < before_id)
+    if tariff_version_id is not None:
+        stmt = stmt.where(CalcRun.tariff_version_id == tariff_version_id)
+    if start is not None:
+        stmt = stmt.where(CalcRun.period_end > start)
+    if end is not None:
+        stmt = stmt.where(CalcRun.period_start < end)
+    # One extra row tells us whether another page exists
+    rows = db.execute(stmt.order_by(CalcRun.id.desc()).limit(limit + 1)).scalars().all()
+    page, more = rows[:limit], len(rows) > limit
+    items = [_history_item(row, include_breakdown) for row in page]
+    return {
+        'customer_id': customer_id,
+        'items': items,
+        'next_before_id': page[-1].id if more else None,
+        'etag': etag_for(customer_id, before_id, limit, start, end, tariff_version_id, include_breakdown,
+                         *[(item['calc_run_id'], item['status'], item['checksum']) for item in items]),
+    }
+
+
+def latest_bill(db: Session, customer_id: int, tariff_version_id: int,
+                start: datetime, end: datetime) -> Optional[CalcRun]:
+    """Return the newest completed run for exactly this customer, version and period."""
+    return db.execute(
+        select(CalcRun).where(
+            CalcRun.customer_id == customer_id,
+            CalcRun.tariff_version_id == tariff_version_id,
+            CalcRun.status == 'completed',
+            CalcRun.period_start == start,
+            CalcRun.period_end == end,
+        ).order_by(CalcRun.id.desc())
+    ).scalars().first()
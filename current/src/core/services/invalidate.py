@@ -0,0 +1,256 @@
+"""
+Late-data invalidation: re-price only the bills affected by new readings.
+
+Ingestion records the (customer, day range) of every reading it adds or
+replaces in ``meter_reading_change`` (see :func:`record_reading_changes` and
+``data/load_sample_meter_data.py``). An invalidation pass then:
+
+  1. claims a batch of unprocessed change rows in a short transaction of
+     its own (``SKIP LOCKED``, then ``claimed_at`` is set and committed),
+     so passes may run concurrently without sharing rows; a claim older
+     than ``--claim-timeout`` is assumed lost with its pass and taken again,
+  2. finds the completed calc_runs whose period overlaps any changed range
+     through ``ix_calc_runs_customer_period``, one row per distinct
+     (customer, tariff version, period); runs stored before calc_runs had
+     ``period_start``/``period_end`` first get them copied from their
+     ``_meta`` (:func:`backfill_run_periods`),
+  3. re-prices each of them with :func:`calc.calculate_bill`, exactly as
+     it was first priced, storing the result through
+     :func:`calc.upsert_calc_run` (a new row only if the checksum changed);
+     readings come from a read replica only once it has caught up with
+     the changes,
+  4. marks the change rows processed. A bill that fails to price does not
+     stop the pass: the change rows it overlaps keep the error in
+     ``last_error`` and are retried by later passes, then marked processed
+     with the error once they have had ``max_attempts``.
+
+Re-pricing is idempotent, so a pass interrupted between steps 3 and 4 just
+repeats some work next time. The claim timeout must exceed a pass.
+
+Usage (from ``current/src``):
+
+    python -m core.services.invalidate --limit 5000 [--interval 60] [--claim-timeout 900]
+"""
+
+import argparse
+import logging
+import time
+from collections import defaultdict
+from datetime import date, datetime, time as dt_time, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import select, func, and_, or_, case, update, values, column, Integer, DateTime
+from sqlalchemy.orm import Session
+
+from ..log import configure_logging
+from ..models import CalcRun, MeterReadingChange
+from ..routing import require_fresh_reads
+from .calc import calculate_bill, fetch_readings, upsert_calc_run
+from .checksum import compute_checksum
+from .worker import now_plus
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CLAIM_TIMEOUT = 900.0
+DEFAULT_MAX_ATTEMPTS = 5
+
+
+def changed_day_ranges(readings: Iterable[Tuple[int, datetime]]) -> List[Tuple[int, date, date]]:
+    """
+    Collapse ``(customer_id, timestamp)`` pairs into inclusive
+    ``(customer_id, day_from, day_to)`` runs of consecutive days.
+    """
+    days = defaultdict(set)
+    for customer_id, ts in readings:
+        days[customer_id].add(ts.date() if isinstance(ts, datetime) else ts)
+    ranges = []
+    for customer_id, customer_days in sorted(days.items()):
+        ordered = sorted(customer_days)
+        run_start = prev = ordered[0]
+        for day in ordered[1:]:
+            if day != prev + timedelta(days=1):
+                ranges.append((customer_id, run_start, prev))
+                run_start = day
+            prev = day
+        ranges.append((customer_id, run_start, prev))
+    return ranges
+
+
+def record_reading_changes(db: Session, readings: Iterable[Tuple[int, datetime]]) -> int:
+    """Record the changed day ranges for ``(customer_id, timestamp)`` pairs; caller commits."""
+    ranges = changed_day_ranges(readings)
+    db.add_all([
+        MeterReadingChange(customer_id=customer_id, day_from=day_from, day_to=day_to, recorded_at=func.now())
+        for customer_id, day_from, day_to in ranges
+    ])
+    return len(ranges)
+
+
+def backfill_run_periods(db: Session) -> int:
+    """
+    Fill ``period_start``/``period_end`` of completed calc_runs stored before
+    those columns existed from ``result_summary_json['_meta']``; caller
+    commits. Rows without a readable ``_meta`` period are left as they are
+    and can never be invalidated.
+    """
+    rows = db.execute(
+        select(CalcRun).where(CalcRun.status == 'completed', CalcRun.period_start.is_(None))
+    ).scalars().all()
+    filled = 0
+    for row in rows:
+        summary = row.result_summary_json if isinstance(row.result_summary_json, dict) else {}
+        meta = summary.get('_meta') or {}
+        try:
+            start, end = datetime.fromisoformat(meta['start']), datetime.fromisoformat(meta['end'])
+        except (KeyError, TypeError, ValueError):
+            continue
+        row.period_start, row.period_end = start, end
+        filled += 1
+    return filled
+
+
+def affected_runs(db: Session, changes: List[MeterReadingChange]) -> List[tuple]:
+    """
+    Return distinct ``(customer_id, tariff_version_id, period_start, period_end)``
+    of completed calc_runs whose period overlaps any of ``changes``.
+    """
+    if not changes:
+        return []
+    changed = values(
+        column('customer_id', Integer), column('changed_from', DateTime), column('changed_to', DateTime),
+        name='changed',
+    ).data([
+        (c.customer_id, datetime.combine(c.day_from, dt_time()), datetime.combine(c.day_to + timedelta(days=1), dt_time()))
+        for c in changes
+    ])
+    return db.execute(
+        select(CalcRun.customer_id, CalcRun.tariff_version_id, CalcRun.period_start, CalcRun.period_end)
+        .distinct()
+        .join(changed, and_(
+            CalcRun.customer_id == changed.c.customer_id,
+            CalcRun.period_start < changed.c.changed_to,
+            CalcRun.period_end > changed.c.changed_from,
+        ))
+        .where(CalcRun.status == 'completed')
+    ).all()
+
+
+def claim_changes(db: Session, limit: int, claim_timeout: float = DEFAULT_CLAIM_TIMEOUT) -> List[MeterReadingChange]:
+    """
+    Claim up to ``limit`` pending change rows, oldest first, and commit the
+    claim, so it outlasts the commits re-pricing makes. Rows claimed more
+    than ``claim_timeout`` seconds ago are claimed again.
+    """
+    change_ids = db.execute(
+        select(MeterReadingChange.id).where(
+            MeterReadingChange.processed_at.is_(None),
+            or_(MeterReadingChange.claimed_at.is_(None),
+                MeterReadingChange.claimed_at <= now_plus(db, -claim_timeout)),
+        ).order_by(MeterReadingChange.id).limit(limit).with_for_update(skip_locked=True)
+    ).scalars().all()
+    if not change_ids:
+        db.rollback()
+        return []
+    db.execute(
+        update(MeterReadingChange).where(MeterReadingChange.id.in_(change_ids)).values(claimed_at=func.now())
+    )
+    db.commit()
+    return db.execute(
+        select(MeterReadingChange).where(MeterReadingChange.id.in_(change_ids)).order_by(MeterReadingChange.id)
+    ).scalars().all()
+
+
+def reprice_runs(db: Session, runs: List[tuple]) -> Tuple[int, Dict[tuple, str]]:
+    """
+    Re-price ``affected_runs`` one bill at a time. Returns the number
+    re-priced and the error of each run that failed, which is rolled back
+    without stopping the others.
+    """
+    repriced = 0
+    failures = {}
+    for run in runs:
+        customer_id, tariff_version_id, start, end = run
+        try:
+            readings = fetch_readings(db, customer_id, start, end)
+            checksum = compute_checksum(db, customer_id, tariff_version_id, start, end, readings=readings)
+            result = calculate_bill(db, customer_id, tariff_version_id, start, end, readings=readings)
+            upsert_calc_run(db, customer_id, tariff_version_id, start, end, checksum, result)
+        except Exception as e:
+            db.rollback()
+            failures[run] = f"{type(e).__name__}: {e}"
+            logger.warning("re-pricing customer %s on tariff version %s for %s..%s failed: %s",
+                           customer_id, tariff_version_id, start, end, failures[run])
+            continue
+        repriced += 1
+    return repriced, failures
+
+
+def run_invalidation(db: Session, limit: int = 5000, claim_timeout: float = DEFAULT_CLAIM_TIMEOUT,
+                     max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> dict:
+    """Process up to ``limit`` pending change rows; returns counts for logging."""
+    changes = claim_changes(db, limit, claim_timeout)
+    if not changes:
+        return {'changes': 0, 'runs': 0, 'repriced': 0, 'failed': 0}
+    spans = [
+        (c.id, c.customer_id, datetime.combine(c.day_from, dt_time()),
+         datetime.combine(c.day_to + timedelta(days=1), dt_time()))
+        for c in changes
+    ]
+    # Pricing reads may go to a replica; it must have the readings behind these changes
+    require_fresh_reads(db)
+    backfill_run_periods(db)
+    db.commit()
+    runs = affected_runs(db, changes)
+    repriced, failures = reprice_runs(db, runs)
+
+    errors = {}
+    for (customer_id, _, start, end), error in failures.items():
+        for change_id, change_customer, changed_from, changed_to in spans:
+            if change_customer == customer_id and start < changed_to and end > changed_from:
+                errors.setdefault(change_id, error)
+    done = [change_id for change_id, *_ in spans if change_id not in errors]
+    if done:
+        db.execute(
+            update(MeterReadingChange).where(MeterReadingChange.id.in_(done)).values(processed_at=func.now())
+        )
+    for change_id, error in errors.items():
+        db.execute(
+            update(MeterReadingChange).where(MeterReadingChange.id == change_id).values(
+                attempts=MeterReadingChange.attempts + 1,
+                last_error=error,
+                claimed_at=None,
+                processed_at=case((MeterReadingChange.attempts + 1 >= max_attempts, func.now()), else_=None),
+            )
+        )
+    db.commit()
+    return {'changes': len(spans), 'runs': len(runs), 'repriced': repriced, 'failed': len(failures)}
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Re-price calc_runs affected by late meter data")
+    parser.add_argument('--limit', type=int, default=5000, help="Change rows per pass")
+    parser.add_argument('--interval', type=float, help="Keep running, polling every N seconds")
+    parser.add_argument('--claim-timeout', type=float, default=DEFAULT_CLAIM_TIMEOUT,
+                        help="Seconds after which a claimed change row is assumed lost and claimed again")
+    parser.add_argument('--max-attempts', type=int, default=DEFAULT_MAX_ATTEMPTS,
+                        help="Passes a change row's failing bills are retried in")
+    args = parser.parse_args(argv)
+
+    configure_logging(fmt="%(asctime)s %(levelname)s %(message)s")
+    from ..database import SessionLocal
+    while True:
+        db = SessionLocal()
+        try:
+            stats = run_invalidation(db, args.limit, args.claim_timeout, args.max_attempts)
+        finally:
+            db.close()
+        logger.info("invalidation pass: %(changes)s changes, %(runs)s runs, %(repriced)s re-priced, %(failed)s failed", stats)
+        if stats['changes'] == args.limit:
+            continue
+        if not args.interval:
+            return
+        time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+"""
+Portfolio x tariff what-if cost matrix.
+
+Prices every customer in a portfolio against every candidate tariff version
+for one billing period and writes an N x M cost matrix (customers x tariff
+versions) to disk. Intended for revenue-impact estimates when a network
+publishes a new tariff year.
+
+The job works in three passes:
+  1. Readings are summed per (customer, interval slot) inside Postgres and
+     streamed back in chunks, so the raw interval rows never reach Python.
+  2. Each tariff version's period is split like a bill
+     (:func:`segments.plan_segments`: sibling versions and season edges).
+     Each distinct (``time_bands`` set, segment) maps the segment's slots
+     to usage buckets through the shared :func:`bandmask.period_band_mask`
+     cache; the streamed chunks are folded into per-customer band-aggregate
+     vectors with ``np.bincount``.
+  3. Each component's ``calculation`` is compiled once with
+     ``vectorized=True`` and evaluated over the whole customer array, one
+     segment at a time. Market operator fees are added as on bills; energy
+     fees use the kWh each customer read in each fee piece, folded in the
+     same pass.
+
+Usage (from ``current/src``):
+
+    python -m core.services.matrix --tariff-version-ids 1 2 3 \
+        --start 2025-07-01 --end 2025-08-01 --out matrix.npz
+"""
+
+import argparse
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Sequence
+
+import numpy as np
+from sqlalchemy import select, func, literal
+from sqlalchemy.orm import Session
+
+from ..models import Customer, MeterReading
+from .calc import _usage_var, _in_season, _loss_factor, _base_vars, _parse_rate
+from .expr import compile_expression
+from .bandmask import period_band_mask, segment_slots, slot_count
+from .fees import _component_ids, fee_cache, price_fees
+from .segments import plan_segments
+from .tiers import compile_tiers, select_rate_values
+from .timeband import BUCKETS, band_set_key
+
+
+def _rate_values(comp: Dict[str, Any], usage: np.ndarray) -> np.ndarray:
+    """Vectorized counterpart of ``calc._rate_value`` over a usage array."""
+    rate_schedule = comp.get('rate_schedule', [])
+    if comp.get('tier_mode') == 'progressive' and rate_schedule:
+        return compile_tiers(rate_schedule).blended_values(usage)
+    return select_rate_values(rate_schedule, usage)
+
+
+def price_usage_arrays(canonical: Dict[str, Any], usage: Dict[str, np.ndarray],
+                       start: datetime, end: datetime) -> np.ndarray:
+    """
+    Vectorized counterpart of ``calc.price_usage`` returning total cost per customer.
+
+    ``usage`` maps the usage bucket names to equal-length arrays. Components
+    whose expression fails to evaluate are skipped, as in the scalar engine;
+    so are customers for whom it does not give a finite cost (division by
+    zero raises for scalars but gives inf/nan for arrays).
+    """
+    base_vars = _base_vars(usage, start, end)
+    n = len(usage['total_usage'])
+    total = np.zeros(n, dtype=np.float64)
+    for comp in canonical.get('components', []):
+        if not comp.get('id') or not comp.get('calculation'):
+            continue
+        if not _in_season(comp, start, end):
+            continue
+        applies = [a.lower() for a in comp.get('applies_to', [])]
+        usage_name, _ = _usage_var(applies)
+        usage_for_tier = np.asarray(base_vars[usage_name], dtype=np.float64) if usage_name else np.zeros(n)
+        if usage_for_tier.shape != (n,):
+            usage_for_tier = np.broadcast_to(usage_for_tier, (n,))
+        rate_vals = _rate_values(comp, usage_for_tier)
+        # _parse_rate is linear in the rate value, so convert a unit rate once
+        rate_dollars = rate_vals * _parse_rate(comp.get('unit'), 1.0, base_vars['days'], start.date())
+        vars_for_expr = dict(base_vars, rate=rate_dollars, loss_factor=_loss_factor(comp))
+        try:
+            with np.errstate(all='ignore'):
+                cost = np.broadcast_to(
+                    np.asarray(compile_expression(comp['calculation'], vectorized=True)(vars_for_expr),
+                               dtype=np.float64), (n,))
+        except Exception:
+            continue
+        total += np.where(np.isfinite(cost), cost, 0.0)
+    return total
+
+
+def segment_key(segment: Dict[str, Any]) -> tuple:
+    """Key of a segment's band aggregates: its band set and bounds."""
+    return band_set_key(segment['canonical']), segment['start'], segment['end']
+
+
+def load_band_aggregates(db: Session, segments: Sequence[Dict[str, Any]], start: datetime, end: datetime,
+                         customer_ids: Optional[Sequence[int]] = None, interval_minutes: int = 30,
+                         chunk_size: int = 200_000, pieces: Sequence[tuple] = ()):
+    """
+    Build per-customer band-aggregate vectors for each distinct segment
+    (``start``, ``end`` and ``canonical``, as from :func:`plan_segments`).
+
+    Returns ``(customer_ids, aggregates, piece_kwh)`` where ``customer_ids``
+    is a sorted int64 array, ``aggregates`` maps :func:`segment_key` to an
+    ``(N, len(BUCKETS))`` float64 array of the kWh read in the segment and
+    ``piece_kwh`` is the ``(N, len(pieces))`` kWh read in each market-fee
+    piece (:meth:`fees.FeeSchedule.pieces`).
+    """
+    if customer_ids is None:
+        customer_ids = db.execute(select(Customer.id).order_by(Customer.id)).scalars().all()
+    ids = np.unique(np.asarray(customer_ids, dtype=np.int64))
+    n = len(ids)
+    n_slots = slot_count(start, end, interval_minutes)
+    # Slots outside a segment (or every fee piece) go to one extra, discarded column
+    width = len(BUCKETS) + 1
+    slot_maps: Dict[tuple, np.ndarray] = {}
+    for seg in segments:
+        key = segment_key(seg)
+        if key not in slot_maps:
+            bucket_index, _ = period_band_mask(seg['canonical'], seg['start'], seg['end'], interval_minutes)
+            slot_map = np.full(n_slots, len(BUCKETS), dtype=np.int64)
+            slot_map[segment_slots(start, seg['start'], seg['end'], interval_minutes)] = bucket_index
+            slot_maps[key] = slot_map
+    aggregates = {key: np.zeros(n * width) for key in slot_maps}
+    piece_width = len(pieces) + 1
+    piece_map = np.full(n_slots, len(pieces), dtype=np.int64)
+    for k, (piece_start, piece_end, _) in enumerate(pieces):
+        piece_map[segment_slots(start, piece_start, piece_end, interval_minutes)] = k
+    piece_kwh = np.zeros(n * piece_width)
+    if n == 0:
+        return ids, {key: np.zeros((0, len(BUCKETS))) for key in slot_maps}, np.zeros((0, len(pieces)))
+
+    slot = func.floor(func.extract('epoch', MeterReading.timestamp - literal(start)) / (interval_minutes * 60))
+    stmt = (
+        select(MeterReading.customer_id, slot.label('slot'), func.sum(MeterReading.kwh_used))
+        .where(MeterReading.timestamp >= start, MeterReading.timestamp < end)
+        .group_by(MeterReading.customer_id, 'slot')
+    )
+    if len(ids) < 10_000:
+        stmt = stmt.where(MeterReading.customer_id.in_(ids.tolist()))
+    result = db.execute(stmt.execution_options(stream_results=True, yield_per=chunk_size))
+    for chunk in result.partitions(chunk_size):
+        rows = np.array(chunk, dtype=np.float64)
+        cust = rows[:, 0].astype(np.int64)
+        pos = np.searchsorted(ids, cust)
+        known = (pos < n) & (ids[np.minimum(pos, n - 1)] == cust)
+        pos = pos[known]
+        slots = rows[known, 1].astype(np.int64)
+        kwh = rows[known, 2]
+        for key, slot_map in slot_maps.items():
+            flat = pos * width + slot_map[slots]
+            aggregates[key] += np.bincount(flat, weights=kwh, minlength=n * width)
+        if pieces:
+            piece_kwh += np.bincount(pos * piece_width + piece_map[slots], weights=kwh, minlength=n * piece_width)
+    return (ids, {key: agg.reshape(n, width)[:, :len(BUCKETS)] for key, agg in aggregates.items()},
+            piece_kwh.reshape(n, piece_width)[:, :len(pieces)])
+
+
+def build_cost_matrix(db: Session, tariff_version_ids: List[int], start: datetime, end: datetime,
+                      customer_ids: Optional[Sequence[int]] = None, interval_minutes: int = 30):
+    """
+    Price every customer against every tariff version for the period.
+
+    Returns ``(customer_ids, tariff_version_ids, costs)`` where ``costs`` has
+    shape (len(customer_ids), len(tariff_version_ids)) and includes market
+    operator fees. Unknown tariff version ids are dropped.
+    """
+    segments_by_id = {}
+    for tv_id in dict.fromkeys(tariff_version_ids):
+        segments = plan_segments(db, tv_id, start, end)
+        if segments:
+            segments_by_id[tv_id] = segments
+    tv_ids = list(segments_by_id)
+
+    pieces = fee_cache.schedule(db).pieces(start, end)
+    ids, aggregates, piece_kwh = load_band_aggregates(
+        db, [seg for segments in segments_by_id.values() for seg in segments], start, end, customer_ids,
+        interval_minutes, pieces=pieces
+    )
+    kwh_by_piece = [piece_kwh[:, k] for k in range(len(pieces))]
+    costs = np.zeros((len(ids), len(tv_ids)), dtype=np.float64)
+    for j, tv_id in enumerate(tv_ids):
+        segments = segments_by_id[tv_id]
+        for seg in segments:
+            agg = aggregates[segment_key(seg)]
+            usage = {name: agg[:, i] for i, name in enumerate(BUCKETS)}
+            usage['total_usage'] = agg.sum(axis=1)
+            costs[:, j] += price_usage_arrays(seg['canonical'], usage, seg['start'], seg['end'])
+        # Energy fee lines hold one cost per customer, time-based ones a scalar
+        for line in price_fees(pieces, kwh_by_piece, skip=_component_ids(segments)).values():
+            costs[:, j] += line['cost']
+    return ids, np.asarray(tv_ids, dtype=np.int64), costs
+
+
+def write_cost_matrix(path: str, customer_ids: np.ndarray, tariff_version_ids: np.ndarray, costs: np.ndarray) -> None:
+    """Write the matrix as ``.npz`` (default) or as CSV if ``path`` ends in ``.csv``."""
+    if path.lower().endswith('.csv'):
+        header = 'customer_id,' + ','.join(f'tv_{tv_id}' for tv_id in tariff_version_ids)
+        table = np.column_stack([customer_ids, costs])
+        np.savetxt(path, table, delimiter=',', header=header, comments='',
+                   fmt=['%d'] + ['%.4f'] * costs.shape[1])
+    else:
+        np.savez_compressed(path, customer_ids=customer_ids, tariff_version_ids=tariff_version_ids, costs=costs)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Price every customer against candidate tariff versions")
+    parser.add_argument('--tariff-version-ids', type=int, nargs='+', required=True)
+    parser.add_argument('--start', required=True, help="Period start (YYYY-MM-DD)")
+    parser.add_argument('--end', required=True, help="Period end, exclusive (YYYY-MM-DD)")
+    parser.add_argument('--customer-ids', type=int, nargs='*', help="Restrict to these customers (default: all)")
+    parser.add_argument('--interval-minutes', type=int, default=30)
+    parser.add_argument('--out', default='cost_matrix.npz', help="Output path (.npz or .csv)")
+    args = parser.parse_args(argv)
+
+    from ..database import SessionLocal
+    db = SessionLocal()
+    try:
+        ids, tv_ids, costs = build_cost_matrix(
+            db, args.tariff_version_ids, datetime.fromisoformat(args.start), datetime.fromisoformat(args.end),
+            args.customer_ids or None, args.interval_minutes,
+        )
+    finally:
+        db.close()
+    write_cost_matrix(args.out, ids, tv_ids, costs)
+    print(f"Wrote {costs.shape[0]}x{costs.shape[1]} cost matrix to {args.out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""
+Resolve "the version of tariff plan P in force on day D" without a query.
+
+Each plan's versions are folded into a :class:`PlanIndex`: the sorted days
+on which the version in force can change, and the version in force from
+each of those days (the same precedence as :mod:`segments`: the latest
+``effective_from`` wins, then the highest version number). A lookup is one
+``bisect``.
+
+The process-wide :data:`resolver` loads every plan at API startup (only the
+id, plan and date columns; no tariff JSON), loads plans it has not seen on
+first use, and rebuilds a plan when it is invalidated: after an upload in
+this process, or when a ``tariff_plan``/``tariff_versions`` change is
+notified (:mod:`core.notify`). Without a listener connected, indexes older
+than ``TARIFF_INDEX_MAX_AGE`` seconds are rebuilt instead.
+"""
+
+import os
+import threading
+import time
+from bisect import bisect_right
+from datetime import date
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from ..models import TariffPlan, TariffVersion
+from ..notify import listening, subscribe
+from ..routing import use_primary
+from .segments import _version_in_force
+
+DEFAULT_MAX_AGE = float(os.getenv("TARIFF_INDEX_MAX_AGE", "300"))
+
+
+class PlanIndex:
+    """Effective-date interval index over one plan's versions."""
+
+    __slots__ = ('plan_id', 'region_id', 'starts', 'version_ids', 'built_at')
+
+    def __init__(self, plan_id: int, region_id: Optional[int], versions: Iterable) -> None:
+        """``versions`` have ``id``, ``version``, ``effective_from`` and ``effective_to``."""
+        versions = [v for v in versions if v.effective_from is not None]
+        bounds = set()
+        for v in versions:
+            bounds.add(v.effective_from.toordinal())
+            if v.effective_to is not None:
+                bounds.add(v.effective_to.toordinal() + 1)
+        self.plan_id = plan_id
+        self.region_id = region_id
+        self.starts: List[int] = sorted(bounds)
+        self.version_ids: List[Optional[int]] = []
+        for day in self.starts:
+            tv = _version_in_force(versions, date.fromordinal(day))
+            self.version_ids.append(tv.id if tv is not None else None)
+        self.built_at = time.monotonic()
+
+    def at(self, day: date) -> Optional[int]:
+        """The version id in force on ``day``, or None."""
+        i = bisect_right(self.starts, day.toordinal()) - 1
+        return self.version_ids[i] if i >= 0 else None
+
+    def first_between(self, first: date, last: date) -> Optional[int]:
+        """The version in force on ``first``, else the first to take effect by ``last`` (inclusive)."""
+        i = max(bisect_right(self.starts, first.toordinal()) - 1, 0)
+        stop = bisect_right(self.starts, last.toordinal())
+        for version_id in self.version_ids[i:stop]:
+            if version_id is not None:
+                return version_id
+        return None
+
+
+class VersionResolver:
+    """Per-process cache of :class:`PlanIndex` by plan id."""
+
+    def __init__(self, max_age: Optional[float] = DEFAULT_MAX_AGE) -> None:
+        self.max_age = max_age
+        self._plans: Dict[int, PlanIndex] = {}
+        self._lock = threading.Lock()
+        # Bumped by every invalidation, so an index built from data read before it is not kept
+        self._generation = 0
+
+    def _build(self, db: Session, plan_ids: Optional[List[int]] = None) -> Dict[int, PlanIndex]:
+        plans = select(TariffPlan.id, TariffPlan.region_id)
+        versions = select(TariffVersion.id, TariffVersion.tariff_plan_id, TariffVersion.version,
+                          TariffVersion.effective_from, TariffVersion.effective_to)
+        if plan_ids is not None:
+            plans = plans.where(TariffPlan.id.in_(plan_ids))
+            versions = versions.where(TariffVersion.tariff_plan_id.in_(plan_ids))
+        by_plan: Dict[int, list] = {}
+        # From the primary: a replica may not have replayed the change that evicted the index yet
+        with use_primary(db):
+            for row in db.execute(versions):
+                by_plan.setdefault(row.tariff_plan_id, []).append(row)
+            plan_rows = db.execute(plans).all()
+        return {plan_id: PlanIndex(plan_id, region_id, by_plan.get(plan_id, [])) for plan_id, region_id in plan_rows}
+
+    def _load_all(self, db: Session) -> Dict[int, PlanIndex]:
+        generation = self._generation
+        built = self._build(db)
+        with self._lock:
+            if generation == self._generation:
+                self._plans = built
+        return built
+
+    def load(self, db: Session) -> int:
+        """(Re)build the index of every plan; returns the number of plans."""
+        return len(self._load_all(db))
+
+    def invalidate(self, plan_id: Optional[int] = None) -> None:
+        """Drop one plan (or all), so the next lookup rebuilds it."""
+        with self._lock:
+            self._generation += 1
+            if plan_id is None:
+                self._plans = {}
+            else:
+                self._plans.pop(plan_id, None)
+
+    def _fresh(self, index: Optional[PlanIndex]) -> bool:
+        if index is None:
+            return False
+        # Notified changes evict entries themselves; the age limit only covers running without a listener
+        return listening() or self.max_age is None or time.monotonic() - index.built_at < self.max_age
+
+    def plan(self, db: Session, plan_id: int) -> Optional[PlanIndex]:
+        """The index for ``plan_id``, building it if missing or stale; None if the plan doesn't exist."""
+        index = self._plans.get(plan_id)
+        if self._fresh(index):
+            return index
+        generation = self._generation
+        index = self._build(db, [plan_id]).get(plan_id)
+        with self._lock:
+            if index is None:
+                self._plans.pop(plan_id, None)
+            elif generation == self._generation:
+                self._plans[plan_id] = index
+        return index
+
+    def plans(self, db: Session) -> List[PlanIndex]:
+        """Every plan's index, reloading them all if any is stale."""
+        indexes = list(self._plans.values())
+        if not indexes or not all(self._fresh(i) for i in indexes):
+            indexes = list(self._load_all(db).values())
+        return indexes
+
+    def resolve(self, db: Session, plan_id: int, day: date) -> Optional[int]:
+        """The id of the version of ``plan_id`` in force on ``day``, or None."""
+        index = self.plan(db, plan_id)
+        return index.at(day) if index is not None else None
+
+
+# Shared by the API, bill runs and workers in this process
+resolver = VersionResolver()
+
+
+def _on_plan_change(event: dict) -> None:
+    plan_ids = event.get('tariff_plan_ids')
+    if event.get('op') in ('RESET', 'TRUNCATE') or not plan_ids:
+        resolver.invalidate()
+        return
+    for plan_id in plan_ids:
+        resolver.invalidate(int(plan_id))
+
+
+subscribe('tariff_plan', _on_plan_change)
+subscribe('tariff_versions', _on_plan_change)
+
+
+def versions_by_region(db: Session, first: date, last: date) -> Dict[int, List[int]]:
+    """
+    Map region id -> version ids to bill for the days ``first``..``last``:
+    per plan, the version in force on ``first``, else the first to take effect.
+    """
+    versions: Dict[int, List[int]] = {}
+    for index in sorted(resolver.plans(db), key=lambda i: i.plan_id):
+        if index.region_id is None:
+            continue
+        version_id = index.first_between(first, last)
+        if version_id is not None:
+            versions.setdefault(index.region_id, []).append(version_id)
+    return versions
@@ -0,0 +1,188 @@
+"""
+Normalised calc-run lines and monthly revenue summaries.
+
+Every stored calc run also writes its breakdown to ``calc_run_line`` (one
+narrow, indexed row per component) in the same transaction, so revenue
+questions no longer unpack ``calc_runs.result_summary_json``.
+
+``revenue_monthly`` holds totals per (month, tariff plan, category,
+component) over the latest completed run for each (customer, tariff
+version, period), so re-priced bills replace rather than add to earlier
+ones. A month is attributed by its run's ``period_start``. Whatever
+completes a run marks its month in ``revenue_dirty_month`` in the same
+transaction (:func:`mark_revenue_month`), and a refresh only recomputes
+the marked months, so background runs that finish after a refresh are
+picked up by the next one however their ids interleave.
+
+Usage (from ``current/src``):
+
+    python -m core.services.revenue --refresh [--full]
+"""
+
+import argparse
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Union
+
+from sqlalchemy import select, func, insert, delete, literal
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from ..models import CalcRun, CalcRunLine, RevenueDirtyMonth, RevenueMonthly, TariffVersion
+from ..routing import RoutingSession
+
+UNCATEGORISED = 'uncategorised'
+
+
+def calc_run_lines(calc_run_id: int, result: Dict[str, Any]) -> List[dict]:
+    """Flatten a calculate_bill result's breakdown into calc_run_line rows."""
+    return [
+        {
+            'calc_run_id': calc_run_id,
+            'component_id': comp_id,
+            'category': line.get('category'),
+            'units_used': line.get('units_used'),
+            'unit_label': line.get('unit_label'),
+            'cost': line.get('cost', 0.0),
+        }
+        for comp_id, line in (result or {}).get('breakdown', {}).items()
+    ]
+
+
+def write_calc_run_lines(db: Session, calc_run_id: int, result: Dict[str, Any]) -> int:
+    """Bulk-insert the run's breakdown lines; the caller commits."""
+    rows = calc_run_lines(calc_run_id, result)
+    if rows:
+        db.execute(insert(CalcRunLine), rows)
+    return len(rows)
+
+
+def mark_revenue_month(db: Session, period_start: Union[date, datetime, None]) -> None:
+    """Queue the month of a run that just completed for the next refresh; the caller commits."""
+    if period_start is None:
+        return
+    month = date(period_start.year, period_start.month, 1)
+    engine = db.primary_engine if isinstance(db, RoutingSession) else db.get_bind()
+    # SQLite (used in tests) has its own upsert construct
+    upsert = sqlite_insert if engine.dialect.name == 'sqlite' else pg_insert
+    stmt = upsert(RevenueDirtyMonth).values(month=month, marked_at=func.now())
+    # Updating rather than ignoring a marked month locks its row, so a refresh
+    # taking the marks waits for this run to commit and then sees it
+    db.execute(stmt.on_conflict_do_update(index_elements=['month'], set_={'marked_at': stmt.excluded.marked_at}))
+
+
+def _latest_runs(month: date, next_month: date):
+    """Latest completed run per (customer, tariff version, period) starting in the month."""
+    return (
+        select(CalcRun.id, CalcRun.tariff_version_id)
+        .distinct(CalcRun.customer_id, CalcRun.tariff_version_id, CalcRun.period_start, CalcRun.period_end)
+        .where(
+            CalcRun.status == 'completed',
+            CalcRun.period_start >= month,
+            CalcRun.period_start < next_month,
+        )
+        .order_by(CalcRun.customer_id, CalcRun.tariff_version_id, CalcRun.period_start, CalcRun.period_end,
+                  CalcRun.id.desc())
+        .subquery('latest')
+    )
+
+
+def _refresh_month(db: Session, month: date) -> None:
+    next_month = date(month.year + month.month // 12, month.month % 12 + 1, 1)
+    latest = _latest_runs(month, next_month)
+    category = func.coalesce(CalcRunLine.category, UNCATEGORISED)
+    summary = (
+        select(
+            literal(month).label('month'),
+            TariffVersion.tariff_plan_id,
+            category.label('category'),
+            CalcRunLine.component_id,
+            func.count(func.distinct(CalcRunLine.calc_run_id)),
+            func.sum(CalcRunLine.units_used),
+            func.sum(CalcRunLine.cost),
+        )
+        .select_from(CalcRunLine)
+        .join(latest, latest.c.id == CalcRunLine.calc_run_id)
+        .join(TariffVersion, TariffVersion.id == latest.c.tariff_version_id)
+        .group_by(TariffVersion.tariff_plan_id, category, CalcRunLine.component_id)
+    )
+    db.execute(delete(RevenueMonthly).where(RevenueMonthly.month == month))
+    db.execute(insert(RevenueMonthly).from_select(
+        ['month', 'tariff_plan_id', 'category', 'component_id', 'bills', 'units_used', 'cost'], summary
+    ))
+
+
+def refresh_revenue_summary(db: Session, full: bool = False) -> List[date]:
+    """
+    Recompute the months marked by runs completed since the last refresh
+    (every month if ``full``) and commit. Returns the months refreshed.
+    """
+    marked = db.execute(
+        select(RevenueDirtyMonth.month).order_by(RevenueDirtyMonth.month).with_for_update()
+    ).scalars().all()
+    # A run completing from here on marks its month again for the next refresh
+    db.execute(delete(RevenueDirtyMonth).where(RevenueDirtyMonth.month.in_(marked)))
+    if full:
+        month_of = func.date_trunc('month', CalcRun.period_start)
+        months = [m.date() for m in db.execute(
+            select(month_of).distinct().where(
+                CalcRun.status == 'completed', CalcRun.period_start.isnot(None),
+            ).order_by(month_of)
+        ).scalars()]
+        db.execute(delete(RevenueMonthly))
+    else:
+        months = list(marked)
+    for month in months:
+        _refresh_month(db, month)
+    db.commit()
+    return months
+
+
+def revenue_by_month(db: Session, start_month: Optional[date] = None, end_month: Optional[date] = None,
+                     tariff_plan_id: Optional[int] = None, category: Optional[str] = None) -> List[dict]:
+    """Read summary rows for [start_month, end_month], optionally filtered."""
+    stmt = select(RevenueMonthly)
+    if start_month is not None:
+        stmt = stmt.where(RevenueMonthly.month >= start_month)
+    if end_month is not None:
+        stmt = stmt.where(RevenueMonthly.month <= end_month)
+    if tariff_plan_id is not None:
+        stmt = stmt.where(RevenueMonthly.tariff_plan_id == tariff_plan_id)
+    if category is not None:
+        stmt = stmt.where(RevenueMonthly.category == category)
+    stmt = stmt.order_by(RevenueMonthly.month, RevenueMonthly.tariff_plan_id,
+                         RevenueMonthly.category, RevenueMonthly.component_id)
+    return [
+        {
+            'month': str(row.month),
+            'tariff_plan_id': row.tariff_plan_id,
+            'category': row.category,
+            'component_id': row.component_id,
+            'bills': row.bills,
+            'units_used': float(row.units_used) if row.units_used is not None else None,
+            'cost': float(row.cost),
+        }
+        for row in db.execute(stmt).scalars()
+    ]
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Maintain monthly revenue summaries")
+    parser.add_argument('--refresh', action='store_true', help="Recompute months touched by new calc runs")
+    parser.add_argument('--full', action='store_true', help="Recompute every month")
+    args = parser.parse_args(argv)
+
+    from ..database import SessionLocal
+    db = SessionLocal()
+    try:
+        if args.refresh or args.full:
+            months = refresh_revenue_summary(db, full=args.full)
+            print(f"Refreshed {len(months)} month(s): {', '.join(str(m) for m in months) or '-'}")
+        else:
+            parser.print_help()
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
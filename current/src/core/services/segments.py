@@ -0,0 +1,137 @@
+"""
+Split a billing period into segments priced by a single tariff version and
+a fixed set of in-season components.
+
+A period is cut at:
+  * the ``effective_from`` / day after ``effective_to`` of every version of
+    the requested version's tariff plan that overlaps the period, and
+  * the ``season.from`` / day after ``season.to`` of every component of the
+    versions in force.
+
+Each segment is priced by the plan version in force on its first day (the
+latest ``effective_from`` wins); days not covered by any version fall back
+to the requested version, so single-version plans behave as before.
+
+Readings are fetched once for the whole period and accumulated per segment
+in a single ordered pass by :func:`aggregate_segments`.
+"""
+
+from datetime import datetime, date, time, timedelta
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+from sqlalchemy import select, or_
+from sqlalchemy.orm import Session
+
+from ..models import TariffVersion
+from ..readings import ReadingSeries, as_series
+from .timeband import bucket_totals
+from .tzindex import DEFAULT_TZ
+
+
+def _midnight(d: date) -> datetime:
+    return datetime.combine(d, time())
+
+
+def _season_boundaries(canonical: Dict[str, Any]) -> List[datetime]:
+    """Return the datetimes at which any component's season starts or ends."""
+    bounds = []
+    for comp in canonical.get('components', []):
+        season = comp.get('season')
+        if not season:
+            continue
+        try:
+            bounds.append(_midnight(datetime.strptime(season.get('from'), "%Y-%m-%d").date()))
+            bounds.append(_midnight(datetime.strptime(season.get('to'), "%Y-%m-%d").date() + timedelta(days=1)))
+        except Exception:
+            continue
+    return bounds
+
+
+def _version_in_force(versions: List[TariffVersion], day: date) -> Optional[TariffVersion]:
+    """Return the version effective on ``day``, preferring the latest start."""
+    in_force = [
+        tv for tv in versions
+        if tv.effective_from is not None and tv.effective_from <= day
+        and (tv.effective_to is None or day <= tv.effective_to)
+    ]
+    if not in_force:
+        return None
+    return max(in_force, key=lambda tv: (tv.effective_from, tv.version or 0, tv.id))
+
+
+def plan_segments(db: Session, tariff_version_id: int, start: datetime, end: datetime) -> List[Dict[str, Any]]:
+    """
+    Return the ordered segments covering [start, end).
+
+    Each segment is a dict with ``start``, ``end``, ``tariff_version_id`` and
+    ``canonical``. Returns an empty list if the requested version does not
+    exist.
+    """
+    tv = db.get(TariffVersion, tariff_version_id)
+    if not tv:
+        return []
+    siblings = [tv]
+    if tv.tariff_plan_id is not None:
+        siblings = db.execute(
+            select(TariffVersion).where(
+                TariffVersion.tariff_plan_id == tv.tariff_plan_id,
+                TariffVersion.effective_from < end.date() + timedelta(days=1),
+                or_(TariffVersion.effective_to.is_(None), TariffVersion.effective_to >= start.date()),
+            )
+        ).scalars().all() or [tv]
+
+    bounds = {start, end}
+    for sibling in siblings:
+        if sibling.effective_from is not None:
+            bounds.add(_midnight(sibling.effective_from))
+        if sibling.effective_to is not None:
+            bounds.add(_midnight(sibling.effective_to + timedelta(days=1)))
+    # Season edges of every version that may be in force
+    for sibling in set(siblings) | {tv}:
+        bounds.update(_season_boundaries(sibling.canonical_json or {}))
+    cuts = sorted(b for b in bounds if start <= b <= end)
+    if len(cuts) < 2:
+        # Empty period: keep the historical single-version behaviour
+        return [{'start': start, 'end': end, 'tariff_version_id': tv.id, 'canonical': tv.canonical_json or {}}]
+
+    segments: List[Dict[str, Any]] = []
+    for seg_start, seg_end in zip(cuts, cuts[1:]):
+        version = _version_in_force(siblings, seg_start.date()) or tv
+        if segments and segments[-1]['tariff_version_id'] == version.id \
+                and seg_start not in _season_boundaries(version.canonical_json or {}):
+            # Same version and no season edge here: extend the previous segment
+            segments[-1]['end'] = seg_end
+            continue
+        segments.append({
+            'start': seg_start,
+            'end': seg_end,
+            'tariff_version_id': version.id,
+            'canonical': version.canonical_json or {},
+        })
+    return segments
+
+
+def aggregate_segments(readings, segments: List[Dict[str, Any]]) -> List[Dict[str, float]]:
+    """
+    Accumulate ``(timestamp, kwh)`` readings ordered by timestamp (or a
+    :class:`~core.readings.ReadingSeries`) into the usage buckets of each
+    segment in one pass. Tz-aware timestamps are read in each segment's own
+    ``time_zones``.
+    """
+    if not isinstance(readings, ReadingSeries):
+        readings = list(readings)
+    ends = np.array([seg['end'] for seg in segments[:-1]], dtype='datetime64[m]').astype(np.int64)
+    by_zone: Dict[str, tuple] = {}
+    usages = []
+    for i, seg in enumerate(segments):
+        tz_name = seg['canonical'].get('time_zones') or DEFAULT_TZ
+        if tz_name not in by_zone:
+            series = as_series(readings, tz_name)
+            wall = series.wall_minutes()
+            # A reading belongs to the first segment whose end is after it
+            by_zone[tz_name] = (wall, series.kwh, np.searchsorted(ends, wall, side='right'))
+        wall, kwh, seg_idx = by_zone[tz_name]
+        in_seg = seg_idx == i
+        usages.append(bucket_totals(wall[in_seg], kwh[in_seg], seg['canonical']))
+    return usages
@@ -0,0 +1,157 @@
+"""
+Tariff upload checks and storage.
+
+Every tariff accepted by ``POST /tariffs`` passes :func:`validate_tariff`:
+
+  * the canonical schema (``docker/tariff_schema.json``), checked by a
+    validator built once per process rather than on every call;
+  * a dry compile of every component ``calculation`` (scalar and vectorized)
+    and one evaluation against the variables pricing provides, so unknown
+    names are reported here instead of the component being silently left
+    out of every bill;
+  * tier tables, unique component ids and the effective date range.
+
+Stored versions carry ``content_hash``, the sha256 of their canonical JSON,
+so re-uploading the same content is a no-op and checksums can use the hash
+instead of re-serialising the tariff.
+"""
+
+import hashlib
+import json
+import os
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from jsonschema import Draft7Validator
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session
+
+from ..models import TariffPlan, TariffVersion
+from .calc import _base_vars, _rate_value
+from .expr import compile_expression
+from .resolve import resolver
+
+SCHEMA_PATH = Path(os.getenv(
+    "TARIFF_SCHEMA_PATH", Path(__file__).resolve().parents[4] / "docker" / "tariff_schema.json"))
+
+
+@lru_cache(maxsize=1)
+def schema_validator() -> Draft7Validator:
+    """The canonical tariff schema, checked and compiled once."""
+    with open(SCHEMA_PATH) as f:
+        schema = json.load(f)
+    Draft7Validator.check_schema(schema)
+    return Draft7Validator(schema)
+
+
+def content_hash(canonical: Dict[str, Any]) -> str:
+    """sha256 of the canonical JSON encoding (sorted keys, no whitespace)."""
+    body = json.dumps(canonical, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+def _check_calculation(expr: str) -> Optional[str]:
+    start = datetime(2024, 1, 1)
+    variables = dict(_base_vars({}, start, start + timedelta(days=1)), rate=1.0, loss_factor=1.0)
+    try:
+        compile_expression(expr, vectorized=True)
+        compiled = compile_expression(expr)
+        with np.errstate(all='ignore'):
+            float(compiled(variables))
+    except ArithmeticError:
+        # Zero usage in the sample variables; the expression itself is fine
+        return None
+    except Exception as e:
+        return str(e)
+    return None
+
+
+def validate_tariff(canonical: Any) -> List[str]:
+    """Return the problems with a canonical tariff, empty if it can be stored."""
+    errors = [
+        f"{'/'.join(str(p) for p in err.absolute_path) or '<root>'}: {err.message}"
+        for err in sorted(schema_validator().iter_errors(canonical), key=lambda e: list(map(str, e.absolute_path)))
+    ]
+    if errors:
+        return errors
+
+    dates = {}
+    for key in ('effective_from', 'effective_to'):
+        if canonical.get(key) is not None:
+            try:
+                dates[key] = date.fromisoformat(canonical[key])
+            except ValueError as e:
+                errors.append(f"{key}: {e}")
+    if len(dates) == 2 and dates['effective_to'] < dates['effective_from']:
+        errors.append(f"effective_to: {dates['effective_to']} is before effective_from {dates['effective_from']}")
+    seen = set()
+    for i, comp in enumerate(canonical['components']):
+        where = f"components/{i}"
+        if comp['id'] in seen:
+            errors.append(f"{where}/id: duplicate component id {comp['id']!r}")
+        seen.add(comp['id'])
+        try:
+            _rate_value(comp, 0.0)
+        except (ValueError, TypeError) as e:
+            errors.append(f"{where}/rate_schedule: {e}")
+        problem = _check_calculation(comp['calculation'])
+        if problem:
+            errors.append(f"{where}/calculation: {problem}")
+    return errors
+
+
+def validate_tariffs(tariffs: List[Any]) -> Dict[str, Any]:
+    """Validate a batch; each result carries the content hash the tariff would be stored under."""
+    results = []
+    for i, canonical in enumerate(tariffs):
+        errors = validate_tariff(canonical)
+        results.append({
+            'index': i,
+            'valid': not errors,
+            'errors': errors,
+            'content_hash': None if errors else content_hash(canonical),
+        })
+    return {'valid': all(r['valid'] for r in results), 'results': results}
+
+
+def store_tariff_version(db: Session, tariff_plan_id: int, canonical: Dict[str, Any],
+                         uploaded_by: str) -> Tuple[Optional[TariffVersion], bool]:
+    """
+    Store a validated tariff as the plan's next version.
+
+    Returns ``(version, created)``; the existing version with the same content
+    is returned with ``created=False``, and ``(None, False)`` if the plan does
+    not exist. Commits.
+    """
+    # Lock the plan so concurrent uploads number their versions one after another
+    plan = db.execute(select(TariffPlan).where(TariffPlan.id == tariff_plan_id).with_for_update()).scalar_one_or_none()
+    if plan is None:
+        return None, False
+    digest = content_hash(canonical)
+    existing = db.execute(
+        select(TariffVersion).where(TariffVersion.tariff_plan_id == tariff_plan_id,
+                                    TariffVersion.content_hash == digest)
+    ).scalars().first()
+    if existing is not None:
+        db.rollback()
+        return existing, False
+    latest = db.execute(
+        select(func.max(TariffVersion.version)).where(TariffVersion.tariff_plan_id == tariff_plan_id)
+    ).scalar()
+    version = TariffVersion(
+        tariff_plan_id=tariff_plan_id,
+        canonical_json=canonical,
+        version=(latest or 0) + 1,
+        uploaded_by=uploaded_by,
+        effective_from=date.fromisoformat(canonical['effective_from']),
+        effective_to=date.fromisoformat(canonical['effective_to']) if canonical.get('effective_to') else None,
+        created_at=datetime.utcnow(),
+        content_hash=digest,
+    )
+    db.add(version)
+    db.commit()
+    resolver.invalidate(tariff_plan_id)
+    return version, True
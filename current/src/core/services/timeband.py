@@ -8,6 +8,13 @@ on bands and the special ``"all"`` day to match any day of the week.
 The assigner returns the ``id`` of the first matching band. If no bands
 match, it returns ``"off_peak"`` by default.
 
+:func:`assign_band` labels one timestamp. :func:`band_indices` and
+:func:`bucket_totals` label whole arrays of readings at once: each band set
+is compiled into minute-of-week masks (cached per band set) and readings are
+mapped to local minute of week through :mod:`tzindex`. Naive timestamps are
+local wall-clock time; tz-aware timestamps are converted into the tariff's
+``time_zones`` (default ``Australia/Melbourne``), so DST changes are handled.
+
 Note: This function intentionally does not handle demand‐specific windows
 (e.g. demand bands). Those should be accounted for in the calculation
 logic where rolling windows are applied. Here we focus on mapping
@@ -15,8 +22,15 @@ timestamps to simple usage categories like ``peak``, ``offpeak`` and
 ``shoulder``.
 """
 
+import json
 from datetime import datetime, date
-from typing import Dict, Any
+from functools import lru_cache
+from typing import Dict, Any, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+from .tzindex import DEFAULT_TZ, MINUTES_PER_WEEK, to_wall_minutes, minute_of_week
 
 
 def _in_date_ranges(ts_date: date, date_ranges: list) -> bool:
@@ -43,7 +57,8 @@ def assign_band(ts: datetime, canonical: Dict[str, Any]) -> str:
     Parameters
     ----------
     ts : datetime
-        The timestamp of a meter reading.
+        The timestamp of a meter reading. Naive timestamps are local time;
+        aware ones are converted into the tariff's ``time_zones``.
     canonical : dict
         The canonical tariff JSON containing ``time_bands`` definitions.
 
@@ -53,6 +68,8 @@ def assign_band(ts: datetime, canonical: Dict[str, Any]) -> str:
         The ``id`` of the first matching time band, or ``"off_peak"`` if
         none match.
     """
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(ZoneInfo(canonical.get("time_zones") or DEFAULT_TZ))
     ts_date = ts.date()
     day_abbr = ts.strftime("%a").lower()[:3]  # e.g. 'mon', 'tue'
     time_str = ts.strftime("%H:%M")
@@ -78,3 +95,131 @@ def assign_band(ts: datetime, canonical: Dict[str, Any]) -> str:
                 return band.get("id", "off_peak")
     # Default band if none matched
     return "off_peak"
+
+
+_PEAK_BANDS = ('peak', 'usage_peak', 'retail_peak', 'network_peak')
+_SHOULDER_BANDS = ('shoulder', 'usage_shoulder', 'retail_shoulder', 'network_shoulder')
+
+
+def usage_bucket(band_id: Optional[str]) -> str:
+    """Map a time band id onto the usage bucket it contributes to."""
+    b = (band_id or '').lower()
+    # Treat variations of peak / offpeak / shoulder identically
+    if b in _PEAK_BANDS:
+        return 'peak_usage'
+    if b in _SHOULDER_BANDS:
+        return 'shoulder_usage'
+    # offpeak or any other band falls into off_peak_usage by default
+    return 'off_peak_usage'
+
+
+BUCKETS = ('off_peak_usage', 'peak_usage', 'shoulder_usage')
+_WEEKDAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+_EPOCH = date(1970, 1, 1)
+
+
+def band_set_key(canonical: Dict[str, Any]) -> str:
+    """Return a stable key identifying a tariff's ``time_bands`` definition."""
+    return json.dumps(canonical.get("time_bands", []), sort_keys=True, separators=(",", ":"))
+
+
+def _epoch_day(value: str) -> int:
+    return (datetime.strptime(value, "%Y-%m-%d").date() - _EPOCH).days
+
+
+def _compile_band(band: Dict[str, Any]):
+    """Return (minute-of-week mask, date ranges in epoch days or None) for a band."""
+    # Same HH:MM string comparison as assign_band, evaluated once per minute of day
+    day_minutes = [f"{m // 60:02d}:{m % 60:02d}" for m in range(1440)]
+    in_day = np.zeros(1440, dtype=bool)
+    for span in band.get("times", []):
+        start_time = span.get("from")
+        end_time = span.get("to")
+        if start_time is None or end_time is None:
+            continue
+        in_day |= np.array([start_time <= t < end_time for t in day_minutes])
+    days_list = [d.lower() for d in band.get("days", [])]
+    mask = np.zeros(MINUTES_PER_WEEK, dtype=bool)
+    for i, abbr in enumerate(_WEEKDAYS):
+        if 'all' in days_list or abbr in days_list:
+            mask[i * 1440:(i + 1) * 1440] = in_day
+    ranges = None
+    if band.get("date_ranges"):
+        ranges = []
+        for r in band["date_ranges"]:
+            try:
+                ranges.append((_epoch_day(r.get("from")), _epoch_day(r.get("to"))))
+            except Exception:
+                # If parsing fails, skip that range
+                continue
+    return mask, ranges
+
+
+def compile_band_set(canonical: Dict[str, Any]):
+    """
+    Compile a tariff's ``time_bands`` once per distinct band set.
+
+    Returns ``(labels, bands, week_table)``: ``labels`` lists band ids with
+    ``"off_peak"`` appended as the default, ``bands`` holds each band's
+    minute-of-week mask and date ranges, and ``week_table`` maps minute of
+    week straight to a label index when no band has date ranges (else None).
+    """
+    return _compile_band_set(band_set_key(canonical))
+
+
+@lru_cache(maxsize=256)
+def _compile_band_set(key: str):
+    time_bands = json.loads(key)
+    labels = tuple(band.get("id", "off_peak") for band in time_bands) + ("off_peak",)
+    bands = [_compile_band(band) for band in time_bands]
+    week_table = None
+    if all(ranges is None for _, ranges in bands):
+        week_table = np.full(MINUTES_PER_WEEK, len(bands), dtype=np.int64)
+        # Apply in reverse so the first matching band wins
+        for i in range(len(bands) - 1, -1, -1):
+            week_table[bands[i][0]] = i
+    return labels, bands, week_table
+
+
+def band_indices_wall(wall_minutes: np.ndarray, canonical: Dict[str, Any]) -> Tuple[tuple, np.ndarray]:
+    """Label local wall minutes since the epoch; returns (labels, label index per minute)."""
+    labels, bands, week_table = compile_band_set(canonical)
+    wall_minutes = np.asarray(wall_minutes, dtype=np.int64)
+    mow = minute_of_week(wall_minutes)
+    if week_table is not None:
+        return labels, week_table[mow]
+    days = wall_minutes // 1440
+    idx = np.full(len(wall_minutes), len(bands), dtype=np.int64)
+    unassigned = np.ones(len(wall_minutes), dtype=bool)
+    for i, (mask, ranges) in enumerate(bands):
+        hit = mask[mow] & unassigned
+        if ranges is not None:
+            in_ranges = np.zeros(len(wall_minutes), dtype=bool)
+            for frm, to in ranges:
+                in_ranges |= (days >= frm) & (days <= to)
+            hit &= in_ranges
+        idx[hit] = i
+        unassigned &= ~hit
+    return labels, idx
+
+
+def band_indices(timestamps, canonical: Dict[str, Any]) -> Tuple[tuple, np.ndarray]:
+    """Vectorized :func:`assign_band`; returns (labels, label index per timestamp)."""
+    wall = to_wall_minutes(timestamps, canonical.get("time_zones") or DEFAULT_TZ)
+    return band_indices_wall(wall, canonical)
+
+
+def bucket_indices_wall(wall_minutes: np.ndarray, canonical: Dict[str, Any]) -> np.ndarray:
+    """Return the :data:`BUCKETS` index of each local wall minute."""
+    labels, idx = band_indices_wall(wall_minutes, canonical)
+    label_bucket = np.array([BUCKETS.index(usage_bucket(label)) for label in labels], dtype=np.int64)
+    return label_bucket[idx]
+
+
+def bucket_totals(wall_minutes: np.ndarray, kwh: np.ndarray, canonical: Dict[str, Any]) -> Dict[str, float]:
+    """Sum kWh at local wall minutes into the usage buckets used by expressions."""
+    kwh = np.asarray(kwh, dtype=np.float64)
+    sums = np.bincount(bucket_indices_wall(wall_minutes, canonical), weights=kwh, minlength=len(BUCKETS))
+    usage = {'total_usage': float(kwh.sum())}
+    usage.update({name: float(sums[i]) for i, name in enumerate(BUCKETS)})
+    return usage
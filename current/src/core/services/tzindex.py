@@ -0,0 +1,175 @@
+"""
+Precomputed UTC-offset transition tables per (time zone, year).
+
+Band assignment needs the local wall-clock minute of every reading. Calling
+``tz_localize``/``tz_convert`` or ``zoneinfo`` per reading is slow, so each
+(zone, year) pair is probed once and cached as two arrays: the UTC instants
+(epoch seconds) at which the offset changes and the offset in force from
+each instant. Converting any number of instants is then one
+``np.searchsorted`` plus an add.
+
+Conventions:
+  * UTC instants are int64 epoch seconds (or tz-aware datetimes).
+  * Local wall times are int64 "wall epoch" seconds: the local clock reading
+    expressed as if it were UTC. Naive ``meter_reading.timestamp`` values are
+    local wall times in the tariff's ``time_zones``.
+  * Minute of week counts from Monday 00:00 local (0..10079).
+"""
+
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Tuple, Iterable
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+
+DEFAULT_TZ = "Australia/Melbourne"
+MINUTES_PER_WEEK = 7 * 24 * 60
+# 1970-01-01 was a Thursday; shift so Monday is day 0
+_EPOCH_WEEKDAY = 3
+
+
+def _offset(tz: ZoneInfo, epoch: int) -> int:
+    return int(datetime.fromtimestamp(epoch, tz).utcoffset().total_seconds())
+
+
+@lru_cache(maxsize=256)
+def year_transitions(tz_name: str, year: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Return ``(utc_starts, offsets)`` covering ``year`` in zone ``tz_name``.
+
+    ``utc_starts[i]`` is the UTC epoch second from which ``offsets[i]``
+    (seconds east of UTC) applies. The first entry starts at the beginning
+    of the year. Offsets are probed hourly and transitions refined to the
+    second by bisection, so the table is built once per (zone, year).
+    """
+    tz = ZoneInfo(tz_name)
+    start = int(datetime(year, 1, 1, tzinfo=timezone.utc).timestamp()) - 14 * 3600
+    end = int(datetime(year + 1, 1, 1, tzinfo=timezone.utc).timestamp()) + 14 * 3600
+    starts = [start]
+    offsets = [_offset(tz, start)]
+    prev = start
+    for probe in range(start + 3600, end + 3600, 3600):
+        off = _offset(tz, probe)
+        if off != offsets[-1]:
+            lo, hi = prev, probe
+            while hi - lo > 1:
+                mid = (lo + hi) // 2
+                if _offset(tz, mid) == offsets[-1]:
+                    lo = mid
+                else:
+                    hi = mid
+            starts.append(hi)
+            offsets.append(off)
+        prev = probe
+    return np.asarray(starts, dtype=np.int64), np.asarray(offsets, dtype=np.int64)
+
+
+def transitions(tz_name: str, first_year: int, last_year: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Concatenate cached yearly tables for ``first_year..last_year`` inclusive."""
+    parts = [year_transitions(tz_name, y) for y in range(first_year, last_year + 1)]
+    if len(parts) == 1:
+        return parts[0]
+    starts = np.concatenate([p[0] for p in parts])
+    offsets = np.concatenate([p[1] for p in parts])
+    # Yearly tables overlap by a few hours at the edges; keep the sorted union
+    order = np.argsort(starts, kind='stable')
+    starts, offsets = starts[order], offsets[order]
+    keep = np.ones(len(starts), dtype=bool)
+    keep[1:] = starts[1:] > starts[:-1]
+    return starts[keep], offsets[keep]
+
+
+def _year_span(epoch: np.ndarray) -> Tuple[int, int]:
+    first = datetime.fromtimestamp(int(epoch.min()), timezone.utc).year
+    last = datetime.fromtimestamp(int(epoch.max()), timezone.utc).year
+    return first, last
+
+
+def utc_to_wall(utc_epoch: np.ndarray, tz_name: str = DEFAULT_TZ) -> np.ndarray:
+    """Convert UTC epoch seconds to local wall epoch seconds."""
+    utc_epoch = np.asarray(utc_epoch, dtype=np.int64)
+    if utc_epoch.size == 0:
+        return utc_epoch.copy()
+    starts, offsets = transitions(tz_name, *_year_span(utc_epoch))
+    idx = np.maximum(np.searchsorted(starts, utc_epoch, side='right') - 1, 0)
+    return utc_epoch + offsets[idx]
+
+
+def wall_to_utc(wall_epoch: np.ndarray, tz_name: str = DEFAULT_TZ, ambiguous: str = "infer") -> np.ndarray:
+    """
+    Convert local wall epoch seconds to UTC epoch seconds.
+
+    Wall times repeated when clocks go back are resolved by ``ambiguous``:
+    ``"earlier"`` (daylight time), ``"later"`` (standard time) or ``"infer"``
+    (the first occurrence in array order is earlier, repeats are later, as
+    for ordered interval data). Wall times skipped when clocks go forward
+    are shifted forward to the transition instant.
+    """
+    wall_epoch = np.asarray(wall_epoch, dtype=np.int64)
+    if wall_epoch.size == 0:
+        return wall_epoch.copy()
+    first, last = _year_span(wall_epoch)
+    starts, offsets = transitions(tz_name, first - 1 if first > 1 else first, last)
+
+    def offset_at(utc):
+        return offsets[np.maximum(np.searchsorted(starts, utc, side='right') - 1, 0)]
+
+    # Transitions are months apart, so a day either side gives the offsets in
+    # force before and after any transition affecting this wall time
+    before = offset_at(wall_epoch - 86400)
+    after = offset_at(wall_epoch + 86400)
+    cand_a = wall_epoch - before
+    cand_b = wall_epoch - after
+    a_ok = offset_at(cand_a) == before
+    b_ok = offset_at(cand_b) == after
+    lo = np.minimum(cand_a, cand_b)
+    hi = np.maximum(cand_a, cand_b)
+    lo_ok = np.where(cand_a <= cand_b, a_ok, b_ok)
+    hi_ok = np.where(cand_a <= cand_b, b_ok, a_ok)
+
+    if ambiguous == "later":
+        use_hi = hi_ok
+    elif ambiguous == "earlier":
+        use_hi = hi_ok & ~lo_ok
+    elif ambiguous == "infer":
+        prior_max = np.maximum.accumulate(np.concatenate([[np.iinfo(np.int64).min], wall_epoch[:-1]]))
+        repeated = wall_epoch <= prior_max
+        use_hi = hi_ok & (~lo_ok | repeated)
+    else:
+        raise ValueError(f"Unsupported ambiguous policy: {ambiguous}")
+    utc = np.where(use_hi, hi, lo)
+
+    # Non-existent wall times: move to the start of the offset period they fall in
+    missing = ~lo_ok & ~hi_ok
+    if missing.any():
+        idx = np.maximum(np.searchsorted(starts, hi[missing], side='right') - 1, 0)
+        utc[missing] = starts[idx]
+    return utc
+
+
+def to_wall_minutes(timestamps: Iterable, tz_name: str = DEFAULT_TZ) -> np.ndarray:
+    """
+    Return local wall-clock minutes since the epoch for each timestamp.
+
+    Naive datetimes (and ``datetime64``) are taken as local wall time;
+    tz-aware datetimes are converted into ``tz_name`` through the cached
+    transition table.
+    """
+    if isinstance(timestamps, np.ndarray) and np.issubdtype(timestamps.dtype, np.datetime64):
+        return timestamps.astype('datetime64[m]').astype(np.int64)
+    timestamps = list(timestamps)
+    if not timestamps:
+        return np.zeros(0, dtype=np.int64)
+    if getattr(timestamps[0], 'tzinfo', None) is None:
+        return np.array(timestamps, dtype='datetime64[m]').astype(np.int64)
+    utc = np.fromiter((int(ts.timestamp()) for ts in timestamps), dtype=np.int64, count=len(timestamps))
+    return utc_to_wall(utc, tz_name) // 60
+
+
+def minute_of_week(wall_minutes: np.ndarray) -> np.ndarray:
+    """Map wall minutes since the epoch to minute of week from Monday 00:00."""
+    wall_minutes = np.asarray(wall_minutes, dtype=np.int64)
+    days = wall_minutes // 1440
+    return ((days + _EPOCH_WEEKDAY) % 7) * 1440 + wall_minutes % 1440
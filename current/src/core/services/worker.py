@@ -0,0 +1,268 @@
+"""
+Background calc_runs worker pool.
+
+``POST /calculate`` with ``background: true`` inserts a ``pending`` calc_runs
+row (see :func:`enqueue_calc_run`) and returns straight away. Workers claim
+pending rows with ``SELECT ... FOR UPDATE SKIP LOCKED``, so any number of
+worker processes, on any number of hosts, can share one Postgres queue
+without handing the same run to two of them.
+
+Each claimed run moves through the ``status`` values already allowed by the
+schema:
+
+  pending -> running -> completed
+                     -> pending (retry after backoff) -> ... -> failed
+
+``started_at``/``finished_at`` record the last attempt, ``attempts`` counts
+attempts and ``available_at`` holds back a retried run until its backoff has
+elapsed. A claim is a lease: a run still ``running`` ``--visibility-timeout``
+seconds after it started is assumed lost with its worker (OOM, deploy,
+SIGKILL) and is claimed again as its next attempt, or marked failed once it
+has had ``max_attempts``. The timeout must exceed the longest bill.
+
+The billing period travels in ``result_summary_json['_meta']``, the same
+place :func:`calc.upsert_calc_run` stores it.
+
+Usage (from ``current/src``):
+
+    python -m core.services.worker --processes 4
+"""
+
+import argparse
+import logging
+import multiprocessing
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Optional, List
+
+from sqlalchemy import select, func, and_, or_
+from sqlalchemy.orm import Session
+
+from ..log import configure_logging
+from ..notify import start_listener
+from ..models import CalcRun
+from ..routing import RoutingSession
+from .calc import calculate_bill, fetch_readings
+from .checksum import compute_checksum
+from .revenue import mark_revenue_month, write_calc_run_lines
+
+logger = logging.getLogger(__name__)
+
+PENDING, RUNNING, COMPLETED, FAILED = 'pending', 'running', 'completed', 'failed'
+
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_BASE_DELAY = 5.0
+DEFAULT_MAX_DELAY = 600.0
+DEFAULT_VISIBILITY_TIMEOUT = 900.0
+
+
+def enqueue_calc_run(db: Session, customer_id: int, tariff_version_id: int, start: datetime, end: datetime) -> int:
+    """Insert a pending calc_runs row for the period and return its id."""
+    row = CalcRun(
+        customer_id=customer_id,
+        tariff_version_id=tariff_version_id,
+        status=PENDING,
+        started_at=None,
+        attempts=0,
+        available_at=func.now(),
+        period_start=start,
+        period_end=end,
+        result_summary_json={'_meta': {'start': str(start), 'end': str(end)}},
+    )
+    db.add(row)
+    db.commit()
+    db.refresh(row)
+    return row.id
+
+
+def retry_delay(attempts: int, base_delay: float = DEFAULT_BASE_DELAY, max_delay: float = DEFAULT_MAX_DELAY) -> float:
+    """Exponential backoff with full jitter for the retry after ``attempts`` attempts."""
+    return random.uniform(0, min(max_delay, base_delay * 2 ** max(0, attempts - 1)))
+
+
+def now_plus(db: Session, seconds: float):
+    """
+    SQL for the primary's current time plus ``seconds``, for leases and
+    backoffs kept on one clock across hosts. SQLite (used in tests) has no
+    interval arithmetic.
+    """
+    engine = db.primary_engine if isinstance(db, RoutingSession) else db.get_bind()
+    if engine.dialect.name == 'sqlite':
+        return func.datetime('now', f'{seconds:+.3f} seconds')
+    return func.now() + timedelta(seconds=seconds)
+
+
+def claim_calc_run(db: Session, visibility_timeout: float = DEFAULT_VISIBILITY_TIMEOUT,
+                   max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> Optional[CalcRun]:
+    """
+    Claim the oldest runnable run and mark it running.
+
+    Runnable runs are pending ones whose backoff has elapsed and running
+    ones whose lease (``visibility_timeout`` seconds from ``started_at``)
+    has expired; an expired run that has used up ``max_attempts`` is marked
+    failed instead. Rows locked by other workers are skipped rather than
+    waited on. The claim is committed before the run is priced, so the row
+    lock is held only for the duration of the claim.
+    """
+    while True:
+        row = db.execute(
+            select(CalcRun).where(or_(
+                and_(CalcRun.status == PENDING,
+                     or_(CalcRun.available_at.is_(None), CalcRun.available_at <= func.now())),
+                and_(CalcRun.status == RUNNING, CalcRun.started_at <= now_plus(db, -visibility_timeout)),
+            )).order_by(CalcRun.available_at, CalcRun.id).limit(1).with_for_update(skip_locked=True)
+        ).scalars().first()
+        if row is None:
+            db.rollback()
+            return None
+        if row.status != RUNNING:
+            break
+        logger.warning("calc run %s attempt %s lease expired; worker presumed lost", row.id, row.attempts)
+        row.last_error = f"attempt {row.attempts} abandoned: lease expired after {visibility_timeout:g}s"
+        if (row.attempts or 0) < max_attempts:
+            break
+        row.status = FAILED
+        row.finished_at = func.now()
+        db.commit()
+    row.status = RUNNING
+    row.attempts = (row.attempts or 0) + 1
+    row.started_at = func.now()
+    row.finished_at = None
+    db.commit()
+    db.refresh(row)
+    return row
+
+
+def _held(db: Session, run_id: int, attempt: int) -> Optional[CalcRun]:
+    """
+    The run, locked, if attempt ``attempt`` still holds it; None once its
+    lease expired and the run was claimed again (or finished) elsewhere.
+    """
+    row = db.execute(
+        select(CalcRun).where(CalcRun.id == run_id).with_for_update().execution_options(populate_existing=True)
+    ).scalars().first()
+    if row is None or row.status != RUNNING or row.attempts != attempt:
+        return None
+    return row
+
+
+def _lost(db: Session, run_id: int, attempt: int) -> str:
+    db.rollback()
+    logger.warning("calc run %s attempt %s lost its lease; result dropped", run_id, attempt)
+    return db.execute(select(CalcRun.status).where(CalcRun.id == run_id)).scalar() or FAILED
+
+
+def execute_calc_run(db: Session, row: CalcRun, max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+                     base_delay: float = DEFAULT_BASE_DELAY, max_delay: float = DEFAULT_MAX_DELAY) -> str:
+    """
+    Price a claimed run and store the result; returns the new status.
+
+    Failures are rescheduled with backoff until ``max_attempts`` attempts
+    have been made, after which the run is marked failed. Either way the
+    row is re-read under lock first: an attempt whose lease expired and
+    whose run was claimed again stores nothing and returns the run's
+    current status, so only one attempt ever writes a run's lines.
+    """
+    run_id, attempt = row.id, row.attempts
+    try:
+        meta = (row.result_summary_json or {}).get('_meta', {})
+        start = datetime.fromisoformat(meta['start'])
+        end = datetime.fromisoformat(meta['end'])
+        readings = fetch_readings(db, row.customer_id, start, end)
+        checksum = compute_checksum(db, row.customer_id, row.tariff_version_id, start, end, readings=readings)
+        result = calculate_bill(db, row.customer_id, row.tariff_version_id, start, end, readings=readings)
+        row = _held(db, run_id, attempt)
+        if row is None:
+            return _lost(db, run_id, attempt)
+        row.result_summary_json = {
+            '_meta': {'start': str(start), 'end': str(end), 'checksum': checksum},
+            'result': result
+        }
+        row.status = COMPLETED
+        row.last_error = None
+        row.finished_at = func.now()
+        write_calc_run_lines(db, run_id, result)
+        mark_revenue_month(db, row.period_start)
+        db.commit()
+        return COMPLETED
+    except Exception as exc:
+        db.rollback()
+        row = _held(db, run_id, attempt)
+        if row is None:
+            return _lost(db, run_id, attempt)
+        row.last_error = f"{type(exc).__name__}: {exc}"
+        row.finished_at = func.now()
+        if (row.attempts or 0) < max_attempts:
+            row.status = PENDING
+            row.available_at = now_plus(db, retry_delay(row.attempts or 0, base_delay, max_delay))
+        else:
+            row.status = FAILED
+        db.commit()
+        logger.warning("calc run %s attempt %s failed: %s", run_id, row.attempts, row.last_error)
+        return row.status
+
+
+def run_worker(poll_interval: float = 1.0, max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+               base_delay: float = DEFAULT_BASE_DELAY, max_delay: float = DEFAULT_MAX_DELAY,
+               max_runs: Optional[int] = None, visibility_timeout: float = DEFAULT_VISIBILITY_TIMEOUT) -> int:
+    """
+    Claim and execute runs until ``max_runs`` have been processed (forever
+    if None), sleeping ``poll_interval`` seconds whenever the queue is empty.
+    Returns the number of runs processed.
+    """
+    from ..database import engine, read_engine, SessionLocal
+    # Connections inherited across fork must not be shared with the parent
+    engine.dispose()
+    if read_engine is not None:
+        read_engine.dispose()
+    # One cache invalidation listener per process; threads don't survive fork
+    start_listener()
+    processed = 0
+    while max_runs is None or processed < max_runs:
+        db = SessionLocal()
+        try:
+            row = claim_calc_run(db, visibility_timeout, max_attempts)
+            if row is None:
+                time.sleep(poll_interval)
+                continue
+            execute_calc_run(db, row, max_attempts, base_delay, max_delay)
+            processed += 1
+        finally:
+            db.close()
+    return processed
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Process pending calc_runs in the background")
+    parser.add_argument('--processes', type=int, default=1, help="Worker processes to start")
+    parser.add_argument('--poll-interval', type=float, default=1.0, help="Seconds to wait when the queue is empty")
+    parser.add_argument('--max-attempts', type=int, default=DEFAULT_MAX_ATTEMPTS)
+    parser.add_argument('--base-delay', type=float, default=DEFAULT_BASE_DELAY, help="Initial retry backoff (s)")
+    parser.add_argument('--max-delay', type=float, default=DEFAULT_MAX_DELAY, help="Retry backoff cap (s)")
+    parser.add_argument('--visibility-timeout', type=float, default=DEFAULT_VISIBILITY_TIMEOUT,
+                        help="Seconds after which a running run is presumed lost and claimed again")
+    args = parser.parse_args(argv)
+
+    configure_logging(fmt="%(asctime)s %(processName)s %(levelname)s %(message)s")
+    worker_args = (args.poll_interval, args.max_attempts, args.base_delay, args.max_delay, None,
+                   args.visibility_timeout)
+    if args.processes <= 1:
+        run_worker(*worker_args)
+        return
+    procs = [
+        multiprocessing.Process(target=run_worker, args=worker_args, name=f"calc-worker-{i}")
+        for i in range(args.processes)
+    ]
+    for proc in procs:
+        proc.start()
+    try:
+        for proc in procs:
+            proc.join()
+    except KeyboardInterrupt:
+        for proc in procs:
+            proc.terminate()
+
+
+if __name__ == '__main__':
+    main()
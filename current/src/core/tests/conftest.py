@@ -0,0 +1,89 @@
+# core/tests/conftest.py
+"""
+Shared fixtures: an in-memory SQLite database with every table, for services
+whose queries do not depend on PostgreSQL, and a throwaway schema on a
+PostgreSQL server (``TEST_DATABASE_URL``) for those that do. Replica routing
+tests read from ``TEST_REPLICA_DATABASE_URL``, or from a second schema on the
+same server standing in for a standalone second instance.
+"""
+
+import os
+import sys
+import uuid
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import BigInteger, create_engine, text
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+sys.path.append(os.path.abspath(os.path.join(__file__, "..", "..", "..")))
+
+from core.database import DATABASE_URL
+from core.models import Base
+
+
+def pytest_configure(config):
+    # NUMERIC columns round-trip through floats on SQLite; readings here have 4 decimals at most
+    config.addinivalue_line("filterwarnings", "ignore:Dialect sqlite.*Decimal")
+    # Plain DISTINCT is enough where tests store one run per (customer, version, period)
+    config.addinivalue_line("filterwarnings", "ignore:DISTINCT ON is currently supported only")
+    config.addinivalue_line("markers", "postgres: needs a PostgreSQL server; skipped when none is reachable")
+
+
+@compiles(JSONB, 'sqlite')
+def _jsonb_as_json(type_, compiler, **kw):
+    return 'JSON'
+
+
+@compiles(BigInteger, 'sqlite')
+def _bigint_as_integer(type_, compiler, **kw):
+    # Only INTEGER PRIMARY KEY columns autoincrement on SQLite
+    return 'INTEGER'
+
+
+@pytest.fixture
+def db():
+    # One shared connection, so API tests see the same database from the request thread
+    engine = create_engine("sqlite://", future=True, poolclass=StaticPool, connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine)
+    with Session(engine, future=True) as session:
+        yield session
+
+
+@contextmanager
+def _pg_schema(url):
+    pytest.importorskip("psycopg2")
+    url = url.replace("postgresql://", "postgresql+psycopg2://")
+    # Own schema, so nothing outside it is touched
+    schema = f"test_{uuid.uuid4().hex[:8]}"
+    engine = create_engine(url, future=True, connect_args={"connect_timeout": 2, "options": f"-csearch_path={schema}"})
+    try:
+        with engine.begin() as conn:
+            conn.execute(text(f"CREATE SCHEMA {schema}"))
+    except Exception as e:
+        pytest.skip(f"no PostgreSQL server: {e}")
+    Base.metadata.create_all(engine)
+    try:
+        yield engine
+    finally:
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP SCHEMA {schema} CASCADE"))
+        engine.dispose()
+
+
+@pytest.fixture
+def pg_db():
+    with _pg_schema(os.getenv("TEST_DATABASE_URL", DATABASE_URL)) as engine:
+        with Session(engine, future=True) as session:
+            yield session
+
+
+@pytest.fixture
+def pg_engines():
+    """(primary, replica) engines, each with its own copy of every table."""
+    url = os.getenv("TEST_DATABASE_URL", DATABASE_URL)
+    with _pg_schema(url) as primary, _pg_schema(os.getenv("TEST_REPLICA_DATABASE_URL", url)) as replica:
+        yield primary, replica
@@ -0,0 +1,88 @@
+# core/tests/test_admission.py
+"""
+Admission limiters queue within bounds and reject fast with 429/503 beyond them.
+"""
+
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(__file__, "..", "..", "..")))
+
+from core.services.admission import AdmissionLimiter, AdmissionRejected, estimate_readings
+
+
+def test_estimate_readings_counts_intervals_per_customer():
+    start, end = datetime(2024, 1, 1), datetime(2024, 1, 2)
+    assert estimate_readings(start, end) == 48
+    assert estimate_readings(start, end, customers=3, interval_minutes=15) == 288
+    assert estimate_readings(end, start) == 1
+
+
+def test_full_queue_rejects_with_429():
+    limiter = AdmissionLimiter('t', max_concurrent=1, max_queue=0, max_wait=1.0)
+    limiter.acquire()
+    with pytest.raises(AdmissionRejected) as exc:
+        limiter.acquire()
+    assert exc.value.status_code == 429
+    assert exc.value.retry_after >= 1
+    assert limiter.snapshot()['rejected_queue_full'] == 1
+
+
+def test_queued_request_times_out_with_503():
+    limiter = AdmissionLimiter('t', max_concurrent=1, max_queue=1, max_wait=0.05)
+    limiter.acquire()
+    with pytest.raises(AdmissionRejected) as exc:
+        limiter.acquire()
+    assert exc.value.status_code == 503
+    snap = limiter.snapshot()
+    assert snap['rejected_timeout'] == 1
+    assert snap['queue_depth'] == 0
+
+
+def test_released_slot_admits_waiter():
+    limiter = AdmissionLimiter('t', max_concurrent=1, max_queue=1, max_wait=5.0)
+    limiter.acquire()
+    admitted = threading.Event()
+
+    def waiter():
+        limiter.acquire()
+        admitted.set()
+
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    time.sleep(0.05)
+    assert limiter.snapshot()['queue_depth'] == 1
+    limiter.release(elapsed=0.01)
+    thread.join(timeout=1)
+    assert admitted.is_set()
+    assert limiter.snapshot()['in_flight'] == 1
+
+
+def test_cost_budget_limits_heavy_requests_but_admits_oversized_alone():
+    limiter = AdmissionLimiter('t', max_concurrent=4, max_queue=0, max_wait=1.0, max_cost=100)
+    limiter.acquire(500)
+    with pytest.raises(AdmissionRejected):
+        limiter.acquire(1)
+    limiter.release(500)
+    limiter.acquire(60)
+    with pytest.raises(AdmissionRejected):
+        limiter.acquire(60)
+    limiter.acquire(40)
+    assert limiter.snapshot()['cost_in_flight'] == 100
+
+
+def test_held_slot_is_released_once_with_its_elapsed_time():
+    limiter = AdmissionLimiter('t', max_concurrent=2, max_queue=0, max_wait=1.0)
+    release = limiter.hold(cost=10)
+    limiter.acquire()
+    # The stream's finally and the response's background task both call it
+    release()
+    release()
+    snapshot = limiter.snapshot()
+    assert (snapshot['in_flight'], snapshot['cost_in_flight']) == (1, 1)
+    assert snapshot['seconds_per_reading'] is not None
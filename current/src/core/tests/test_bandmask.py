@@ -0,0 +1,59 @@
+# core/tests/test_bandmask.py
+"""
+Cached period band masks must label slots like assign_band and turn interval
+vectors into the same usage buckets as per-reading aggregation.
+"""
+
+import os
+import sys
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(__file__, "..", "..", "..")))
+
+from core.services.bandmask import (
+    interval_matrix, interval_vector, period_band_mask, segment_slots, usage_from_vectors,
+)
+from core.services.calc import aggregate_usage
+from core.services.timeband import BUCKETS, assign_band, usage_bucket
+
+
+TARIFF = {
+    "time_zones": "Australia/Melbourne",
+    "time_bands": [
+        {"id": "peak", "days": ["mon", "tue", "wed", "thu", "fri"], "times": [{"from": "07:00", "to": "19:00"}]},
+        {"id": "shoulder", "days": ["sat", "sun"], "times": [{"from": "07:00", "to": "22:00"}]},
+    ],
+}
+START = datetime(2024, 3, 1)
+END = datetime(2024, 4, 1)
+
+
+def test_mask_matches_assign_band_and_is_cached():
+    index, one_hot = period_band_mask(TARIFF, START, END)
+    slots = [START + timedelta(minutes=30 * i) for i in range(len(index))]
+    assert len(slots) == 31 * 48
+    assert [BUCKETS[i] for i in index] == [usage_bucket(assign_band(ts, TARIFF)) for ts in slots]
+    assert one_hot.sum(axis=0).tolist() == np.bincount(index, minlength=len(BUCKETS)).tolist()
+    assert period_band_mask(dict(TARIFF), START, END)[0] is index
+
+
+def test_vector_usage_matches_per_reading_aggregation():
+    readings = [(START + timedelta(minutes=5 * i), 0.1 + (i % 13) * 0.01) for i in range(31 * 288)]
+    _, one_hot = period_band_mask(TARIFF, START, END)
+    usage = usage_from_vectors(interval_vector(readings, START, END), one_hot)
+    expected = aggregate_usage(readings, TARIFF)
+    assert usage == pytest.approx(expected)
+
+
+def test_batch_matrix_rows_and_segment_slices():
+    readings = [(cid, START + timedelta(minutes=30 * i), float(cid)) for cid in (7, 3) for i in range(48)]
+    vectors = interval_matrix(readings, [3, 7, 11], START, END)
+    assert vectors.sum(axis=1).tolist() == [3.0 * 48, 7.0 * 48, 0.0]
+    seg = segment_slots(START, datetime(2024, 3, 2), END)
+    assert (seg.start, seg.stop) == (48, 31 * 48)
+    _, one_hot = period_band_mask(TARIFF, datetime(2024, 3, 2), END)
+    usage = usage_from_vectors(vectors[:, seg], one_hot)
+    assert usage["total_usage"].tolist() == [0.0, 0.0, 0.0]
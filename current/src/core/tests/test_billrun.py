@@ -0,0 +1,67 @@
+# core/tests/test_billrun.py
+"""
+Bill-run shards cover every customer, are leased exclusively until the lease expires and resume from checkpoints.
+"""
+
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(__file__, "..", "..", "..")))
+
+from core.models import BillRunShard, Customer
+from core.services.billrun import _checkpoint, claim_shard, create_bill_run, process_shard
+
+START, END = datetime(2024, 5, 1), datetime(2024, 6, 1)
+
+
+def _hashint4(value):
+    # Any spread of signed 32-bit values will do in place of PostgreSQL's hashint4
+    return (value * 2654435761) % 2 ** 32 - 2 ** 31
+
+
+@pytest.fixture
+def run(db):
+    db.connection().connection.create_function('hashint4', 1, _hashint4)
+    db.add_all([Customer(id=i, name=f'customer {i}', region_id=1) for i in range(1, 41)])
+    db.commit()
+    return create_bill_run(db, START, END, shard_count=4)
+
+
+def _expire(db, shard_id):
+    db.get(BillRunShard, shard_id).lease_expires_at = datetime.utcnow() - timedelta(seconds=1)
+    db.commit()
+
+
+def test_shards_cover_every_customer_once(db, run):
+    shards = db.query(BillRunShard).order_by(BillRunShard.shard_no).all()
+    assert sum(s.customers_total for s in shards) == 40
+    assert [s.hash_to for s in shards[:-1]] == [s.hash_from for s in shards[1:]]
+    assert (shards[0].hash_from, shards[-1].hash_to) == (-2 ** 31, 2 ** 31)
+
+
+def test_leases_are_exclusive_until_they_expire(db, run):
+    claimed = [claim_shard(db, run, f'worker-{i}', lease_seconds=60) for i in range(4)]
+    assert [s.shard_no for s in claimed] == [0, 1, 2, 3]
+    assert claim_shard(db, run, 'worker-4') is None
+    _expire(db, claimed[0].id)
+    taken = claim_shard(db, run, 'worker-4', lease_seconds=60)
+    assert (taken.id, taken.lease_owner) == (claimed[0].id, 'worker-4')
+    # The previous owner can no longer checkpoint
+    assert not _checkpoint(db, taken.id, 'worker-0', 60, last_customer_id=99)
+    assert _checkpoint(db, taken.id, 'worker-4', 60, last_customer_id=5)
+    assert db.get(BillRunShard, taken.id).last_customer_id == 5
+
+
+def test_shard_resumes_from_its_checkpoint(db, run):
+    shard = claim_shard(db, run, 'worker-0')
+    ids = sorted(cid for cid in range(1, 41) if shard.hash_from <= _hashint4(cid) < shard.hash_to)
+    # A previous owner got through the first two customers
+    assert _checkpoint(db, shard.id, 'worker-0', 60, last_customer_id=ids[1], customers_done=2)
+    shard = db.get(BillRunShard, shard.id)
+    assert process_shard(db, shard, {}, 'worker-0', batch_size=3)
+    shard = db.get(BillRunShard, shard.id)
+    assert (shard.status, shard.customers_done, shard.last_customer_id) == ('completed', len(ids), ids[-1])
+    assert shard.lease_expires_at is None
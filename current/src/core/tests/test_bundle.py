@@ -0,0 +1,96 @@
+# core/tests/test_bundle.py
+"""
+The config bundle carries a customer's region, the region's plans with the
+versions in force and the market fees in force, under an ETag that follows
+its content; /config-bundle answers a matching If-None-Match with a 304.
+"""
+
+import os
+import sys
+from datetime import date
+
+import pytest
+from fastapi.testclient import TestClient
+
+sys.path.append(os.path.abspath(os.path.join(__file__, "..", "..", "..")))
+
+from api.main import app
+from core.database import get_db
+from core.models import Customer, MarketOpFee, Region, TariffPlan, TariffVersion
+from core.services.bundle import bundle_etag, config_bundle
+
+ON = date(2024, 6, 1)
+
+
+@pytest.fixture
+def config(db):
+    db.add_all([
+        Region(id=1, name="Victoria", loss_factor=1.05),
+        Region(id=2, name="Elsewhere"),
+        Customer(id=7, name="customer 7", address="1 Main St", region_id=1),
+        Customer(id=8, name="customer 8"),
+        TariffPlan(id=1, name="Flat", region_id=1),
+        TariffPlan(id=2, name="Other region", region_id=2),
+        TariffVersion(id=1, tariff_plan_id=1, version=1, uploaded_by="test", canonical_json={"v": 1},
+                      effective_from=date(2023, 1, 1), effective_to=date(2023, 12, 31)),
+        TariffVersion(id=2, tariff_plan_id=1, version=2, uploaded_by="test", canonical_json={"v": 2},
+                      effective_from=date(2024, 1, 1)),
+        TariffVersion(id=3, tariff_plan_id=2, version=1, uploaded_by="test", canonical_json={"v": 3},
+                      effective_from=date(2024, 1, 1)),
+        MarketOpFee(id=1, name="Old_Fee", amount=0.5, unit="$/MWh", effective_to=date(2024, 1, 31)),
+        MarketOpFee(id=2, name="Market_Fee", amount=0.8, unit="$/MWh", effective_from=date(2024, 2, 1)),
+    ])
+    db.commit()
+    return db
+
+
+def test_bundle_holds_what_is_in_force(config):
+    bundle = config_bundle(config, 7, ON)
+    assert bundle['as_of'] == '2024-06-01'
+    assert bundle['customer'] == {'id': 7, 'name': 'customer 7', 'address': '1 Main St', 'region_id': 1}
+    assert bundle['region'] == {'region_id': 1, 'region_name': 'Victoria', 'loss_factor': 1.05}
+    assert [(p['id'], [v['id'] for v in p['versions']]) for p in bundle['tariff_plans']] == [(1, [2])]
+    assert bundle['tariff_plans'][0]['versions'][0]['canonical_json'] == {"v": 2}
+    assert [fee['name'] for fee in bundle['market_op_fees']] == ['Market_Fee']
+    # On an earlier day the older version and fee are the ones in force
+    earlier = config_bundle(config, 7, date(2023, 6, 1))
+    assert [v['id'] for v in earlier['tariff_plans'][0]['versions']] == [1]
+    assert [fee['name'] for fee in earlier['market_op_fees']] == ['Old_Fee']
+
+
+def test_customer_without_region_and_unknown_customer(config):
+    bundle = config_bundle(config, 8, ON)
+    assert bundle['region'] is None and bundle['tariff_plans'] == []
+    assert config_bundle(config, 99, ON) is None
+
+
+def test_etag_follows_content(config):
+    etag = bundle_etag(config_bundle(config, 7, ON))
+    assert bundle_etag(config_bundle(config, 7, ON)) == etag
+    config.get(MarketOpFee, 2).amount = 0.9
+    config.commit()
+    assert bundle_etag(config_bundle(config, 7, ON)) != etag
+
+
+@pytest.fixture
+def client(config):
+    app.dependency_overrides[get_db] = lambda: config
+    yield TestClient(app)
+    app.dependency_overrides.clear()
+
+
+def test_config_bundle_revalidates(client, config):
+    params = {"customer_id": 7, "on": "2024-06-01"}
+    response = client.get("/config-bundle", params=params)
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+    assert etag == bundle_etag(config_bundle(config, 7, ON))
+    assert response.json()['tariff_plans'][0]['id'] == 1
+    for sent in (etag, f'"stale", {etag}'):
+        revalidated = client.get("/config-bundle", params=params, headers={"If-None-Match": sent})
+        assert revalidated.status_code == 304 and revalidated.content == b""
+    config.get(MarketOpFee, 2).amount = 0.9
+    config.commit()
+    changed = client.get("/config-bundle", params=params, headers={"If-None-Match": etag})
+    assert changed.status_code == 200 and changed.headers["etag"] != etag
+    assert client.get("/config-bundle", params={"customer_id": 99}).status_code == 404
@@ -0,0 +1,109 @@
+# core/tests/test_compare.py
+"""
+Comparing tariffs ranks them cheapest first, each priced as price_usage prices the same usage
+plus the market fees a bill carries, and split at version changes and season edges as bills are.
+"""
+
+import copy
+import json
+import os
+import sys
+from datetime import date, datetime, timedelta
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(__file__, "..", "..", "..")))
+
+from core.models import MeterReading, TariffVersion
+from core.services.calc import aggregate_usage, calculate_bill, fetch_readings, price_usage
+from core.services.compare import compare_tariffs
+from core.services.fees import Fee, fee_cache
+
+SHELL_TARIFF = os.path.abspath(os.path.join(__file__, "..", "..", "..", "..", "tariffs", "shell-2024-04-01.json"))
+START, END = datetime(2024, 5, 6), datetime(2024, 5, 13)
+FEES = [
+    Fee(1, 'AEMO_Market_Fee', 0.50, '$/MWh', None, date(2024, 5, 9)),
+    Fee(2, 'AEMO_Market_Fee', 0.80, '$/MWh', date(2024, 5, 10), None),
+    Fee(3, 'AEMO_Daily_Fee', 2.0, 'c/day', None, None),
+]
+
+
+def _scaled(canonical, factor):
+    scaled = copy.deepcopy(canonical)
+    for comp in scaled['components']:
+        for step in comp.get('rate_schedule', []):
+            step['value'] *= factor
+    return scaled
+
+
+@pytest.fixture
+def tariffs(db):
+    with open(SHELL_TARIFF) as f:
+        shell = json.load(f)
+    canonicals = {1: shell, 2: _scaled(shell, 0.8), 3: _scaled(shell, 1.5)}
+    for tv_id, canonical in canonicals.items():
+        db.add(TariffVersion(id=tv_id, tariff_plan_id=tv_id, canonical_json=canonical, version=tv_id,
+                             uploaded_by='test', effective_from=date(2024, 4, 1)))
+    for i in range(7 * 48):
+        db.add(MeterReading(customer_id=5, timestamp=START + timedelta(minutes=30 * i), kwh_used=0.2 + (i % 6) * 0.05))
+    db.commit()
+    return canonicals
+
+
+def test_results_are_ranked_and_match_price_usage(db, tariffs):
+    out = compare_tariffs(db, 5, [3, 1, 99, 2, 1], START, END)
+    assert [r['tariff_version_id'] for r in out['results']] == [2, 1, 3]
+    assert [r['rank'] for r in out['results']] == [1, 2, 3]
+    assert out['missing'] == [99] and out['band_sets'] == 1
+    readings = fetch_readings(db, 5, START, END)
+    for row in out['results']:
+        canonical = tariffs[row['tariff_version_id']]
+        expected = price_usage(canonical, aggregate_usage(readings, canonical), START, END)
+        assert row['total_cost'] == pytest.approx(expected['total_cost'])
+        assert row['breakdown'].keys() == expected['breakdown'].keys()
+
+
+@pytest.fixture
+def fees():
+    fee_cache.load(FEES)
+    yield
+    fee_cache.invalidate()
+
+
+def test_results_carry_market_fees_like_bills(db, tariffs, fees):
+    out = compare_tariffs(db, 5, [1, 2], START, END)
+    for row in out['results']:
+        bill = calculate_bill(db, 5, row['tariff_version_id'], START, END)
+        assert {'AEMO_Market_Fee', 'AEMO_Daily_Fee'} <= row['breakdown'].keys()
+        assert row['breakdown']['AEMO_Market_Fee'] == bill['breakdown']['AEMO_Market_Fee']
+        assert row['total_cost'] == pytest.approx(bill['total_cost'], abs=0.01)
+
+
+def _seasonal(energy_cents):
+    return {
+        'time_zones': 'Australia/Melbourne',
+        'time_bands': [{'id': 'peak', 'days': ['all'], 'times': [{'from': '07:00', 'to': '19:00'}]}],
+        'components': [
+            {'id': 'Energy', 'unit': 'c/kWh', 'applies_to': ['usage_total'],
+             'rate_schedule': [{'value': energy_cents}], 'calculation': 'total_usage * rate'},
+            {'id': 'Winter', 'unit': 'c/kWh', 'applies_to': ['usage_peak'],
+             'season': {'from': '2024-06-01', 'to': '2024-06-20'},
+             'rate_schedule': [{'value': 5.0}], 'calculation': 'peak_usage * rate'},
+        ],
+    }
+
+
+def test_periods_across_version_and_season_edges_match_the_bill(db):
+    db.add(TariffVersion(id=1, tariff_plan_id=7, canonical_json=_seasonal(20.0), version=1, uploaded_by='test',
+                         effective_from=date(2024, 1, 1), effective_to=date(2024, 6, 14)))
+    db.add(TariffVersion(id=2, tariff_plan_id=7, canonical_json=_seasonal(30.0), version=2, uploaded_by='test',
+                         effective_from=date(2024, 6, 15)))
+    start, end = datetime(2024, 6, 10), datetime(2024, 6, 30)
+    for h in range(20 * 24):
+        db.add(MeterReading(customer_id=3, timestamp=start + timedelta(hours=h), kwh_used=1.0))
+    db.commit()
+    row, = compare_tariffs(db, 3, [1], start, end)['results']
+    bill = calculate_bill(db, 3, 1, start, end)
+    assert [s['tariff_version_id'] for s in row['segments']] == [1, 2, 2]
+    assert row['total_cost'] == pytest.approx(bill['total_cost'])
+    assert row['breakdown']['Winter']['cost'] == pytest.approx(11 * 12 * 0.05)
@@ -0,0 +1,82 @@
+# core/tests/test_curve.py
+"""
+Per-interval cost curves must add up to the bill lines priced from the
+period totals, market fees included.
+"""
+
+import os
+import sys
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(__file__, "..", "..", "..")))
+
+from core.models import MeterReading, TariffVersion
+from core.services.bandmask import interval_vector, period_band_mask, usage_from_vectors
+from core.services.calc import calculate_bill, price_usage
+from core.services.curve import _segment_costs, iter_cost_curve
+from core.services.fees import Fee, fee_cache
+
+
+TARIFF = {
+    "time_zones": "Australia/Melbourne",
+    "time_bands": [
+        {"id": "peak", "days": ["mon", "tue", "wed", "thu", "fri"], "times": [{"from": "07:00", "to": "23:00"}]},
+    ],
+    "components": [
+        {"id": "peak_energy", "unit": "c/kWh", "applies_to": ["usage_peak"],
+         "rate_schedule": [{"to": 500, "value": 30.0}, {"from": 500, "value": 25.0}],
+         "calculation": "peak_usage * rate * loss_factor", "loss_factor": 1.05},
+        {"id": "offpeak_energy", "unit": "c/kWh", "applies_to": ["usage_offpeak"],
+         "rate_schedule": [{"value": 15.0}], "calculation": "off_peak_usage * rate"},
+        {"id": "supply", "unit": "c/day", "applies_to": ["fixed"],
+         "rate_schedule": [{"value": 110.0}], "calculation": "rate * days"},
+    ],
+}
+START = datetime(2024, 5, 1)
+END = datetime(2024, 6, 1)
+FEES = [
+    Fee(1, 'AEMO_Market_Fee', 0.50, '$/MWh', None, date(2024, 5, 14)),
+    Fee(2, 'AEMO_Market_Fee', 0.80, '$/MWh', date(2024, 5, 15), None),
+    Fee(3, 'AEMO_Daily_Fee', 2.0, 'c/day', None, None),
+]
+
+
+def _readings():
+    return [(START + timedelta(minutes=30 * i), 0.2 + (i % 9) * 0.05) for i in range(31 * 48)]
+
+
+def test_interval_costs_sum_to_bill_lines():
+    readings = _readings()
+    kwh = interval_vector(readings, START, END)
+    _, one_hot = period_band_mask(TARIFF, START, END)
+    costs = _segment_costs(TARIFF, kwh, one_hot, START, END)
+    bill = price_usage(TARIFF, usage_from_vectors(kwh, one_hot), START, END)
+    assert set(costs) == set(bill["breakdown"])
+    for comp_id, line in bill["breakdown"].items():
+        assert len(costs[comp_id]) == len(kwh)
+        assert costs[comp_id].sum() == pytest.approx(line["cost"], abs=1e-3)
+    # Energy is charged only in the interval's own band; supply is spread evenly
+    assert np.all(costs["peak_energy"][one_hot[:, 1] == 0] == 0)
+    assert np.ptp(costs["supply"]) == 0
+
+
+@pytest.fixture
+def fees():
+    fee_cache.load(FEES)
+    yield
+    fee_cache.invalidate()
+
+
+def test_curve_adds_up_to_the_bill_with_market_fees(db, fees):
+    db.add(TariffVersion(id=1, tariff_plan_id=1, canonical_json=TARIFF, version=1, uploaded_by='test',
+                         effective_from=date(2024, 1, 1)))
+    db.add_all([MeterReading(customer_id=4, timestamp=ts, kwh_used=kwh) for ts, kwh in _readings()])
+    db.commit()
+    chunks = list(iter_cost_curve(db, 4, 1, START, END))
+    bill = calculate_bill(db, 4, 1, START, END)
+    for fee in ('AEMO_Market_Fee', 'AEMO_Daily_Fee'):
+        assert sum(chunk[fee].sum() for chunk in chunks) == pytest.approx(bill['breakdown'][fee]['cost'], abs=1e-3)
+    assert sum(chunk['total'].sum() for chunk in chunks) == pytest.approx(bill['total_cost'], abs=0.01)
@@ -0,0 +1,62 @@
+# core/tests/test_expr.py
+"""
+Compiled calculation expressions: scalar results must match the vectorized
+form element-wise, and anything outside the whitelist must be rejected.
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(__file__, "..", "..", "..")))
+
+from core.services.expr import compile_expression
+from core.services.calc import _safe_eval
+
+
+EXPRESSIONS = [
+    "peak_usage * rate * loss_factor",
+    "rate * days",
+    "max(max_kva, 10) * rate",
+    "min(peak_usage, 100) * rate + sqrt(off_peak_usage)",
+    "peak_usage * rate if peak_usage > 50 else 0",
+    "rate * (peak_usage >= 10 and off_peak_usage < 500)",
+    "round(peak_usage * rate, 2)",
+]
+
+
+@pytest.mark.parametrize("expr", EXPRESSIONS)
+def test_vectorized_matches_scalar(expr):
+    rng = np.random.default_rng(7)
+    peak = rng.uniform(0, 200, 25)
+    off_peak = rng.uniform(0, 800, 25)
+    max_kva = rng.uniform(0, 40, 25)
+    common = {"rate": 0.1155, "loss_factor": 1.06, "days": 31}
+    vector = compile_expression(expr, vectorized=True)(
+        dict(common, peak_usage=peak, off_peak_usage=off_peak, max_kva=max_kva)
+    )
+    vector = np.broadcast_to(np.asarray(vector, dtype=float), (25,))
+    for i in range(25):
+        scalar = _safe_eval(expr, dict(common, peak_usage=peak[i], off_peak_usage=off_peak[i], max_kva=max_kva[i]))
+        assert vector[i] == pytest.approx(scalar)
+
+
+@pytest.mark.parametrize("expr", [
+    "__import__('os').system('true')",
+    "math.sqrt(4)",
+    "peak_usage.real",
+    "[x for x in (1, 2)]",
+    "(lambda: 1)()",
+    "rate[0]",
+])
+def test_rejects_unsafe_constructs(expr):
+    with pytest.raises(ValueError):
+        _safe_eval(expr, {"peak_usage": 1.0, "rate": 1.0})
+
+
+def test_unknown_name_reported_on_evaluation():
+    compiled = compile_expression("peak_usage * tariff_rate")
+    with pytest.raises(ValueError):
+        compiled({"peak_usage": 1.0})
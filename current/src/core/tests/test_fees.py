@@ -0,0 +1,73 @@
+# core/tests/test_fees.py
+"""
+Market operator fees are cut at fee changes, prorated per piece and left to tariffs that carry them.
+"""
+
+import os
+import sys
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(__file__, "..", "..", "..")))
+
+from core.services.fees import Fee, add_fee_lines, batch_fee_lines, bill_fee_lines, fee_cache
+
+FEES = [
+    Fee(1, 'AEMO_Market_Fee', 0.50, '$/MWh', date(2024, 1, 1), date(2024, 1, 15)),
+    Fee(2, 'AEMO_Market_Fee', 0.80, '$/MWh', date(2024, 1, 16), None),
+    Fee(3, 'AEMO_Daily_Fee', 2.0, 'c/day', None, None),
+    Fee(4, 'Unknown_Basis', 1.0, 'per widget', None, None),
+]
+SEGMENTS = [{'canonical': {'time_zones': 'Australia/Melbourne', 'components': [{'id': 'peak'}]}}]
+
+
+@pytest.fixture
+def schedule():
+    yield fee_cache.load(FEES)
+    fee_cache.invalidate()
+
+
+def test_pieces_follow_fee_changes(schedule):
+    start, end = datetime(2024, 1, 10), datetime(2024, 2, 1)
+    pieces = schedule.pieces(start, end)
+    assert [(a.day, b.day) for a, b, _ in pieces] == [(10, 16), (16, 1)]
+    assert [f.id for f in pieces[0][2]] == [3, 1]
+    assert [f.id for f in pieces[1][2]] == [3, 2]
+    assert [f.id for f in schedule.at(date(2023, 6, 1))] == [3]
+    assert schedule.fingerprint(start, end) != schedule.fingerprint(start, end - timedelta(days=1))
+
+
+def test_bill_prorates_energy_and_daily_fees(schedule):
+    start, end = datetime(2024, 1, 10), datetime(2024, 2, 1)
+    readings = [(start + timedelta(hours=h), 1.0) for h in range(22 * 24)]
+    lines = bill_fee_lines(None, SEGMENTS, start, end, readings)
+    assert set(lines) == {'AEMO_Market_Fee', 'AEMO_Daily_Fee'}
+    # 6 days at $0.50/MWh then 16 days at $0.80/MWh, 24 kWh a day
+    assert lines['AEMO_Market_Fee']['cost'] == pytest.approx(144 * 0.0005 + 384 * 0.0008)
+    assert lines['AEMO_Daily_Fee']['units_used'] == pytest.approx(22)
+    result = {'total_cost': 1.0, 'breakdown': {}, 'units': 'AUD'}
+    add_fee_lines(result, lines)
+    assert result['breakdown']['AEMO_Daily_Fee'] == {
+        'units_used': 22.0, 'unit_label': 'days', 'category': 'market_op_fee', 'cost': 0.44}
+    assert result['total_cost'] == pytest.approx(1.0 + 0.44 + 0.3792)
+
+
+def test_batch_matches_single_bills_and_tariff_components_win(schedule):
+    start, end = datetime(2024, 1, 10), datetime(2024, 2, 1)
+    vectors = np.vstack([np.full(22 * 48, 0.5), np.full(22 * 48, 0.25)])
+    segments = [{'canonical': {'components': [{'id': 'AEMO_Daily_Fee'}]}}]
+    lines = batch_fee_lines(None, segments, start, end, vectors, 30)
+    assert set(lines) == {'AEMO_Market_Fee'}
+    assert lines['AEMO_Market_Fee']['cost'] == pytest.approx([0.3792, 0.1896])
+    result = {'total_cost': 0.0, 'breakdown': {}, 'units': 'AUD'}
+    add_fee_lines(result, lines, 1)
+    assert result['breakdown']['AEMO_Market_Fee']['units_used'] == pytest.approx(264)
+
+
+def test_loaded_schedule_is_served_until_invalidated(schedule, db):
+    assert fee_cache.schedule(db) is schedule
+    fee_cache.invalidate()
+    # Rebuilt from the (empty) market_op_fees table
+    assert fee_cache.schedule(db).pieces(datetime(2024, 1, 1), datetime(2024, 2, 1)) == []
@@ -0,0 +1,68 @@
+# core/tests/test_fixedpoint.py
+"""
+Fixed-point pricing rounds each line once by its policy and totals reconcile exactly.
+"""
+
+import json
+import os
+import sys
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(__file__, "..", "..", "..")))
+
+from core.services.calc import price_usage
+from core.services.fixedpoint import DEFAULT_ROUNDING, component_rounding, energy_units, round_money, units_to_kwh
+
+SHELL_TARIFF = os.path.abspath(os.path.join(__file__, "..", "..", "..", "..", "tariffs", "shell-2024-04-01.json"))
+
+
+@pytest.mark.parametrize("mode, expected", [
+    ('half_even', [2680000, -2680000, 1240000]),
+    ('half_up', [2680000, -2680000, 1250000]),
+    ('half_down', [2670000, -2670000, 1240000]),
+    ('down', [2670000, -2670000, 1240000]),
+    ('up', [2680000, -2680000, 1250000]),
+])
+def test_rounding_modes_at_two_decimals(mode, expected):
+    # 2.675 is 2.67499999... in binary; 1.245 likewise sits just below its half
+    assert round_money(np.array([2.675, -2.675, 1.245]), mode, 2).tolist() == expected
+
+
+def test_scalars_round_to_micro_dollars_by_default():
+    assert round_money(0.1 + 0.2) == 300000
+    assert round_money(1.0000005) == 1000000
+    with pytest.raises(ValueError):
+        round_money(1.0, 'bankers')
+
+
+def test_energy_units_are_lossless_for_four_decimal_readings():
+    kwh = np.array([0.1234, 1.0001, 2.5])
+    assert energy_units(kwh).tolist() == [1234, 10001, 25000]
+    assert units_to_kwh({'total_usage': float(energy_units(kwh).sum())}) == {'total_usage': 3.6235}
+
+
+def test_fixed_lines_follow_component_policy_and_sum_to_total():
+    with open(SHELL_TARIFF) as f:
+        tariff = json.load(f)
+    tariff['components'][0]['rounding'] = {'mode': 'up', 'decimals': 2}
+    usage = {'total_usage': 1234.5678, 'peak_usage': 456.789, 'off_peak_usage': 777.7788}
+    start, end = datetime(2024, 5, 1), datetime(2024, 6, 1)
+    floating = price_usage(tariff, usage, start, end)
+    fixed = price_usage(tariff, usage, start, end, fixed=True)
+    lines = fixed['breakdown']
+    assert fixed['total_micros'] == sum(line['cost_micros'] for line in lines.values())
+    first = tariff['components'][0]['id']
+    assert lines[first]['cost_micros'] % 10000 == 0
+    assert lines[first]['cost'] >= floating['breakdown'][first]['cost']
+    assert fixed['total_cost'] == pytest.approx(floating['total_cost'], abs=0.01)
+
+
+def test_invalid_stored_rounding_falls_back_to_the_default(caplog):
+    canonical = {'meta': {'rounding': {'mode': 'bankers', 'decimals': 2}}}
+    assert component_rounding({'id': 'a'}, canonical) == DEFAULT_ROUNDING
+    assert component_rounding({'id': 'b', 'rounding': {'decimals': 'two'}}, {}) == DEFAULT_ROUNDING
+    assert component_rounding({'id': 'c', 'rounding': {'decimals': 2}}, canonical) == ('half_even', 2)
+    assert 'component a has invalid rounding' in caplog.text
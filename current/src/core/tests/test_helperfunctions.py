@@ -0,0 +1,46 @@
+# core/tests/test_helperfunctions.py
+"""
+Resampling localises naive wall times as tz_localize would, across daylight-saving changes,
+and leaves unparseable timestamps out rather than turning them into 1677 dates.
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(__file__, "..", "..", "..")))
+
+from core.helperfunctions import resample_to_30min
+
+TZ = "Australia/Melbourne"
+
+
+def _frame(stamps):
+    return pd.DataFrame({"timestamp": stamps, "usage_kwh": np.arange(1.0, len(stamps) + 1)})
+
+
+@pytest.mark.parametrize("stamps, policy", [
+    # Clocks go back at 03:00 on 2024-04-07: 02:00-02:59 happens twice
+    (["2024-04-07 01:30", "2024-04-07 02:00", "2024-04-07 02:30", "2024-04-07 02:00", "2024-04-07 02:30",
+      "2024-04-07 03:00"], {"ambiguous": "infer"}),
+    # Clocks go forward at 02:00 on 2024-10-06: 02:00-02:59 never happens
+    (["2024-10-06 01:30", "2024-10-06 02:30", "2024-10-06 03:00", "2024-10-06 03:30"],
+     {"nonexistent": "shift_forward"}),
+])
+def test_naive_times_localise_as_tz_localize_does(stamps, policy):
+    out = resample_to_30min(_frame(stamps), tz=TZ)
+    index = pd.DatetimeIndex(pd.to_datetime(stamps)).tz_localize(TZ, **policy)
+    expected = pd.Series(np.arange(1.0, len(stamps) + 1), index=index).resample("30min").sum()
+    assert out.index.equals(expected.index)
+    assert out["usage_kwh"].tolist() == expected.tolist()
+
+
+def test_unparseable_timestamps_are_left_out():
+    stamps = ["2024-06-01 00:00:00", "not a time", "2024-06-01 00:30:00", None, "2024-06-01 01:00:00"]
+    out = resample_to_30min(_frame(stamps), tz=TZ)
+    assert len(out) == 3
+    assert out.index[0] == pd.Timestamp("2024-06-01 00:00", tz=TZ)
+    assert out["usage_kwh"].tolist() == [1.0, 3.0, 5.0]
@@ -0,0 +1,100 @@
+# core/tests/test_history.py
+"""
+Bill history pages newest first by keyset, filters by period overlap and
+tariff version, and revalidates with checksum ETags; the bill endpoints
+answer a matching If-None-Match with an empty 304.
+"""
+
+import os
+import sys
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+
+sys.path.append(os.path.abspath(os.path.join(__file__, "..", "..", "..")))
+
+from api.main import app
+from core.database import get_db
+from core.models import CalcRun
+from core.services.history import bill_history, etag_for
+
+
+def _month(i):
+    return datetime(2024, i, 1)
+
+
+@pytest.fixture
+def runs(db):
+    # Customer 1 has one completed bill a month from January to May, ids 1..5
+    for i in range(1, 6):
+        db.add(CalcRun(id=i, customer_id=1, tariff_version_id=1 + i % 2, status='completed',
+                       period_start=_month(i), period_end=_month(i + 1), attempts=1,
+                       result_summary_json={'_meta': {'checksum': f'c{i}'},
+                                            'result': {'total_cost': 10.0 * i, 'units': 'AUD', 'breakdown': {}}}))
+    db.add(CalcRun(id=6, customer_id=2, tariff_version_id=1, status='completed',
+                   period_start=_month(1), period_end=_month(2), attempts=1, result_summary_json={}))
+    db.commit()
+    return db
+
+
+def _ids(page):
+    return [item['calc_run_id'] for item in page['items']]
+
+
+def test_pages_follow_before_id_to_the_last_page(runs):
+    first = bill_history(runs, 1, limit=2)
+    assert _ids(first) == [5, 4] and first['next_before_id'] == 4
+    second = bill_history(runs, 1, before_id=first['next_before_id'], limit=2)
+    assert _ids(second) == [3, 2] and second['next_before_id'] == 2
+    last = bill_history(runs, 1, before_id=second['next_before_id'], limit=2)
+    assert _ids(last) == [1] and last['next_before_id'] is None
+    # A last page that is exactly full has no next page either
+    assert bill_history(runs, 1, before_id=3, limit=2)['next_before_id'] is None
+    assert _ids(bill_history(runs, 2)) == [6]
+
+
+def test_period_overlap_and_tariff_version_filters(runs):
+    # Periods ending on start or starting on end do not overlap [start, end)
+    assert _ids(bill_history(runs, 1, start=_month(3), end=_month(5))) == [4, 3]
+    assert _ids(bill_history(runs, 1, start=datetime(2024, 2, 15), end=datetime(2024, 3, 2))) == [3, 2]
+    assert _ids(bill_history(runs, 1, tariff_version_id=2)) == [5, 3, 1]
+    assert _ids(bill_history(runs, 1, start=_month(3), tariff_version_id=1)) == [4]
+
+
+def test_etag_is_stable_and_follows_checksums(runs):
+    etag = bill_history(runs, 1, limit=2)['etag']
+    assert bill_history(runs, 1, limit=2)['etag'] == etag
+    assert bill_history(runs, 1, limit=3)['etag'] != etag
+    # A run off the page does not change it; a re-priced run on the page does
+    runs.get(CalcRun, 1).result_summary_json = {'_meta': {'checksum': 'changed'}}
+    runs.commit()
+    assert bill_history(runs, 1, limit=2)['etag'] == etag
+    runs.get(CalcRun, 5).result_summary_json = {'_meta': {'checksum': 'changed'}}
+    runs.commit()
+    assert bill_history(runs, 1, limit=2)['etag'] != etag
+
+
+@pytest.fixture
+def client(runs):
+    app.dependency_overrides[get_db] = lambda: runs
+    yield TestClient(app)
+    app.dependency_overrides.clear()
+
+
+@pytest.mark.parametrize("path, params", [
+    ("/customers/1/bills", {"start": "2024-02-01T00:00:00", "end": "2024-03-01T00:00:00", "tariff_version_id": 1}),
+    ("/customers/1/bills/history", {"limit": 2}),
+])
+def test_if_none_match_gets_304(client, path, params):
+    response = client.get(path, params=params)
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+    if path.endswith("/bills"):
+        assert etag == etag_for(2, 'c2') and response.json()["total_cost"] == 20.0
+    for sent in (etag, f'"stale", W/"other", {etag}', "*"):
+        revalidated = client.get(path, params=params, headers={"If-None-Match": sent})
+        assert revalidated.status_code == 304 and revalidated.content == b""
+        assert revalidated.headers["etag"] == etag
+    stale = client.get(path, params=params, headers={"If-None-Match": '"stale", W/"other"'})
+    assert stale.status_code == 200 and stale.json() == response.json()
@@ -0,0 +1,171 @@
+# core/tests/test_ingest.py
+"""
+Drop files parse into customer readings, a batch that fails for any reason
+quarantines only the files that fail on their own, a file that cannot be
+archived stays behind without stopping the daemon, and ingesting a file again
+replaces its readings (against PostgreSQL, when reachable).
+"""
+
+import os
+import shutil
+import sys
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(__file__, "..", "..", "..")))
+
+from core.models import Customer, MeterReading, MeterReadingChange, Region
+from data.ingest_daemon import IngestDaemon, parse_file, parse_nem12, parse_tabular
+
+FIXTURES = os.path.abspath(os.path.join(__file__, "..", "fixtures"))
+NMI_MAP = {"6001234567": 1, "6009876543": 2}
+
+
+def _fixture(name):
+    return os.path.join(FIXTURES, name)
+
+
+def test_nem12_bills_consumption_channels_in_kwh():
+    frame = parse_nem12(_fixture("sample.nem12"), NMI_MAP)
+    # The B1 (export) channel is skipped and the blank interval dropped
+    assert frame.groupby("customer_id").size().to_dict() == {1: 47, 2: 48}
+    first = frame[frame["customer_id"] == 1]
+    assert first["timestamp"].iloc[0] == datetime(2024, 6, 1)
+    assert first["timestamp"].iloc[3] == datetime(2024, 6, 1, 2)
+    assert first["kwh"].sum() == pytest.approx(47 * 0.5)
+    # Wh readings are scaled to kWh
+    assert (frame.loc[frame["customer_id"] == 2, "kwh"] == 0.25).all()
+
+
+def test_nem12_unmapped_nmi_raises():
+    with pytest.raises(ValueError, match="6009876543"):
+        parse_nem12(_fixture("sample.nem12"), {"6001234567": 1})
+
+
+def test_tabular_customer_from_filename():
+    path = _fixture("42_june.csv")
+    frame = parse_tabular(pd.read_csv(path), path, default_customer_id=None)
+    assert (frame["customer_id"] == 42).all()
+    assert frame["kwh"].tolist() == [0.25, 0.5, 0.75, 1.0, 1.25, 1.5]
+
+
+def test_tabular_customer_column_drops_rows_without_one():
+    path = _fixture("customers.csv")
+    frame = parse_tabular(pd.read_csv(path), path, default_customer_id=99)
+    assert frame["customer_id"].tolist() == [7, 7, 7, 8, 8, 8]
+    assert frame["kwh"].sum() == pytest.approx(10.0)
+
+
+def test_tabular_without_any_customer_raises():
+    path = _fixture("customers.csv")
+    df = pd.read_csv(path).drop(columns=["customer_id"])
+    with pytest.raises(ValueError, match="customer"):
+        parse_tabular(df, path, default_customer_id=None)
+
+
+def test_parse_file_sniffs_nem12_in_a_csv(tmp_path):
+    path = tmp_path / "drop.csv"
+    shutil.copy(_fixture("sample.nem12"), path)
+    customers, readings = parse_file(str(path), NMI_MAP, None)
+    assert len(customers) == len(readings) == 95
+    assert np.array_equal(np.unique(customers), [1, 2])
+    assert readings.timestamps[0] == np.datetime64("2024-06-01T00:00")
+
+
+class _Connection:
+    closed = 0
+
+
+class _Pool:
+    def __init__(self, conn=None):
+        self.conn = conn or _Connection()
+
+    def getconn(self):
+        return self.conn
+
+    def putconn(self, conn, close=False):
+        pass
+
+
+class _Daemon(IngestDaemon):
+    """A daemon on a watch directory and pool, without workers or a database URL."""
+
+    def __init__(self, watch_dir, conn=None):
+        self.watch_dir = watch_dir
+        self.archive_dir = os.path.join(watch_dir, "archive")
+        self.quarantine_dir = os.path.join(watch_dir, "quarantine")
+        os.makedirs(self.archive_dir)
+        os.makedirs(self.quarantine_dir)
+        self.pool = _Pool(conn)
+        self.ready = []
+        self.committed = []
+        self.totals = {"files_archived": 0, "files_quarantined": 0, "rows_committed": 0}
+
+    def drop(self, name, source=_fixture("customers.csv")):
+        path = os.path.join(self.watch_dir, name)
+        shutil.copy(source, path)
+        self.ready.append((path, parse_file(path, {}, None), 0.0))
+
+
+class _FailingDaemon(_Daemon):
+    """A daemon whose writes fail for one file with a non-database error."""
+
+    def _write(self, conn, batch):
+        if any(path.endswith("bad.csv") for path, _, _ in batch):
+            raise TypeError("unconvertible reading")
+        return sum(len(parsed[0]) for _, parsed, _ in batch)
+
+
+def test_failed_batch_quarantines_only_the_failing_file(tmp_path):
+    daemon = _FailingDaemon(str(tmp_path))
+    for name in ("good.csv", "bad.csv", "also_good.csv"):
+        daemon.drop(name)
+    daemon._flush()
+    assert sorted(os.listdir(daemon.archive_dir)) == ["also_good.csv", "good.csv"]
+    assert sorted(os.listdir(daemon.quarantine_dir)) == ["bad.csv", "bad.csv.error"]
+    with open(os.path.join(daemon.quarantine_dir, "bad.csv.error")) as fh:
+        assert fh.read() == "insert failed: TypeError: unconvertible reading\n"
+    assert daemon.totals == {"files_archived": 2, "files_quarantined": 1, "rows_committed": 12}
+
+
+def test_archive_failure_leaves_the_file_and_keeps_running(tmp_path, caplog):
+    daemon = _FailingDaemon(str(tmp_path))
+    daemon.drop("good.csv")
+    os.rmdir(daemon.archive_dir)
+    daemon._flush()
+    assert os.path.exists(tmp_path / "good.csv")
+    assert daemon.totals == {"files_archived": 0, "files_quarantined": 0, "rows_committed": 6}
+    assert "moving good.csv to" in caplog.text
+
+
+@pytest.mark.postgres
+def test_ingesting_a_file_again_replaces_its_readings(pg_db, tmp_path):
+    pg_db.add(Region(id=1, name="Test"))
+    pg_db.add_all([Customer(id=i, name=f"customer {i}", region_id=1) for i in (7, 8)])
+    pg_db.commit()
+    raw = pg_db.get_bind().raw_connection()
+    try:
+        daemon = _Daemon(str(tmp_path), raw.connection)
+        daemon.drop("customers.csv")
+        daemon._flush()
+        # The same file dropped again: nothing new, so no day is recorded as changed
+        daemon.drop("customers.csv")
+        daemon._flush()
+        assert pg_db.query(MeterReading).count() == 6
+        assert pg_db.query(MeterReadingChange).count() == 2
+        # A corrected file replaces the readings it covers
+        with open(_fixture("customers.csv")) as fh:
+            corrected = fh.read().replace("7,2024-06-01 00:00:00,1.5", "7,2024-06-01 00:00:00,4.25")
+        (tmp_path / "corrected").write_text(corrected)
+        daemon.drop("corrected.csv", str(tmp_path / "corrected"))
+        daemon._flush()
+        assert pg_db.query(MeterReading).count() == 6
+        first = pg_db.query(MeterReading).filter_by(customer_id=7).order_by(MeterReading.timestamp).first()
+        assert float(first.kwh_used) == 4.25
+        assert [c.customer_id for c in pg_db.query(MeterReadingChange).order_by(MeterReadingChange.id)] == [7, 8, 7]
+        assert daemon.totals["files_archived"] == 3
+    finally:
+        raw.close()
@@ -0,0 +1,141 @@
+# core/tests/test_invalidate.py
+"""
+Ingestion records changed readings as runs of consecutive days per customer,
+and invalidation claims them once, re-prices the runs they overlap (legacy runs
+included) and keeps failing bills from blocking the rest.
+"""
+
+import os
+import sys
+from datetime import date, datetime, timedelta
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(__file__, "..", "..", "..")))
+
+from core.models import CalcRun, Customer, MeterReading, MeterReadingChange, Region, TariffPlan, TariffVersion
+from core.services.calc import calculate_bill
+from core.services.invalidate import (backfill_run_periods, changed_day_ranges, claim_changes, reprice_runs,
+                                      run_invalidation)
+
+
+def test_changed_day_ranges_merge_consecutive_days():
+    readings = [
+        (2, datetime(2024, 3, 1, 0, 30)),
+        (1, datetime(2024, 3, 2, 23, 30)),
+        (1, datetime(2024, 3, 1, 0, 0)),
+        (1, datetime(2024, 3, 1, 12, 0)),
+        (1, datetime(2024, 3, 5, 8, 0)),
+    ]
+    assert changed_day_ranges(readings) == [
+        (1, date(2024, 3, 1), date(2024, 3, 2)),
+        (1, date(2024, 3, 5), date(2024, 3, 5)),
+        (2, date(2024, 3, 1), date(2024, 3, 1)),
+    ]
+
+
+def test_changed_day_ranges_empty():
+    assert changed_day_ranges([]) == []
+
+
+TARIFF = {
+    'time_zones': 'Australia/Melbourne',
+    'time_bands': [{'id': 'peak', 'days': ['all'], 'times': [{'from': '07:15', 'to': '19:00'}]}],
+    'components': [
+        {'id': 'Peak', 'unit': 'c/kWh', 'applies_to': ['usage_peak'],
+         'rate_schedule': [{'value': 40.0}], 'calculation': 'peak_usage * rate'},
+        {'id': 'Supply', 'unit': 'c/day', 'applies_to': ['fixed'],
+         'rate_schedule': [{'value': 100.0}], 'calculation': 'rate * days'},
+    ],
+}
+START, END = datetime(2024, 5, 1), datetime(2024, 5, 3)
+BROKEN = dict(TARIFF, components=[dict(TARIFF['components'][0], rate_schedule=[{'value': 'n/a'}])])
+
+
+@pytest.fixture
+def priced(db):
+    db.add(TariffVersion(id=1, tariff_plan_id=1, canonical_json=TARIFF, version=1, uploaded_by='test',
+                         effective_from=date(2024, 1, 1)))
+    for customer_id in (1, 2):
+        for slot in range(2 * 48):
+            db.add(MeterReading(customer_id=customer_id, timestamp=START + timedelta(minutes=30 * slot), kwh_used=0.5))
+    # Customer 2's run predates period_start/period_end: only its _meta has the period
+    db.add(CalcRun(customer_id=1, tariff_version_id=1, status='completed', period_start=START, period_end=END,
+                   result_summary_json={'_meta': {'start': str(START), 'end': str(END), 'checksum': 'old'}}))
+    db.add(CalcRun(customer_id=2, tariff_version_id=1, status='completed',
+                   result_summary_json={'_meta': {'start': str(START), 'end': str(END), 'checksum': 'old'}}))
+    db.commit()
+    return db
+
+
+def test_legacy_runs_are_backfilled_and_repriced_as_calculate_bill_does(priced):
+    db = priced
+    assert backfill_run_periods(db) == 1
+    db.commit()
+    legacy = db.query(CalcRun).filter_by(customer_id=2).one()
+    assert (legacy.period_start, legacy.period_end) == (START, END)
+    # A late reading; affected_runs joins a VALUES list, which SQLite cannot alias
+    for customer_id in (1, 2):
+        db.add(MeterReading(customer_id=customer_id, timestamp=datetime(2024, 5, 2, 23, 45), kwh_used=0.25))
+    db.commit()
+    assert reprice_runs(db, [(1, 1, START, END), (2, 1, START, END)]) == (2, {})
+    for customer_id in (1, 2):
+        latest = db.query(CalcRun).filter_by(customer_id=customer_id).order_by(CalcRun.id.desc()).first()
+        assert latest.result_summary_json['_meta']['checksum'] != 'old'
+        # The same bill the worker and bill runs store, peak edge off the half-hour grid included
+        assert latest.result_summary_json['result'] == calculate_bill(db, customer_id, 1, START, END)
+
+
+def test_claims_are_committed_and_taken_again_once_stale(db):
+    db.add_all([MeterReadingChange(customer_id=1, day_from=START.date(), day_to=START.date()) for _ in range(3)])
+    db.commit()
+    assert [c.id for c in claim_changes(db, 2)] == [1, 2]
+    # The claim outlives this session's transaction
+    assert [c.id for c in claim_changes(db, 5)] == [3]
+    assert claim_changes(db, 5) == []
+    db.get(MeterReadingChange, 1).claimed_at = datetime.utcnow() - timedelta(hours=1)
+    db.commit()
+    assert [c.id for c in claim_changes(db, 5, claim_timeout=60)] == [1]
+
+
+def test_a_failing_bill_does_not_stop_the_others(priced):
+    db = priced
+    db.add(TariffVersion(id=2, tariff_plan_id=2, canonical_json=BROKEN, version=1, uploaded_by='test',
+                         effective_from=date(2024, 1, 1)))
+    db.commit()
+    repriced, failures = reprice_runs(db, [(1, 2, START, END), (1, 1, START, END)])
+    assert repriced == 1
+    assert list(failures) == [(1, 2, START, END)]
+    assert failures[(1, 2, START, END)].startswith('ValueError:')
+    assert db.query(CalcRun).filter_by(customer_id=1).count() == 2
+
+
+@pytest.mark.postgres
+def test_pass_marks_changes_processed_and_retries_failed_bills(pg_db):
+    db = pg_db
+    db.add(Region(id=1, name='Test'))
+    db.add_all([TariffPlan(id=1, name='Good', region_id=1), TariffPlan(id=2, name='Broken', region_id=1)])
+    db.add_all([Customer(id=i, name=f'customer {i}', region_id=1) for i in (1, 2)])
+    db.flush()
+    db.add(TariffVersion(id=1, tariff_plan_id=1, canonical_json=TARIFF, version=1, uploaded_by='test',
+                         effective_from=date(2024, 1, 1)))
+    db.add(TariffVersion(id=2, tariff_plan_id=2, canonical_json=BROKEN, version=1, uploaded_by='test',
+                         effective_from=date(2024, 1, 1)))
+    db.flush()
+    for customer_id, tariff_version_id in ((1, 1), (2, 2)):
+        db.add(CalcRun(customer_id=customer_id, tariff_version_id=tariff_version_id, status='completed',
+                       period_start=START, period_end=END, result_summary_json={}))
+        db.add(MeterReading(customer_id=customer_id, timestamp=START, kwh_used=0.5))
+        db.add(MeterReadingChange(customer_id=customer_id, day_from=START.date(), day_to=START.date()))
+    db.commit()
+
+    assert run_invalidation(db, max_attempts=2) == {'changes': 2, 'runs': 2, 'repriced': 1, 'failed': 1}
+    good, broken = db.query(MeterReadingChange).order_by(MeterReadingChange.customer_id).all()
+    assert good.processed_at is not None
+    assert (broken.processed_at, broken.claimed_at, broken.attempts) == (None, None, 1)
+    assert broken.last_error.startswith('ValueError:')
+    # Only the failed change comes back, and is given up on after its last attempt
+    assert run_invalidation(db, max_attempts=2) == {'changes': 1, 'runs': 1, 'repriced': 0, 'failed': 1}
+    db.refresh(broken)
+    assert broken.processed_at is not None and broken.attempts == 2
+    assert run_invalidation(db)['changes'] == 0
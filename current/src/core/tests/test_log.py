@@ -0,0 +1,60 @@
+# core/tests/test_log.py
+"""
+Queued logging writes structured records off-thread; hot-path helpers stay quiet when disabled.
+"""
+
+import json
+import logging
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(__file__, "..", "..", "..")))
+
+from core import log
+from core.log import Sampler, configure_logging, log_event, stage, stop_logging
+
+
+def test_queued_json_records_reach_the_file(tmp_path):
+    path = tmp_path / "billing.log"
+    root = logging.getLogger()
+    level = root.level
+    try:
+        configure_logging(level="INFO", filename=str(path), structured=True)
+        logger = logging.getLogger("test.log")
+        log_event(logger, logging.INFO, "priced %s", "bill", customer_id=7, total=12.5)
+        logger.debug("not written")
+        stop_logging()
+        lines = [json.loads(line) for line in path.read_text().splitlines()]
+    finally:
+        stop_logging()
+        root.removeHandler(log._handler)
+        log._handler = None
+        for target in log._targets:
+            target.close()
+        root.setLevel(level)
+    assert len(lines) == 1
+    assert lines[0]["message"] == "priced bill"
+    assert lines[0]["customer_id"] == 7 and lines[0]["total"] == 12.5
+
+
+def test_stage_logs_timing_only_at_debug(caplog):
+    logger = logging.getLogger("test.stage")
+    with caplog.at_level(logging.INFO, logger="test.stage"):
+        with stage(logger, "price", segments=1):
+            pass
+    assert not caplog.records
+    with caplog.at_level(logging.DEBUG, logger="test.stage"):
+        with stage(logger, "price", segments=1) as fields:
+            fields["rows"] = 48
+    (record,) = caplog.records
+    assert record.getMessage() == "stage price"
+    assert record.fields["rows"] == 48 and "ms" in record.fields
+
+
+def test_sampler_logs_one_in_every(caplog):
+    logger = logging.getLogger("test.sampler")
+    sampler = Sampler(logger, every=10)
+    with caplog.at_level(logging.DEBUG, logger="test.sampler"):
+        for _ in range(25):
+            sampler.log("reading dropped")
+    assert [r.fields["seen"] for r in caplog.records] == [1, 11, 21]
@@ -0,0 +1,120 @@
+# core/tests/test_notify.py
+"""
+Notified table changes reach their subscribers and evict exactly the affected cache entries,
+and the schema's triggers send the payloads they document (against PostgreSQL, when reachable).
+"""
+
+import json
+import os
+import select
+import sys
+import uuid
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(__file__, "..", "..", "..")))
+
+from core.database import DATABASE_URL
+from core.notify import CHANNEL, dispatch, reset_all, subscribe
+from core.services.resolve import PlanIndex, resolver
+
+
+def test_handlers_see_their_table_and_survive_a_failing_peer():
+    seen = []
+
+    def broken(event):
+        raise RuntimeError("boom")
+
+    subscribe('test_notify_table', broken)
+    subscribe('test_notify_table', seen.append)
+    dispatch({'table': 'test_notify_table', 'op': 'INSERT', 'id': 1})
+    dispatch({'table': 'another_table', 'op': 'INSERT', 'id': 2})
+    reset_all()
+    assert [e['op'] for e in seen] == ['INSERT', 'RESET']
+
+
+def test_version_change_evicts_only_its_plans():
+    resolver.invalidate()
+    resolver._plans.update({plan_id: PlanIndex(plan_id, None, []) for plan_id in (1, 2, 3)})
+    dispatch({'table': 'tariff_versions', 'op': 'UPDATE', 'id': 9, 'tariff_plan_ids': [1, 3]})
+    assert set(resolver._plans) == {2}
+    dispatch({'table': 'tariff_versions', 'op': 'TRUNCATE', 'id': None, 'tariff_plan_ids': None})
+    assert resolver._plans == {}
+
+
+SCHEMA_SQL = os.path.abspath(os.path.join(__file__, "..", "..", "..", "..", "..", "docker", "db", "initdb",
+                                          "01_schema.sql"))
+
+
+def _trigger_sql():
+    # The trigger function and triggers exactly as the schema creates them
+    with open(SCHEMA_SQL) as f:
+        sql = f.read()
+    last = "FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_invalidation();"
+    start = sql.index("CREATE OR REPLACE FUNCTION notify_cache_invalidation()")
+    return sql[start:sql.rindex(last) + len(last)]
+
+
+@pytest.fixture
+def pg():
+    psycopg2 = pytest.importorskip("psycopg2")
+    url = os.getenv("TEST_DATABASE_URL", DATABASE_URL).replace("postgresql+psycopg2://", "postgresql://")
+    try:
+        listener, writer = psycopg2.connect(url, connect_timeout=2), psycopg2.connect(url, connect_timeout=2)
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"no PostgreSQL server: {e}")
+    # Own schema, so nothing outside it is touched
+    schema = f"notify_test_{uuid.uuid4().hex[:8]}"
+    writer.autocommit = listener.autocommit = True
+    with writer.cursor() as cur:
+        cur.execute(f"CREATE SCHEMA {schema}; SET search_path TO {schema}")
+        cur.execute("CREATE TABLE tariff_plan (id SERIAL PRIMARY KEY, name TEXT);"
+                    "CREATE TABLE tariff_versions (id SERIAL PRIMARY KEY, tariff_plan_id INT);"
+                    "CREATE TABLE market_op_fees (id SERIAL PRIMARY KEY, name TEXT);")
+        cur.execute(_trigger_sql())
+    with listener.cursor() as cur:
+        cur.execute(f"LISTEN {CHANNEL}")
+    writer.autocommit = False
+    try:
+        yield listener, writer
+    finally:
+        writer.rollback()
+        writer.autocommit = True
+        with writer.cursor() as cur:
+            cur.execute(f"DROP SCHEMA {schema} CASCADE")
+        writer.close()
+        listener.close()
+
+
+def _received(listener, count):
+    events = []
+    while len(events) < count and select.select([listener], [], [], 5.0)[0]:
+        listener.poll()
+        while listener.notifies:
+            events.append(json.loads(listener.notifies.pop(0).payload))
+    return events
+
+
+@pytest.mark.postgres
+def test_triggers_notify_committed_changes(pg):
+    listener, writer = pg
+    with writer.cursor() as cur:
+        cur.execute("INSERT INTO tariff_plan (id, name) VALUES (3, 'a'), (4, 'b')")
+        cur.execute("INSERT INTO tariff_versions (id, tariff_plan_id) VALUES (42, 3)")
+        # Nothing is sent before the transaction commits
+        assert not select.select([listener], [], [], 0.2)[0]
+        writer.commit()
+        cur.execute("UPDATE tariff_versions SET tariff_plan_id = 4 WHERE id = 42")
+        writer.commit()
+        cur.execute("TRUNCATE tariff_versions")
+        writer.commit()
+    events = _received(listener, 5)
+    assert events[:2] == [
+        {'table': 'tariff_plan', 'op': 'INSERT', 'id': 3, 'tariff_plan_ids': [3]},
+        {'table': 'tariff_plan', 'op': 'INSERT', 'id': 4, 'tariff_plan_ids': [4]},
+    ]
+    assert events[2:] == [
+        {'table': 'tariff_versions', 'op': 'INSERT', 'id': 42, 'tariff_plan_ids': [3]},
+        {'table': 'tariff_versions', 'op': 'UPDATE', 'id': 42, 'tariff_plan_ids': [3, 4]},
+        {'table': 'tariff_versions', 'op': 'TRUNCATE', 'id': None, 'tariff_plan_ids': None},
+    ]
@@ -0,0 +1,60 @@
+# core/tests/test_readings.py
+"""
+ReadingSeries views, serialises and feeds every consumer like the query rows it replaces.
+"""
+
+import os
+import pickle
+import sys
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(__file__, "..", "..", "..")))
+
+from core.readings import ReadingSeries, as_series
+from core.services.bandmask import interval_vector
+from core.services.checksum import reading_text
+from core.services.segments import aggregate_segments
+
+START = datetime(2024, 3, 1)
+ROWS = [(START + timedelta(minutes=15 * i), Decimal(f"{0.25 + (i % 5) * 0.0125:.4f}")) for i in range(4 * 48)]
+CANONICAL = {'time_zones': 'Australia/Melbourne', 'time_bands': [
+    {'id': 'peak', 'days': ['mon', 'tue', 'wed', 'thu', 'fri'], 'times': [{'from': '07:00', 'to': '23:00'}]}]}
+
+
+@pytest.fixture
+def series():
+    return ReadingSeries.from_rows(ROWS, customer_id=7)
+
+
+def test_slices_and_views_share_memory(series):
+    day = series.between(START + timedelta(days=1), START + timedelta(days=2))
+    assert len(day) == 96 and day[0] == (START + timedelta(days=1), 0.2625)
+    assert np.shares_memory(day.epoch, series.epoch) and np.shares_memory(day.kwh, series.kwh)
+    frame = series.to_pandas()
+    assert np.shares_memory(frame.to_numpy(), series.kwh)
+    assert frame.index[0] == START and frame.sum() == pytest.approx(sum(float(k) for _, k in ROWS))
+    assert list(as_series(ROWS)) == [(ts, float(k)) for ts, k in ROWS]
+
+
+def test_bytes_round_trip(series):
+    data = series.to_bytes()
+    assert len(data) == 20 + 16 * len(series)
+    back = ReadingSeries.from_bytes(data)
+    assert back.customer_id == 7 and back.epoch.tolist() == series.epoch.tolist()
+    assert not back.kwh.flags.writeable
+    assert pickle.loads(pickle.dumps(series[10:20])).kwh.tolist() == series.kwh[10:20].tolist()
+    with pytest.raises(ValueError):
+        ReadingSeries.from_bytes(data[:-8])
+
+
+def test_consumers_match_rows(series):
+    end = START + timedelta(days=2)
+    assert interval_vector(series, START, end).tolist() == interval_vector(ROWS, START, end).tolist()
+    segments = [{'canonical': CANONICAL, 'end': end}]
+    assert aggregate_segments(series, segments) == aggregate_segments(ROWS, segments)
+    # Checksums hash the same text as the rows did
+    assert reading_text(series) == ''.join(f"{ts}{kwh}" for ts, kwh in ROWS).encode()
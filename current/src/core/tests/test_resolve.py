@@ -0,0 +1,49 @@
+# core/tests/test_resolve.py
+"""
+The per-plan interval index resolves the version in force on a day with the segments precedence.
+"""
+
+import os
+import sys
+from collections import namedtuple
+from datetime import date
+
+sys.path.append(os.path.abspath(os.path.join(__file__, "..", "..", "..")))
+
+from core.services.resolve import PlanIndex
+
+Version = namedtuple('Version', 'id version effective_from effective_to')
+
+
+def test_latest_start_wins_and_gaps_resolve_to_none():
+    index = PlanIndex(1, 10, [
+        Version(1, 1, date(2024, 1, 1), date(2024, 6, 30)),
+        Version(2, 2, date(2024, 4, 1), date(2024, 4, 30)),   # temporary override
+        Version(3, 3, date(2024, 9, 1), None),
+    ])
+    assert index.at(date(2023, 12, 31)) is None
+    assert index.at(date(2024, 1, 1)) == 1
+    assert index.at(date(2024, 4, 15)) == 2
+    assert index.at(date(2024, 5, 1)) == 1
+    assert index.at(date(2024, 7, 1)) is None
+    assert index.at(date(2030, 1, 1)) == 3
+
+
+def test_same_start_prefers_highest_version():
+    index = PlanIndex(1, None, [
+        Version(5, 1, date(2024, 1, 1), None),
+        Version(6, 2, date(2024, 1, 1), None),
+    ])
+    assert index.at(date(2024, 3, 1)) == 6
+
+
+def test_first_between_falls_back_to_the_first_to_take_effect():
+    index = PlanIndex(1, 10, [
+        Version(1, 1, date(2024, 1, 1), date(2024, 1, 31)),
+        Version(2, 2, date(2024, 2, 15), None),
+    ])
+    assert index.first_between(date(2024, 1, 10), date(2024, 2, 29)) == 1
+    assert index.first_between(date(2024, 2, 1), date(2024, 2, 29)) == 2
+    assert index.first_between(date(2024, 2, 1), date(2024, 2, 10)) is None
+    assert index.first_between(date(2023, 12, 1), date(2023, 12, 31)) is None
+    assert PlanIndex(2, 10, []).at(date(2024, 1, 1)) is None
@@ -0,0 +1,56 @@
+# core/tests/test_revenue.py
+"""
+Monthly revenue refreshes pick up every completed run, including background
+runs that finish after a refresh has already seen later ones.
+"""
+
+import os
+import sys
+from datetime import date, datetime
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(__file__, "..", "..", "..")))
+
+from core.models import RevenueDirtyMonth, TariffVersion
+from core.services.revenue import refresh_revenue_summary, revenue_by_month
+from core.services.worker import claim_calc_run, enqueue_calc_run, execute_calc_run
+
+TARIFF = {
+    'time_zones': 'Australia/Melbourne',
+    'time_bands': [],
+    'components': [
+        {'id': 'Supply', 'unit': 'c/day', 'applies_to': ['fixed'], 'category': 'network',
+         'rate_schedule': [{'value': 100.0}], 'calculation': 'rate * days'},
+    ],
+}
+START, END = datetime(2024, 5, 1), datetime(2024, 6, 1)
+
+
+@pytest.fixture
+def plan(db):
+    db.add(TariffVersion(id=1, tariff_plan_id=3, canonical_json=TARIFF, version=1, uploaded_by='test',
+                         effective_from=date(2024, 1, 1)))
+    db.commit()
+    return db
+
+
+def test_run_completing_after_a_refresh_is_counted_by_the_next(plan):
+    db = plan
+    earlier = enqueue_calc_run(db, 1, 1, START, END)
+    later = enqueue_calc_run(db, 2, 1, START, END)
+    assert refresh_revenue_summary(db) == []
+    # The later run finishes first and is summarised before the earlier one completes
+    first, second = claim_calc_run(db), claim_calc_run(db)
+    assert (first.id, second.id) == (earlier, later)
+    execute_calc_run(db, second)
+    assert refresh_revenue_summary(db) == [date(2024, 5, 1)]
+    assert [r['bills'] for r in revenue_by_month(db)] == [1]
+    execute_calc_run(db, first)
+    assert refresh_revenue_summary(db) == [date(2024, 5, 1)]
+    assert revenue_by_month(db) == [{
+        'month': '2024-05-01', 'tariff_plan_id': 3, 'category': 'network', 'component_id': 'Supply',
+        'bills': 2, 'units_used': pytest.approx(62.0), 'cost': pytest.approx(62.0),
+    }]
+    assert refresh_revenue_summary(db) == []
+    assert db.query(RevenueDirtyMonth).count() == 0
@@ -0,0 +1,129 @@
+# core/tests/test_routing.py
+"""
+Pricing reads go to the replica; writes, queue state and a transaction's
+reads after its own writes go to the primary. The ``postgres`` tests route
+between two PostgreSQL databases (see ``pg_engines`` in conftest).
+"""
+
+import os
+import sys
+import time
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine, select, func, text, update
+from sqlalchemy.orm import Session
+
+sys.path.append(os.path.abspath(os.path.join(__file__, "..", "..", "..")))
+
+from core import routing
+from core.models import Customer, MeterReading, CalcRun
+from core.routing import RoutingSession, use_primary
+
+
+@pytest.fixture
+def engines():
+    primary = create_engine("sqlite://", future=True)
+    replica = create_engine("sqlite://", future=True)
+    for engine in (primary, replica):
+        MeterReading.__table__.create(engine)
+    return primary, replica
+
+
+def _count(db):
+    return db.execute(select(func.count()).select_from(MeterReading)).scalar_one()
+
+
+def test_pricing_reads_use_replica_and_state_uses_primary(engines):
+    primary, replica = engines
+    db = RoutingSession(primary=primary, replica=replica, future=True)
+    readings = select(MeterReading.timestamp, MeterReading.kwh_used).where(MeterReading.customer_id == 1)
+    assert db.get_bind(clause=readings) is replica
+    assert db.get_bind(clause=select(CalcRun)) is primary
+    assert db.get_bind(clause=readings.with_for_update()) is primary
+    with use_primary(db):
+        assert db.get_bind(clause=readings) is primary
+    assert db.get_bind(clause=readings) is replica
+    # A write pins the rest of the transaction to the primary
+    assert db.get_bind(clause=update(MeterReading).values(kwh_used=0)) is primary
+    assert db.get_bind(clause=readings) is primary
+    db.rollback()
+    assert db.get_bind(clause=readings) is replica
+
+
+def test_transaction_reads_its_own_writes(engines):
+    primary, replica = engines
+    db = RoutingSession(primary=primary, replica=replica, future=True)
+    db.add(MeterReading(id=1, customer_id=1, timestamp=datetime(2024, 1, 1), kwh_used=1))
+    db.flush()
+    assert _count(db) == 1
+    db.commit()
+    # The replica is a separate, never-updated database here
+    assert _count(db) == 0
+    db.close()
+
+
+def test_without_replica_everything_uses_primary(engines):
+    primary, _ = engines
+    db = RoutingSession(primary=primary, future=True)
+    assert db.get_bind(clause=select(MeterReading)) is primary
+
+
+def _seed(engine, kwh):
+    with Session(engine, future=True) as session:
+        session.add(Customer(id=1, name="customer 1"))
+        session.add(MeterReading(customer_id=1, timestamp=datetime(2024, 1, 1), kwh_used=kwh))
+        session.commit()
+
+
+def _usage(db):
+    return float(db.execute(select(func.sum(MeterReading.kwh_used))).scalar_one())
+
+
+@pytest.fixture
+def routed(pg_engines):
+    # The two databases hold different usage, so each read shows where it went
+    primary, replica = pg_engines
+    _seed(primary, 2.0)
+    _seed(replica, 1.0)
+    db = RoutingSession(primary=primary, replica=replica, future=True)
+    yield db
+    db.close()
+
+
+@pytest.mark.postgres
+def test_postgres_pricing_reads_use_replica(routed):
+    assert _usage(routed) == 1.0
+    assert routed.execute(select(func.count()).select_from(CalcRun)).scalar_one() == 0
+    with use_primary(routed):
+        assert _usage(routed) == 2.0
+
+
+@pytest.mark.postgres
+def test_postgres_lagging_replica_falls_back_to_primary(routed, monkeypatch):
+    replica = routed.replica_engine
+    monkeypatch.setitem(routing._lag_cache, replica, (time.monotonic(), routed.max_lag + 1))
+    assert _usage(routed) == 2.0
+    monkeypatch.setitem(routing._lag_cache, replica, (time.monotonic(), None))
+    assert _usage(routed) == 2.0
+    # Once the cached reading expires, the replica is measured again
+    monkeypatch.setitem(routing._lag_cache, replica, (time.monotonic() - routing.LAG_CHECK_SECONDS, 30.0))
+    assert _usage(routed) == 1.0
+
+
+@pytest.mark.postgres
+def test_postgres_commit_marks_reads_fresh(routed, monkeypatch):
+    before = routing.primary_lsn(routed.primary_engine)
+    routed.add(MeterReading(customer_id=1, timestamp=datetime(2024, 1, 2), kwh_used=3.0))
+    routed.commit()
+    mark = routed._min_lsn
+    with routed.primary_engine.connect() as conn:
+        assert conn.execute(text("SELECT CAST(:a AS pg_lsn) > CAST(:b AS pg_lsn)"), {"a": mark, "b": before}).scalar_one()
+    # Until the replica has replayed the write, pricing reads stay on the primary
+    monkeypatch.setattr(routing, "replica_replayed", lambda replica, lsn: False)
+    assert _usage(routed) == 5.0
+    assert routed._min_lsn == mark
+    monkeypatch.undo()
+    # A standalone second server is never in recovery, so it counts as caught up
+    assert _usage(routed) == 1.0
+    assert routed._min_lsn is None
@@ -0,0 +1,84 @@
+# core/tests/test_segments.py
+"""
+Billing periods are cut at version changes and season edges, and their priced segments add up to the bill.
+"""
+
+import os
+import sys
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(__file__, "..", "..", "..")))
+
+from core.models import MeterReading, TariffVersion
+from core.services.calc import _in_season, calculate_bill
+from core.services.segments import aggregate_segments, plan_segments
+
+SEASON = {'from': '2024-06-01', 'to': '2024-06-20'}
+
+
+def _tariff(energy_cents, season_cents):
+    return {
+        'time_zones': 'Australia/Melbourne',
+        'time_bands': [{'id': 'peak', 'days': ['all'], 'times': [{'from': '07:00', 'to': '19:00'}]}],
+        'components': [
+            {'id': 'Energy', 'unit': 'c/kWh', 'applies_to': ['usage_total'],
+             'rate_schedule': [{'value': energy_cents}], 'calculation': 'total_usage * rate'},
+            {'id': 'Supply', 'unit': 'c/day', 'applies_to': ['fixed'],
+             'rate_schedule': [{'value': 100.0}], 'calculation': 'rate * days'},
+            {'id': 'Winter', 'unit': 'c/kWh', 'applies_to': ['usage_peak'], 'season': SEASON,
+             'rate_schedule': [{'value': season_cents}], 'calculation': 'peak_usage * rate'},
+        ],
+    }
+
+
+@pytest.fixture
+def plan(db):
+    db.add(TariffVersion(id=1, tariff_plan_id=7, canonical_json=_tariff(20.0, 5.0), version=1, uploaded_by='test',
+                         effective_from=date(2024, 1, 1), effective_to=date(2024, 6, 14)))
+    db.add(TariffVersion(id=2, tariff_plan_id=7, canonical_json=_tariff(30.0, 5.0), version=2, uploaded_by='test',
+                         effective_from=date(2024, 6, 15)))
+    start = datetime(2024, 6, 10)
+    for h in range(20 * 24):
+        db.add(MeterReading(customer_id=3, timestamp=start + timedelta(hours=h), kwh_used=1.0))
+    db.commit()
+    return db
+
+
+def test_period_is_cut_at_version_change_and_season_end(plan):
+    segments = plan_segments(plan, 1, datetime(2024, 6, 10), datetime(2024, 6, 30))
+    assert [(s['start'].day, s['end'].day, s['tariff_version_id']) for s in segments] == [
+        (10, 15, 1), (15, 21, 2), (21, 30, 2)]
+    # The season's last day is inclusive, the period end exclusive
+    winter = segments[1]['canonical']['components'][2]
+    assert _in_season(winter, segments[1]['start'], segments[1]['end'])
+    assert not _in_season(winter, segments[2]['start'], segments[2]['end'])
+    assert not _in_season(winter, datetime(2024, 5, 1), datetime(2024, 6, 1))
+    assert _in_season(winter, datetime(2024, 5, 1), datetime(2024, 6, 1, 0, 30))
+
+
+def test_segments_add_up_to_the_bill(plan):
+    bill = calculate_bill(plan, 3, 1, datetime(2024, 6, 10), datetime(2024, 6, 30))
+    assert [s['tariff_version_id'] for s in bill['segments']] == [1, 2, 2]
+    energy = bill['breakdown']['Energy']
+    assert energy['units_used'] == 480
+    assert energy['cost'] == pytest.approx(120 * 0.20 + 360 * 0.30)
+    assert bill['breakdown']['Supply']['cost'] == pytest.approx(20.0)
+    # Peak hours (07-19) from the 10th to the season's last day, the 20th
+    assert bill['breakdown']['Winter']['cost'] == pytest.approx(11 * 12 * 0.05)
+    assert 'Winter' not in bill['segments'][2]['breakdown']
+    assert bill['total_cost'] == pytest.approx(sum(s['total_cost'] for s in bill['segments']))
+
+
+def test_aware_readings_use_each_segments_zone():
+    segments = [
+        {'end': datetime(2024, 6, 2), 'canonical': _tariff(20.0, 5.0)},
+        {'end': datetime(2024, 6, 3), 'canonical': dict(_tariff(20.0, 5.0), time_zones='UTC')},
+    ]
+    # 12:00 UTC is 22:00 in Melbourne (off peak) and 12:00 (peak) in UTC
+    readings = [(datetime(2024, 6, 1, 12, tzinfo=timezone.utc), 1.0),
+                (datetime(2024, 6, 2, 12, tzinfo=timezone.utc), 2.0)]
+    first, second = aggregate_segments(readings, segments)
+    assert (first['total_usage'], first['peak_usage']) == (1.0, 0.0)
+    assert (second['total_usage'], second['peak_usage']) == (2.0, 2.0)
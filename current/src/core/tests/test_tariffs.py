@@ -0,0 +1,71 @@
+# core/tests/test_tariffs.py
+"""
+Tariff uploads are checked against the schema and dry-compiled before they are stored.
+"""
+
+import copy
+import json
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(__file__, "..", "..", "..")))
+
+from core.services.tariffs import content_hash, schema_validator, validate_tariff, validate_tariffs
+
+SHELL_TARIFF = os.path.abspath(os.path.join(__file__, "..", "..", "..", "..", "tariffs", "shell-2024-04-01.json"))
+
+
+def _shell():
+    with open(SHELL_TARIFF) as f:
+        return json.load(f)
+
+
+def test_published_tariff_is_valid():
+    assert validate_tariff(_shell()) == []
+    assert schema_validator() is schema_validator()
+
+
+def test_bad_calculations_and_ids_are_reported_by_path():
+    tariff = _shell()
+    tariff['components'][0]['calculation'] = 'rate * bogus'
+    tariff['components'][1]['calculation'] = '__import__("os")'
+    tariff['components'][2]['id'] = tariff['components'][3]['id']
+    tariff['effective_to'] = '2020-01-01'
+    errors = validate_tariff(tariff)
+    assert errors[0].startswith('effective_to:')
+    assert errors[1] == 'components/0/calculation: Use of name bogus not allowed'
+    assert errors[2].startswith('components/1/calculation:')
+    assert errors[3].startswith('components/3/id: duplicate')
+
+
+def test_rounding_policies_are_checked_for_components_and_meta():
+    tariff = _shell()
+    tariff['meta'] = {'rounding': {'mode': 'bankers', 'decimals': 2}}
+    tariff['components'][0]['rounding'] = {'mode': 'half_up', 'decimals': 7}
+    errors = validate_tariff(tariff)
+    assert len(errors) == 2
+    assert errors[0].startswith('components/0/rounding/decimals:')
+    assert errors[1].startswith('meta/rounding/mode:')
+
+
+def test_unknown_tier_mode_is_rejected():
+    tariff = _shell()
+    tariff['components'][0]['tier_mode'] = 'stepped'
+    errors = validate_tariff(tariff)
+    assert len(errors) == 1 and errors[0].startswith('components/0/tier_mode:')
+
+
+def test_batch_reports_each_tariff_and_hashes_only_valid_ones():
+    good = _shell()
+    bad = copy.deepcopy(good)
+    del bad['provider']
+    result = validate_tariffs([good, bad])
+    assert result['valid'] is False
+    assert result['results'][0]['content_hash'] == content_hash(good)
+    assert result['results'][1]['errors'] == ["<root>: 'provider' is a required property"]
+    assert result['results'][1]['content_hash'] is None
+
+
+def test_content_hash_ignores_key_order():
+    tariff = _shell()
+    assert content_hash(tariff) == content_hash(dict(reversed(list(tariff.items()))))
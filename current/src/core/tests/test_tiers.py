@@ -0,0 +1,61 @@
+# core/tests/test_tiers.py
+"""
+Progressive block tiers priced through the compiled tier table, and the
+single-tier selection the engine has always used.
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(__file__, "..", "..", "..")))
+
+from core.services.tiers import compile_tiers, select_rate_values
+from core.services.calc import _select_rate_value, _rate_value
+
+
+SCHEDULE = [
+    {"to": 100, "value": 10.0},
+    {"from": 100, "to": 500, "value": 12.0},
+    {"from": 500, "value": 15.0},
+]
+
+
+@pytest.mark.parametrize("usage, expected", [
+    (0, 0.0),
+    (50, 500.0),
+    (100, 1000.0),
+    (300, 1000.0 + 200 * 12.0),
+    (500, 1000.0 + 400 * 12.0),
+    (750, 1000.0 + 400 * 12.0 + 250 * 15.0),
+])
+def test_progressive_cost(usage, expected):
+    assert compile_tiers(SCHEDULE).cost(usage) == pytest.approx(expected)
+
+
+def test_tables_are_cached_per_schedule():
+    assert compile_tiers(SCHEDULE) is compile_tiers([dict(t) for t in SCHEDULE])
+    with pytest.raises(ValueError):
+        compile_tiers([])
+
+
+def test_progressive_vectorized_matches_bisect():
+    table = compile_tiers(SCHEDULE)
+    usage = np.array([0.0, 12.5, 100.0, 499.9, 500.0, 2000.0])
+    assert table.costs(usage) == pytest.approx([table.cost(u) for u in usage])
+    assert table.blended_values(usage) == pytest.approx([table.blended_value(u) for u in usage])
+
+
+def test_progressive_blended_rate_prices_blocks():
+    comp = {"rate_schedule": SCHEDULE, "tier_mode": "progressive"}
+    assert 300 * _rate_value(comp, 300) == pytest.approx(1000.0 + 200 * 12.0)
+
+
+def test_single_mode_unchanged():
+    usage = np.array([0.0, 50.0, 100.0, 250.0, 500.0, 900.0])
+    comp = {"rate_schedule": SCHEDULE}
+    expected = [_select_rate_value(SCHEDULE, u) for u in usage]
+    assert [_rate_value(comp, u) for u in usage] == expected
+    assert select_rate_values(SCHEDULE, usage).tolist() == expected
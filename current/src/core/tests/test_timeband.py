@@ -0,0 +1,65 @@
+# core/tests/test_timeband.py
+"""
+Vectorized band assignment must agree with assign_band, and the cached
+transition table must round-trip local and UTC instants across DST changes.
+"""
+
+import os
+import random
+import sys
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(__file__, "..", "..", "..")))
+
+from core.services.timeband import assign_band, band_indices
+from core.services.tzindex import utc_to_wall, wall_to_utc, minute_of_week
+
+
+TARIFF = {
+    "time_zones": "Australia/Melbourne",
+    "time_bands": [
+        {"id": "summer_peak", "days": ["mon", "tue", "wed", "thu", "fri"],
+         "times": [{"from": "15:00", "to": "21:00"}],
+         "date_ranges": [{"from": "2024-01-01", "to": "2024-03-31"}]},
+        {"id": "peak", "days": ["mon", "tue", "wed", "thu", "fri"], "times": [{"from": "07:00", "to": "19:00"}]},
+        {"id": "shoulder", "days": ["sat", "sun"], "times": [{"from": "07:00", "to": "22:00"}]},
+        {"id": "offpeak", "days": ["all"], "times": [{"from": "00:00", "to": "07:00"}, {"from": "19:00", "to": "23:59"}]},
+    ],
+}
+
+
+def test_band_indices_match_assign_band():
+    rnd = random.Random(3)
+    stamps = [datetime(2023, 11, 1) + timedelta(minutes=rnd.randint(0, 60 * 24 * 300)) for _ in range(5000)]
+    labels, idx = band_indices(stamps, TARIFF)
+    assert [labels[i] for i in idx] == [assign_band(ts, TARIFF) for ts in stamps]
+
+
+def test_aware_timestamps_use_tariff_time_zone():
+    # 2024-01-02 05:00 UTC is 16:00 AEDT on a Tuesday in summer
+    ts = datetime(2024, 1, 2, 5, 0, tzinfo=timezone.utc)
+    labels, idx = band_indices([ts], TARIFF)
+    assert labels[idx[0]] == "summer_peak" == assign_band(ts, TARIFF)
+
+
+@pytest.mark.parametrize("wall, utc", [
+    # Clocks go back at 03:00 AEDT on 2024-04-07: 02:30 occurs twice
+    (datetime(2024, 4, 7, 2, 30), [datetime(2024, 4, 6, 15, 30), datetime(2024, 4, 6, 16, 30)]),
+    # Clocks go forward at 02:00 AEST on 2024-10-06: 02:30 does not exist
+    (datetime(2024, 10, 6, 2, 30), [datetime(2024, 10, 5, 16, 0)]),
+])
+def test_wall_to_utc_across_dst(wall, utc):
+    wall_s = int(wall.replace(tzinfo=timezone.utc).timestamp())
+    expected = [int(u.replace(tzinfo=timezone.utc).timestamp()) for u in utc]
+    got = wall_to_utc(np.array([wall_s] * len(expected)), "Australia/Melbourne", ambiguous="infer")
+    assert got.tolist() == expected
+
+
+def test_utc_to_wall_minute_of_week():
+    # 2024-04-06 16:30 UTC is Sunday 02:30 AEST, after clocks went back
+    utc = int(datetime(2024, 4, 6, 16, 30, tzinfo=timezone.utc).timestamp())
+    wall_minutes = utc_to_wall(np.array([utc]), "Australia/Melbourne") // 60
+    assert minute_of_week(wall_minutes).tolist() == [6 * 1440 + 150]
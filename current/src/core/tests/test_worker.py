@@ -0,0 +1,100 @@
+# core/tests/test_worker.py
+"""
+Workers claim pending runs once, reclaim runs whose lease expired, drop the results of attempts
+that lost their lease and back off failed attempts.
+"""
+
+import os
+import sys
+from datetime import date, datetime, timedelta
+
+sys.path.append(os.path.abspath(os.path.join(__file__, "..", "..", "..")))
+
+from core.models import CalcRun, CalcRunLine, MeterReading, TariffVersion
+from core.services.worker import (COMPLETED, FAILED, PENDING, RUNNING, claim_calc_run, enqueue_calc_run,
+                                  execute_calc_run)
+
+START, END = datetime(2024, 5, 1), datetime(2024, 6, 1)
+TARIFF = {
+    'components': [
+        {'id': 'Energy', 'unit': 'c/kWh', 'applies_to': ['usage_total'],
+         'rate_schedule': [{'value': 20.0}], 'calculation': 'total_usage * rate'},
+        {'id': 'Supply', 'unit': 'c/day', 'applies_to': ['fixed'],
+         'rate_schedule': [{'value': 100.0}], 'calculation': 'rate * days'},
+    ],
+}
+
+
+def _expire_lease(db, run_id, seconds=3600):
+    # SQLite's CURRENT_TIMESTAMP is UTC
+    db.get(CalcRun, run_id).started_at = datetime.utcnow() - timedelta(seconds=seconds)
+    db.commit()
+
+
+def test_claim_is_exclusive_until_the_lease_expires(db):
+    run_id = enqueue_calc_run(db, 1, 1, START, END)
+    row = claim_calc_run(db, visibility_timeout=60)
+    assert (row.id, row.status, row.attempts) == (run_id, RUNNING, 1)
+    assert claim_calc_run(db, visibility_timeout=60) is None
+    _expire_lease(db, run_id)
+    row = claim_calc_run(db, visibility_timeout=60)
+    assert (row.id, row.status, row.attempts) == (run_id, RUNNING, 2)
+    assert row.last_error.startswith('attempt 1 abandoned')
+
+
+def test_lost_last_attempt_fails_the_run(db):
+    run_id = enqueue_calc_run(db, 1, 1, START, END)
+    claim_calc_run(db, max_attempts=1)
+    _expire_lease(db, run_id, seconds=7200)
+    assert claim_calc_run(db, max_attempts=1) is None
+    row = db.get(CalcRun, run_id)
+    assert (row.status, row.attempts) == (FAILED, 1)
+
+
+def test_failed_attempts_back_off_then_fail(db):
+    run_id = enqueue_calc_run(db, 1, 1, START, END)
+    db.get(CalcRun, run_id).result_summary_json = {}   # no period: pricing raises
+    db.commit()
+    row = claim_calc_run(db)
+    assert execute_calc_run(db, row, max_attempts=2, base_delay=3600, max_delay=3600) == PENDING
+    row = db.get(CalcRun, run_id)
+    assert row.last_error.startswith('KeyError') and row.available_at > datetime.utcnow()
+    assert claim_calc_run(db) is None
+    row.available_at = datetime.utcnow() - timedelta(seconds=1)
+    db.commit()
+    row = claim_calc_run(db)
+    assert row.attempts == 2
+    assert execute_calc_run(db, row, max_attempts=2) == FAILED
+    assert COMPLETED not in {r.status for r in db.query(CalcRun)}
+
+
+def test_attempt_that_lost_its_lease_stores_nothing(db):
+    db.add(TariffVersion(id=1, tariff_plan_id=1, canonical_json=TARIFF, version=1, uploaded_by='test',
+                         effective_from=date(2024, 1, 1)))
+    db.add(MeterReading(customer_id=1, timestamp=START, kwh_used=2.5))
+    db.commit()
+    run_id = enqueue_calc_run(db, 1, 1, START, END)
+    slow = claim_calc_run(db, visibility_timeout=60)
+    # The slow worker's copy of its claim, as another process would hold it
+    db.expunge(slow)
+    _expire_lease(db, run_id)
+    fast = claim_calc_run(db, visibility_timeout=60)
+    assert fast.attempts == 2
+    assert execute_calc_run(db, fast) == COMPLETED
+    assert execute_calc_run(db, slow) == COMPLETED
+    assert db.query(CalcRunLine).filter_by(calc_run_id=run_id).count() == 2
+    row = db.get(CalcRun, run_id)
+    assert (row.status, row.attempts) == (COMPLETED, 2)
+
+
+def test_lost_attempt_does_not_reschedule_a_reclaimed_run(db):
+    run_id = enqueue_calc_run(db, 1, 1, START, END)
+    db.get(CalcRun, run_id).result_summary_json = {}   # no period: pricing raises
+    db.commit()
+    slow = claim_calc_run(db, visibility_timeout=60)
+    db.expunge(slow)
+    _expire_lease(db, run_id)
+    claim_calc_run(db, visibility_timeout=60)
+    assert execute_calc_run(db, slow) == RUNNING
+    row = db.get(CalcRun, run_id)
+    assert (row.status, row.attempts, row.last_error) == (RUNNING, 2, 'attempt 1 abandoned: lease expired after 60s')
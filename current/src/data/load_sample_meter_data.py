@@ -15,6 +15,9 @@ By default the script looks for columns containing the words "date",
 the consumption value.  If these heuristics are insufficient, supply
 --timestamp-col and --usage-col explicitly.
 
+Readings are upserted on (customer, timestamp), so loading a file again
+replaces its readings instead of adding them twice.
+
 This script is intended to be run manually after the database has been
 initialised; it does not form part of the automatic docker initdb process.
 """
@@ -26,10 +29,45 @@ from typing import Tuple
 
 import pandas as pd
 import psycopg2
+from psycopg2.extras import execute_values
+
+sys.path.append(os.path.abspath(os.path.join(__file__, "..", "..")))
+
+from core.readings import ReadingSeries
+from core.services.invalidate import changed_day_ranges
 
 
 import re
 
+# Only readings that are new or whose kWh changed come back, and only they
+# are recorded for invalidation
+UPSERT_READINGS_SQL = (
+    "INSERT INTO meter_reading (customer_id, timestamp, kwh_used) VALUES %s "
+    "ON CONFLICT (customer_id, timestamp) DO UPDATE SET kwh_used = EXCLUDED.kwh_used "
+    "WHERE meter_reading.kwh_used IS DISTINCT FROM EXCLUDED.kwh_used "
+    "RETURNING customer_id, timestamp"
+)
+
+
+def upsert_readings(cur, records) -> int:
+    """Upsert ``(customer_id, timestamp, kwh)`` records and record the changed
+    day ranges; the caller commits. The last of duplicate records wins.
+    Returns the number of readings added or changed.
+    """
+    latest = {(cid, ts): kwh for cid, ts, kwh in records}
+    changed = execute_values(
+        cur, UPSERT_READINGS_SQL, [(cid, ts, kwh) for (cid, ts), kwh in latest.items()],
+        page_size=10_000, fetch=True,
+    )
+    if changed:
+        # Let the invalidation pass re-price bills covering these days
+        execute_values(
+            cur,
+            "INSERT INTO meter_reading_change (customer_id, day_from, day_to) VALUES %s",
+            changed_day_ranges(changed),
+        )
+    return len(changed)
+
 
 def _normalize(col: str) -> str:
     """
@@ -72,27 +110,20 @@ def guess_columns(df: pd.DataFrame) -> Tuple[str, str]:
     return ts_candidates[0], usage_candidates[0]
 
 
-def insert_meter_readings(
-    csv_path: str,
-    db_url: str,
-    customer_id: int,
+def read_meter_frame(
+    df: pd.DataFrame,
     timestamp_col: str | None = None,
     usage_col: str | None = None,
-):
-    """Read a CSV and insert its readings into the meter_reading table.
+) -> pd.DataFrame:
+    """Pick and clean the timestamp and usage columns of a meter data frame.
 
-    :param csv_path: path to the CSV file containing meter data
-    :param db_url: PostgreSQL connection string
-    :param customer_id: ID of the customer to associate readings with
+    Returns a frame with ``timestamp`` (datetime) and ``kwh`` (float) columns;
+    rows with an unparseable timestamp or usage value are dropped.
+
+    :param df: raw meter data, e.g. from ``pd.read_csv``
     :param timestamp_col: optional name of the timestamp column
     :param usage_col: optional name of the kWh usage column
     """
-    if not os.path.exists(csv_path):
-        raise FileNotFoundError(f"CSV file not found: {csv_path}")
-
-    # Read the CSV; let pandas infer datatypes
-    df = pd.read_csv(csv_path)
-
     # Identify columns.  If the user supplied explicit names, attempt to match
     # them in a case‑insensitive manner by normalising both the input and
     # dataframe column names.  This allows specifying "E (Usage Kwh)" when
@@ -121,19 +152,39 @@ def insert_meter_readings(
         usage_col = usage_col or auto_usage_col
 
     # Convert timestamp column to datetime
-    df[timestamp_col] = pd.to_datetime(df[timestamp_col], errors="coerce")
-    # Drop any rows with invalid timestamps
-    df = df.dropna(subset=[timestamp_col])
-    # Ensure usage column is numeric
-    df[usage_col] = pd.to_numeric(df[usage_col], errors="coerce")
-    df = df.dropna(subset=[usage_col])
+    frame = pd.DataFrame({
+        "timestamp": pd.to_datetime(df[timestamp_col], errors="coerce"),
+        # Ensure usage column is numeric
+        "kwh": pd.to_numeric(df[usage_col], errors="coerce"),
+    })
+    # Drop any rows with invalid timestamps or usage
+    return frame.dropna(subset=["timestamp", "kwh"])
+
+
+def insert_meter_readings(
+    csv_path: str,
+    db_url: str,
+    customer_id: int,
+    timestamp_col: str | None = None,
+    usage_col: str | None = None,
+):
+    """Read a CSV and upsert its readings into the meter_reading table.
+
+    :param csv_path: path to the CSV file containing meter data
+    :param db_url: PostgreSQL connection string
+    :param customer_id: ID of the customer to associate readings with
+    :param timestamp_col: optional name of the timestamp column
+    :param usage_col: optional name of the kWh usage column
+    """
+    if not os.path.exists(csv_path):
+        raise FileNotFoundError(f"CSV file not found: {csv_path}")
+
+    # Read the CSV; let pandas infer datatypes
+    df = read_meter_frame(pd.read_csv(csv_path), timestamp_col, usage_col)
 
     # Prepare values for insertion
-    records = list(
-        zip([
-            customer_id
-        ] * len(df), df[timestamp_col].tolist(), df[usage_col].astype(float).tolist())
-    )
+    readings = ReadingSeries.from_frame(df, customer_id=customer_id)
+    records = list(zip([customer_id] * len(readings), readings.timestamps.tolist(), readings.kwh.tolist()))
     if not records:
         print("No valid meter readings found to insert.")
         return
@@ -143,11 +194,8 @@ def insert_meter_readings(
     try:
         with conn:
             with conn.cursor() as cur:
-                cur.executemany(
-                    "INSERT INTO meter_reading (customer_id, timestamp, kwh_used) VALUES (%s, %s, %s)",
-                    records,
-                )
-        print(f"Inserted {len(records)} meter readings for customer_id={customer_id}.")
+                changed = upsert_readings(cur, records)
+        print(f"Loaded {len(records)} meter readings for customer_id={customer_id} ({changed} new or changed).")
     finally:
         conn.close()
 
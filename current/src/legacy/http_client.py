@@ -0,0 +1,70 @@
+"""
+Keep-alive HTTP client with a local TTL/ETag cache for the billing system.
+
+One requests.Session (and so one connection pool) is shared by every
+EnergyBillingSystem in the process, including manifest worker threads.
+GET responses are cached per (url, params):
+  - while younger than their TTL they are served without a request;
+  - after that they are revalidated with If-None-Match, and a
+    304 Not Modified only renews the TTL.
+"""
+import logging
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger("billing.http")
+
+DEFAULT_TTL = 300  # seconds; config (units, formulas, tariffs) rarely changes
+
+
+class CachedClient:
+    def __init__(self, ttl: float = DEFAULT_TTL, pool_size: int = 16):
+        self.ttl = ttl
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._cache = {}  # (url, params) -> (expires_at, etag, data)
+        self._lock = threading.Lock()
+
+    def get_json(self, url: str, params: dict = None, ttl: float = None, missing_ok: bool = False):
+        """
+        GET url and return its JSON, from cache while fresh.
+        With missing_ok, a 404 returns (and caches) None instead of raising.
+        """
+        key = (url, tuple(sorted((params or {}).items())))
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(key)
+        if cached and cached[0] > now:
+            return cached[2]
+
+        headers = {"If-None-Match": cached[1]} if cached and cached[1] else {}
+        resp = self.session.get(url, params=params, headers=headers)
+        expires = now + (self.ttl if ttl is None else ttl)
+        if resp.status_code == 304 and cached:
+            logger.debug("Not modified: %s %s", url, params or '')
+            with self._lock:
+                self._cache[key] = (expires, cached[1], cached[2])
+            return cached[2]
+        if resp.status_code == 404 and missing_ok:
+            # Cached like any response, so an endpoint the API lacks is not asked again until the TTL lapses
+            with self._lock:
+                self._cache[key] = (expires, None, None)
+            return None
+        resp.raise_for_status()
+        data = resp.json()
+        with self._lock:
+            self._cache[key] = (expires, resp.headers.get("ETag"), data)
+        return data
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+# Shared by all billing objects in the process
+client = CachedClient()
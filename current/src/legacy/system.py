@@ -8,46 +8,73 @@ Required files: usage data (Excel), tariff data (CSV), and configuration (YAML).
 Modified date: 2025-06-7
 Version: 3.0 (API Integration)
 """
+import os
+import sys
+import numpy as np
 import pandas as pd
-import yaml
+import ast
 import calendar
+import csv
 import logging
 import argparse
-import requests
-from datetime import date, datetime
-from typing import Dict
+from http_client import client
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from typing import Dict, List, Optional
 
-logging.basicConfig(
-    filename='../docs/energy_billing.log', 
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+# Formulas are compiled with the core engine's whitelisted expression compiler
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from core.services.expr import compile_expression
+from core.log import configure_logging, log_event
+
+# Records are written to the log file by a background listener, off the billing threads
+configure_logging(filename='../docs/energy_billing.log', fmt='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("billing")
 
 BASE_URL = "http://localhost:8000"
 PEAK_HOURS = range(17, 22)  # hardcoded as not in DB
 
+# Per-period inputs to the charge formulas (see summarise_usage / price_periods)
+USAGE_COLUMNS = ['total_usage', 'peak_usage', 'off_peak_usage', 'network_peak_usage', 'network_offpeak_usage',
+                 'max_kva', 'incentive_kva']
+
 class EnergyBillingSystem:
-    def __init__(self, customer_id: int):
+    def __init__(self, customer_id: int, interactive: bool = True):
         self.customer_id = customer_id
+        # Headless (interactive=False) derives network usage from the region's network_peak_hours
+        self.interactive = interactive
         self.plan = None
         self.region = None
         self.unit_defs = {}
         self.formulas = {}
+        # Built once per load_config by _compile_config
+        self.unit_table = {}
+        self.compiled_formulas = {}
 
     def load_config(self):
+        # One /config-bundle request (cached, revalidated by ETag) where the API serves it;
+        # sections it does not carry fall back to their own cached endpoints
+        logger.info("Loading config for customer ID: %s", self.customer_id)
+        bundle = client.get_json(f"{BASE_URL}/config-bundle", params={"customer_id": self.customer_id},
+                                 missing_ok=True) or {}
+
         # Get customer
-        customers = requests.get(f"{BASE_URL}/customers").json()
-        customer = next((c for c in customers if c['id'] == self.customer_id), None)
-        logging.info(f"Loading config for customer ID: {self.customer_id}")
+        customer = bundle.get('customer')
+        if not customer:
+            customers = client.get_json(f"{BASE_URL}/customers")
+            customer = next((c for c in customers if c['id'] == self.customer_id), None)
         if not customer:
             raise ValueError(f"Customer ID {self.customer_id} not found in API data.")
 
-
-        # Get region from DB
-        self.region = requests.get(f"{BASE_URL}/regions/1").json()
+        # Get region from DB (copied: the cached response is shared). The bundle's region carries
+        # only the core columns, so the season and network fields still come from /regions
+        region = dict(bundle.get('region') or {})
+        if 'summer_months' not in region or 'network_peak_hours' not in region:
+            region_id = region.get('region_id') or customer.get('region_id') or 1
+            region.update(client.get_json(f"{BASE_URL}/regions/{region_id}"))
+        self.region = region
 
         if 'summer_months' in self.region and isinstance(self.region['summer_months'], str):
-            import ast
             try:
                 self.region['summer_months'] = ast.literal_eval(self.region['summer_months'])
             except Exception:
@@ -55,6 +82,12 @@ class EnergyBillingSystem:
         elif 'summer_months' not in self.region:
             self.region['summer_months'] = [12, 1, 2]  # Default to Dec, Jan, Feb
 
+        if isinstance(self.region.get('network_peak_hours'), str):
+            try:
+                self.region['network_peak_hours'] = ast.literal_eval(self.region['network_peak_hours'])
+            except Exception:
+                self.region['network_peak_hours'] = None
+
         # --- REMOVE YAML loading for units/formulas ---
         # with open("../docs/config.yaml", "r") as f:
         #     config = yaml.safe_load(f)
@@ -65,53 +98,92 @@ class EnergyBillingSystem:
         # self.unit_defs = config.get("unit_definitions", {})
 
         # --- Instead, fetch from API ---
-        self.unit_defs = {u['unit']: u for u in requests.get(f"{BASE_URL}/unit_definitions").json()}
-        self.formulas = {f['charge_type']: f['expression'] for f in requests.get(f"{BASE_URL}/formulas").json()}
+        unit_defs = bundle.get('unit_definitions') or client.get_json(f"{BASE_URL}/unit_definitions")
+        formulas = bundle.get('formulas') or client.get_json(f"{BASE_URL}/formulas")
+        self.unit_defs = {u['unit']: u for u in unit_defs}
+        self.formulas = {f['charge_type']: f['expression'] for f in formulas}
 
         # Get tariff components
         self.plan = {"id": 0}
-        self.plan["components"] = requests.get(
+        self.plan["components"] = bundle.get('tariff_components') or client.get_json(
             f"{BASE_URL}/tariff_components",
             params={"region_id": self.region["region_id"]}
-        ).json()
+        )
+        self._compile_config()
+
+    def _compile_config(self):
+        # Unit conversion plans per component unit (or the error to report) and compiled formulas
+        self.unit_table = {}
+        for comp in self.plan['components']:
+            if comp['unit'] not in self.unit_table:
+                try:
+                    self.unit_table[comp['unit']] = self._compile_unit(comp['unit'])
+                except ValueError as e:
+                    self.unit_table[comp['unit']] = e
+        self.compiled_formulas = {}
+        for charge_type, expression in self.formulas.items():
+            try:
+                self.compiled_formulas[charge_type] = compile_expression(expression, vectorized=True)
+            except ValueError as e:
+                logger.warning("Formula for %s rejected: %s", charge_type, e)
+                self.compiled_formulas[charge_type] = None
 
     def _is_leap_year(self, y: int):
         return y % 4 == 0 and (y % 100 != 0 or y % 400 == 0)
 
-    def _convert_units(self, value: float, unit: str, start_date: date, end_date: date) -> float:
-        logging.info(f"Converting units: {unit}")
-        converted = float(value)
-        unit_parts = unit.split('/')
-        days_in_range = (end_date - start_date).days + 1  # inclusive
-
-        # For proration
-        days_in_month = calendar.monthrange(start_date.year, start_date.month)[1]
-        days_in_year = 366 if self._is_leap_year(start_date.year) else 365
-
-        for part in unit_parts:
+    def _compile_unit(self, unit: str):
+        # (static factor, dynamic factor functions, period proration) for a unit string
+        static = 1.0
+        dynamic = []
+        for part in unit.split('/'):
             part = part.strip()
             defn = self.unit_defs.get(part)
             if not defn:
                 raise ValueError(f"Undefined unit: {part}")
-            logging.info(f"Conversion: {converted} * {defn['factor']} (type: {defn['conversion_type']})")
             if defn['conversion_type'] == 'static':
-                converted *= defn['factor']
-            elif defn['conversion_type'] == 'dynamic':
-                if defn['factor_function'] == 'days_in_month':
-                    converted *= (days_in_range / days_in_month)
-                elif defn['factor_function'] == 'days_in_year':
-                    converted *= (days_in_range / days_in_year)
+                static *= float(defn['factor'])
+            elif defn['conversion_type'] == 'dynamic' and defn['factor_function'] in ('days_in_month', 'days_in_year'):
+                dynamic.append(defn['factor_function'])
 
         # Prorate for common period-based units
         if unit in ['$/meter/year', '$/year']:
-            converted *= (days_in_range / days_in_year)
+            prorate = 'year'
         elif unit in ['$/meter/month', '$/month', '$/kVA/Mth']:
-            converted *= (days_in_range / days_in_month)
+            prorate = 'month'
         elif unit in ['c/day', '$/day']:
-            converted *= days_in_range
-
+            prorate = 'day'
+        else:
+            prorate = None
+        logger.debug("Compiled unit %s: static=%s dynamic=%s prorate=%s", unit, static, dynamic, prorate)
+        return static, tuple(dynamic), prorate
+
+    @staticmethod
+    def _apply_unit(plan, value, days_in_range, days_in_month, days_in_year):
+        # Works on scalars or per-period arrays alike
+        static, dynamic, prorate = plan
+        converted = value * static
+        for function in dynamic:
+            converted = converted * (days_in_range / (days_in_month if function == 'days_in_month' else days_in_year))
+        if prorate == 'year':
+            converted = converted * (days_in_range / days_in_year)
+        elif prorate == 'month':
+            converted = converted * (days_in_range / days_in_month)
+        elif prorate == 'day':
+            converted = converted * days_in_range
         return converted
-    
+
+    def _convert_units(self, value: float, unit: str, start_date: date, end_date: date) -> float:
+        plan = self.unit_table.get(unit)
+        if plan is None:
+            plan = self.unit_table[unit] = self._compile_unit(unit)
+        if isinstance(plan, Exception):
+            raise plan
+        days_in_range = (end_date - start_date).days + 1  # inclusive
+
+        # For proration
+        days_in_month = calendar.monthrange(start_date.year, start_date.month)[1]
+        days_in_year = 366 if self._is_leap_year(start_date.year) else 365
+        return self._apply_unit(plan, float(value), days_in_range, days_in_month, days_in_year)
 
     def prompt_network_peak_usage(self, retail_peak, retail_offpeak):
         try:
@@ -123,8 +195,18 @@ class EnergyBillingSystem:
             net_peak, net_offpeak = retail_peak, retail_offpeak
         return net_peak, net_offpeak
 
+    def derive_network_peak_usage(self, df: pd.DataFrame, retail_peak, retail_offpeak):
+        # Non-interactive replacement for prompt_network_peak_usage: split usage on the
+        # region's network peak hours, falling back to the retail split like the prompt's defaults
+        hours = self.region.get('network_peak_hours') if self.region else None
+        if not hours:
+            logger.warning("No network_peak_hours for region; using retail peak/off-peak for customer %s", self.customer_id)
+            return retail_peak, retail_offpeak
+        net_peak = df[df['ReadingDateTime'].dt.hour.isin([int(h) for h in hours])]['usage_kwh'].sum()
+        return net_peak, df['usage_kwh'].sum() - net_peak
+
     def fetch_usage_data(self, start: date, end: date) -> pd.DataFrame:
-        res = requests.get(f"{BASE_URL}/meter_readings", params={
+        res = client.session.get(f"{BASE_URL}/meter_readings", params={
             "customer_id": self.customer_id,
             "start": str(start),
             "end": str(end)
@@ -161,12 +243,11 @@ class EnergyBillingSystem:
         return demand.max()
 
 
-    def calculate_charges(self, df: pd.DataFrame, start: date, end: date) -> Dict[str, float]:
+    def summarise_usage(self, df: pd.DataFrame, start: date, end: date) -> dict:
+        # One period's formula inputs (a row of the frame price_periods takes)
         df['usage_kwh'] = df['usage_kwh'].astype(float)
         total_usage = df['usage_kwh'].sum()
         max_kva = df['kva'].max() if 'kva' in df.columns else 0
-        days = (end - start).days + 1
-        charges = {}
 
         incentive_kva = None
         if 'incentive_kva' in df.columns:
@@ -177,58 +258,83 @@ class EnergyBillingSystem:
         retail_peak_usage = self._get_peak_usage(df)
         retail_offpeak_usage = total_usage - retail_peak_usage
 
-        # Prompt user for network peak/off-peak usage
-        network_peak_usage, network_offpeak_usage = self.prompt_network_peak_usage(retail_peak_usage, retail_offpeak_usage)
-        # Debug: Log overall period stats
-        logging.info(f"Calculation period: {start} to {end} ({days} days)")
-        logging.info(f"Total usage_kwh: {total_usage}")
-        logging.info(f"Max KVA: {max_kva}")
-        logging.info(f"Incentive KVA: {incentive_kva}")
+        # Prompt user for network peak/off-peak usage, or derive it from network time bands when headless
+        if self.interactive:
+            network_peak_usage, network_offpeak_usage = self.prompt_network_peak_usage(retail_peak_usage, retail_offpeak_usage)
+        else:
+            network_peak_usage, network_offpeak_usage = self.derive_network_peak_usage(df, retail_peak_usage, retail_offpeak_usage)
+        return {
+            'start': start,
+            'end': end,
+            'days': (end - start).days + 1,
+            'total_usage': total_usage,
+            'peak_usage': retail_peak_usage,
+            'off_peak_usage': retail_offpeak_usage,
+            'network_peak_usage': network_peak_usage,
+            'network_offpeak_usage': network_offpeak_usage,
+            'max_kva': max_kva,
+            'incentive_kva': incentive_kva,
+        }
+
+    def price_periods(self, periods: pd.DataFrame) -> pd.DataFrame:
+        """
+        Price every period (a row of summarise_usage columns) against every component at once.
+        Returns one column per component, rounded to cents; NaN where the component does not apply.
+        """
+        starts = pd.to_datetime(periods['start'])
+        days = periods['days'].to_numpy(dtype=float)
+        days_in_month = starts.dt.days_in_month.to_numpy(dtype=float)
+        days_in_year = np.where(starts.dt.is_leap_year, 366.0, 365.0)
+        in_summer = starts.dt.month.isin(self.region['summer_months']).to_numpy()
+        base = {name: periods[name].to_numpy(dtype=float) for name in USAGE_COLUMNS}
+        base['days'] = days
+        charges = {}
 
         for comp in self.plan['components']:
-            logging.info(f"--- Calculating component: {comp['category_name']} (unit_type: {comp['unit_type']}) ---")
+            name = comp['category_name']
             charge_type = comp.get('charge_type', comp['unit_type'])
-            formula = self.formulas.get(charge_type.lower())
-            logging.info(f"Formula used: {formula}")
-            if "summer" in comp['category_name'].lower() and start.month not in self.region['summer_months']:
-                logging.info("Skipped (not in summer months)")
+            formula = self.compiled_formulas.get(charge_type.lower())
+            plan = self.unit_table.get(comp['unit'])
+            if isinstance(plan, Exception):
+                logger.warning("Unit conversion failed for %s: %s", name, plan)
                 continue
-
-            try:
-                rate = self._convert_units(comp['rate_per_unit'], comp['unit'], start, end)
-                logging.info(f"Converted rate for {comp['unit']}: {rate}")
-            except Exception as e:
-                logging.warning(f"Unit conversion failed for {comp['category_name']}: {e}")
+            if formula is None:
+                logger.warning("No formula found for %s", charge_type)
                 continue
 
-            variables = {
-                'total_usage': total_usage,
-                'peak_usage': retail_peak_usage,
-                'off_peak_usage': retail_offpeak_usage,
-                'max_kva': max_kva,
-                'incentive_kva': incentive_kva,
-                'rate': rate,
-                'loss_factor': comp['loss_factor'] or self.region['loss_factor'],
-                'days': days
-            }
+            variables = dict(
+                base,
+                rate=self._apply_unit(plan, float(comp['rate_per_unit']), days, days_in_month, days_in_year),
+                loss_factor=comp['loss_factor'] or self.region['loss_factor'],
+            )
             if comp['unit_type'] in ['network_peak']:
-                variables['peak_usage'] = network_peak_usage
+                variables['peak_usage'] = base['network_peak_usage']
             if comp['unit_type'] in ['network_offpeak']:
-                variables['off_peak_usage'] = network_offpeak_usage
-                    # Log variables used in formula
-            logging.info(f"Variables for formula: {variables}")
-
-            if not formula:
-                logging.warning(f"No formula found for {charge_type}")
-                continue
+                variables['off_peak_usage'] = base['network_offpeak_usage']
             try:
-                result = eval(formula, {}, variables)
-                charges[comp['category_name']] = round(result, 2)
-                logging.info(f"Result for {comp['category_name']}: {result} (rounded: {charges[comp['category_name']]})")
+                with np.errstate(all='ignore'):
+                    result = np.broadcast_to(np.asarray(formula(variables), dtype=float), days.shape)
             except Exception as e:
-                logging.warning(f"Error in {comp['category_name']}: {e}")
+                logger.warning("Error in %s: %s", name, e)
+                continue
+
+            # Periods outside the summer months and failed evaluations (e.g. division by zero) get no charge
+            applies = np.isfinite(result)
+            if "summer" in name.lower():
+                applies &= in_summer
+            charges[name] = [round(float(v), 2) if ok else np.nan for v, ok in zip(result, applies)]
+
+        return pd.DataFrame(charges, index=periods.index)
 
-        logging.info(f"Final charges for {comp['category_name']}: {charges}")
+    def calculate_charges(self, df: pd.DataFrame, start: date, end: date) -> Dict[str, float]:
+        summary = self.summarise_usage(df, start, end)
+        log_event(logger, logging.INFO, "Calculation period: %s to %s", start, end, customer_id=self.customer_id,
+                  days=summary['days'], total_usage_kwh=summary['total_usage'], max_kva=summary['max_kva'],
+                  incentive_kva=summary['incentive_kva'])
+
+        priced = self.price_periods(pd.DataFrame([summary]))
+        charges = {name: cost for name, cost in priced.iloc[0].items() if not pd.isna(cost)}
+        log_event(logger, logging.INFO, "Final charges for customer %s", self.customer_id, charges=charges)
         return charges
     
     def calculate_from_api(self, api_url: str, start_date: date, end_date: date):
@@ -255,20 +361,106 @@ class EnergyBillingSystem:
             "total_cost": sum(charges.values()),
             "breakdowns": breakdowns
         }
-        resp = requests.post(f"{BASE_URL}/invoices", json=payload)
+        resp = client.session.post(f"{BASE_URL}/invoices", json=payload)
         if resp.status_code == 200:
             print("Invoice saved to database.")
         else:
             print("Failed to save invoice:", resp.text)
 
+def read_manifest(path: str) -> List[dict]:
+    # CSV with a header row: customer_id,start,end (dates as YYYY-MM-DD)
+    with open(path, newline='') as f:
+        return [
+            {
+                'customer_id': int(row['customer_id']),
+                'start': date.fromisoformat(row['start'].strip()),
+                'end': date.fromisoformat(row['end'].strip()),
+            }
+            for row in csv.DictReader(f)
+            if row.get('customer_id', '').strip()
+        ]
+
+
+def summarise_manifest_entry(entry: dict) -> dict:
+    # Network-bound part of a manifest bill: config (cached) and readings, reduced to one period row
+    billing = EnergyBillingSystem(entry['customer_id'], interactive=False)
+    try:
+        billing.load_config()
+        df = billing.fetch_usage_data(entry['start'], entry['end'])
+        return {**entry, 'billing': billing, 'summary': billing.summarise_usage(df, entry['start'], entry['end']),
+                'charges': {}, 'error': None}
+    except Exception as e:
+        logger.warning("Billing failed for customer %s (%s to %s): %s", entry['customer_id'], entry['start'], entry['end'], e)
+        return {**entry, 'billing': None, 'summary': None, 'charges': {}, 'error': str(e)}
+
+
+def price_manifest(results: List[dict]):
+    # Price all periods of a region (same components, units and formulas) as one DataFrame operation
+    by_region = {}
+    for r in results:
+        if r['billing'] is not None:
+            by_region.setdefault(r['billing'].region.get('region_id'), []).append(r)
+    for group in by_region.values():
+        priced = group[0]['billing'].price_periods(pd.DataFrame([r['summary'] for r in group]))
+        for r, (_, row) in zip(group, priced.iterrows()):
+            r['charges'] = {name: cost for name, cost in row.items() if not pd.isna(cost)}
+
+
+def run_manifest(manifest_path: str, output_path: str, workers: int = 4, save: bool = False,
+                 api_url: Optional[str] = None) -> List[dict]:
+    """
+    Bill every (customer, period) in the manifest headlessly: readings are fetched on a
+    thread pool, then each region's periods are priced together. Writes one row per
+    charge (plus a total row) to output_path for reconciliation.
+    """
+    global BASE_URL
+    if api_url:
+        BASE_URL = api_url
+    entries = read_manifest(manifest_path)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(summarise_manifest_entry, entries))
+    price_manifest(results)
+    if save:
+        for r in results:
+            if r['billing'] is not None:
+                r['billing'].save_invoice(r['charges'], r['start'], r['end'])
+
+    with open(output_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['customer_id', 'start', 'end', 'component', 'cost', 'error'])
+        for r in results:
+            for name, cost in r['charges'].items():
+                writer.writerow([r['customer_id'], r['start'], r['end'], name, cost, ''])
+            writer.writerow([r['customer_id'], r['start'], r['end'], 'TOTAL',
+                             round(sum(r['charges'].values()), 2), r['error'] or ''])
+    failed = sum(1 for r in results if r['error'])
+    print(f"Billed {len(results) - failed} of {len(results)} manifest entries ({failed} failed) -> {output_path}")
+    return results
+
+
 def main():
+    global BASE_URL
     parser = argparse.ArgumentParser()
-    parser.add_argument('--customer_id', required=True, type=int) # 1 EXISTS IN DB
-    parser.add_argument('--start', required=True) # YYYY-MM-DD
-    parser.add_argument('--end', required=True) # YYYY-MM-DD
+    parser.add_argument('--customer_id', type=int) # 1 EXISTS IN DB
+    parser.add_argument('--start') # YYYY-MM-DD
+    parser.add_argument('--end') # YYYY-MM-DD
+    parser.add_argument('--headless', action='store_true', help="Derive network peak usage instead of prompting")
+    parser.add_argument('--manifest', help="CSV of customer_id,start,end to bill headlessly")
+    parser.add_argument('--output', default='legacy_charges.csv', help="Charges CSV written for --manifest")
+    parser.add_argument('--workers', type=int, default=4, help="Threads used for --manifest")
+    parser.add_argument('--save', action='store_true', help="Also save invoices for --manifest")
+    parser.add_argument('--api_url', help=f"API base URL (default {BASE_URL})")
     args = parser.parse_args()
 
-    billing = EnergyBillingSystem(args.customer_id)
+    if args.manifest:
+        run_manifest(args.manifest, args.output, args.workers, args.save, args.api_url)
+        return
+    if args.customer_id is None or not args.start or not args.end:
+        parser.error("--customer_id, --start and --end are required without --manifest")
+    if args.api_url:
+        BASE_URL = args.api_url
+
+    billing = EnergyBillingSystem(args.customer_id, interactive=not args.headless)
     billing.load_config()
     start_date, end_date = date.fromisoformat(args.start), date.fromisoformat(args.end)
     df = billing.fetch_usage_data(start_date, end_date)
@@ -285,3 +477,5 @@ if __name__ == "__main__":
     main()
 
 # must use by cli example: python system.py --customer_id 1 --start 2023-09-01 --end 2023-10-01
+# unattended: python system.py --customer_id 1 --start 2023-09-01 --end 2023-10-01 --headless
+# batch:      python system.py --manifest bills.csv --output legacy_charges.csv --workers 8
@@ -0,0 +1,83 @@
+# legacy/tests/test_http_client.py
+"""
+CachedClient serves fresh responses from its cache, revalidates stale ones
+with If-None-Match (a 304 renews the TTL) and caches a 404 when asked to.
+"""
+
+import io
+import json
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("requests")
+sys.path.append(os.path.abspath(os.path.join(__file__, "..", "..")))
+
+from requests import HTTPError, Response
+from requests.adapters import BaseAdapter
+
+from http_client import CachedClient
+
+URL = "http://api.test/units"
+
+
+class _Server(BaseAdapter):
+    """Answers each request with the next canned (status, etag, body) and records it."""
+
+    def __init__(self, *responses):
+        super().__init__()
+        self.responses = list(responses)
+        self.sent = []
+
+    def send(self, request, **kwargs):
+        self.sent.append(request)
+        status, etag, body = self.responses.pop(0)
+        response = Response()
+        response.status_code = status
+        response.request, response.url, response.encoding = request, request.url, "utf-8"
+        if etag:
+            response.headers["ETag"] = etag
+        response.raw = io.BytesIO(json.dumps(body).encode() if body is not None else b"")
+        return response
+
+    def close(self):
+        pass
+
+
+def _client(*responses):
+    client = CachedClient(ttl=60)
+    server = _Server(*responses)
+    client.session.mount("http://", server)
+    return client, server
+
+
+def test_fresh_responses_are_served_from_cache():
+    client, server = _client((200, '"v1"', {"units": 1}), (200, None, {"units": 2}))
+    assert client.get_json(URL) == {"units": 1}
+    assert client.get_json(URL) == {"units": 1}
+    # Other params are another cache entry
+    assert client.get_json(URL, params={"region": 2}) == {"units": 2}
+    assert len(server.sent) == 2
+    assert "If-None-Match" not in server.sent[0].headers
+
+
+def test_stale_responses_revalidate_and_304_renews_ttl():
+    client, server = _client((200, '"v1"', {"units": 1}), (304, None, None), (200, '"v2"', {"units": 3}))
+    assert client.get_json(URL, ttl=0) == {"units": 1}
+    # Stale at once: revalidated, and the 304 keeps the cached body for another 60 s
+    assert client.get_json(URL) == {"units": 1}
+    assert server.sent[1].headers["If-None-Match"] == '"v1"'
+    assert client.get_json(URL) == {"units": 1}
+    assert len(server.sent) == 2
+    client.clear()
+    assert client.get_json(URL) == {"units": 3}
+
+
+def test_missing_ok_caches_404():
+    client, server = _client((404, None, None), (404, None, None))
+    assert client.get_json(URL, missing_ok=True) is None
+    assert client.get_json(URL, missing_ok=True) is None
+    assert len(server.sent) == 1
+    with pytest.raises(HTTPError):
+        client.get_json(URL + "/other")
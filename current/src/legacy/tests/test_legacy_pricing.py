@@ -0,0 +1,180 @@
+# legacy/tests/test_legacy_pricing.py
+"""
+Compiled units and formulas price legacy charges exactly as the per-component
+eval loop did, and a batch of periods prices each period as a single bill does.
+"""
+
+import calendar
+import os
+import sys
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("requests")  # legacy/http_client.py
+sys.path.append(os.path.abspath(os.path.join(__file__, "..", "..")))
+
+from system import EnergyBillingSystem
+
+REGION = {'region_id': 1, 'region_name': 'Test', 'loss_factor': 1.02,
+          'summer_months': [12, 1, 2], 'network_peak_hours': [15, 16, 17, 18, 19, 20]}
+UNIT_DEFS = [
+    {'unit': '$', 'conversion_type': 'static', 'factor': 1},
+    {'unit': 'c', 'conversion_type': 'static', 'factor': 0.01},
+    {'unit': 'kWh', 'conversion_type': 'static', 'factor': 1},
+    {'unit': 'kVA', 'conversion_type': 'static', 'factor': 1},
+    {'unit': 'meter', 'conversion_type': 'static', 'factor': 1},
+    {'unit': 'day', 'conversion_type': 'static', 'factor': 1},
+    {'unit': 'month', 'conversion_type': 'static', 'factor': 1},
+    {'unit': 'year', 'conversion_type': 'static', 'factor': 1},
+    {'unit': 'Mth', 'conversion_type': 'dynamic', 'factor': None, 'factor_function': 'days_in_month'},
+]
+FORMULAS = {
+    'energy': 'total_usage * rate',
+    'peak': 'peak_usage * rate * loss_factor',
+    'network_peak': 'peak_usage * rate',
+    'network_offpeak': 'off_peak_usage * rate',
+    'supply': 'rate',
+    'demand': 'max_kva * rate',
+}
+COMPONENTS = [
+    {'id': 1, 'category_name': 'Energy', 'unit_type': 'energy', 'unit': 'c/kWh', 'rate_per_unit': 21.5,
+     'loss_factor': None},
+    {'id': 2, 'category_name': 'Peak', 'unit_type': 'peak', 'unit': 'c/kWh', 'rate_per_unit': 9.75,
+     'loss_factor': 1.05},
+    {'id': 3, 'category_name': 'Network Peak', 'unit_type': 'network_peak', 'unit': 'c/kWh', 'rate_per_unit': 8.1,
+     'loss_factor': None},
+    {'id': 4, 'category_name': 'Network Off-Peak', 'unit_type': 'network_offpeak', 'unit': 'c/kWh',
+     'rate_per_unit': 3.3, 'loss_factor': None},
+    {'id': 5, 'category_name': 'Supply', 'unit_type': 'supply', 'unit': '$/year', 'rate_per_unit': 400.0,
+     'loss_factor': None},
+    {'id': 6, 'category_name': 'Metering', 'unit_type': 'meter', 'charge_type': 'supply', 'unit': '$/meter/month',
+     'rate_per_unit': 12.0, 'loss_factor': None},
+    {'id': 7, 'category_name': 'Daily', 'unit_type': 'daily', 'charge_type': 'supply', 'unit': 'c/day',
+     'rate_per_unit': 95.0, 'loss_factor': None},
+    {'id': 8, 'category_name': 'Summer Demand', 'unit_type': 'demand', 'unit': '$/kVA/Mth', 'rate_per_unit': 6.4,
+     'loss_factor': None},
+]
+# Leap-year February (a summer month), a non-leap summer month and a winter month
+PERIODS = [(date(2024, 2, 1), date(2024, 2, 29)), (date(2023, 1, 1), date(2023, 1, 31)),
+           (date(2023, 6, 1), date(2023, 6, 30))]
+
+
+@pytest.fixture
+def billing():
+    billing = EnergyBillingSystem(1, interactive=False)
+    billing.region = dict(REGION)
+    billing.unit_defs = {u['unit']: u for u in UNIT_DEFS}
+    billing.formulas = dict(FORMULAS)
+    billing.plan = {'id': 0, 'components': [dict(c) for c in COMPONENTS]}
+    billing._compile_config()
+    return billing
+
+
+def _readings(start: date, end: date) -> pd.DataFrame:
+    stamps = pd.date_range(start, pd.Timestamp(end) + pd.Timedelta(hours=23), freq='h')
+    hours = np.arange(len(stamps))
+    df = pd.DataFrame({
+        'timestamp': stamps.astype(str),
+        'usage_kwh': 0.4 + (hours % 24) * 0.05 + (hours % 7) * 0.01,
+        'kva': 2.0 + (hours % 11) * 0.3,
+    })
+    df['ReadingDateTime'] = pd.to_datetime(df['timestamp'])
+    return df
+
+
+def _old_convert_units(billing, value, unit, start_date, end_date):
+    # The per-call conversion load_config's unit table replaced
+    converted = float(value)
+    days_in_range = (end_date - start_date).days + 1
+    days_in_month = calendar.monthrange(start_date.year, start_date.month)[1]
+    days_in_year = 366 if billing._is_leap_year(start_date.year) else 365
+    for part in unit.split('/'):
+        defn = billing.unit_defs[part.strip()]
+        if defn['conversion_type'] == 'static':
+            converted *= defn['factor']
+        elif defn['conversion_type'] == 'dynamic':
+            if defn['factor_function'] == 'days_in_month':
+                converted *= (days_in_range / days_in_month)
+            elif defn['factor_function'] == 'days_in_year':
+                converted *= (days_in_range / days_in_year)
+    if unit in ['$/meter/year', '$/year']:
+        converted *= (days_in_range / days_in_year)
+    elif unit in ['$/meter/month', '$/month', '$/kVA/Mth']:
+        converted *= (days_in_range / days_in_month)
+    elif unit in ['c/day', '$/day']:
+        converted *= days_in_range
+    return converted
+
+
+def _old_charges(billing, df, start, end):
+    # The per-component eval loop calculate_charges used before formulas were compiled
+    usage = billing.summarise_usage(df.copy(), start, end)
+    charges = {}
+    for comp in billing.plan['components']:
+        formula = billing.formulas.get(comp.get('charge_type', comp['unit_type']).lower())
+        if "summer" in comp['category_name'].lower() and start.month not in billing.region['summer_months']:
+            continue
+        variables = {
+            'total_usage': usage['total_usage'],
+            'peak_usage': usage['peak_usage'],
+            'off_peak_usage': usage['off_peak_usage'],
+            'max_kva': usage['max_kva'],
+            'incentive_kva': usage['incentive_kva'],
+            'rate': _old_convert_units(billing, comp['rate_per_unit'], comp['unit'], start, end),
+            'loss_factor': comp['loss_factor'] or billing.region['loss_factor'],
+            'days': usage['days'],
+        }
+        if comp['unit_type'] == 'network_peak':
+            variables['peak_usage'] = usage['network_peak_usage']
+        if comp['unit_type'] == 'network_offpeak':
+            variables['off_peak_usage'] = usage['network_offpeak_usage']
+        try:
+            charges[comp['category_name']] = round(eval(formula, {}, variables), 2)
+        except Exception:
+            pass
+    return charges
+
+
+@pytest.mark.parametrize("start,end", PERIODS)
+def test_compiled_pricing_matches_the_eval_loop(billing, start, end):
+    df = _readings(start, end)
+    charges = billing.calculate_charges(df.copy(), start, end)
+    expected = _old_charges(billing, df, start, end)
+    assert charges.keys() == expected.keys()
+    for name, cost in expected.items():
+        assert charges[name] == pytest.approx(cost, abs=1e-9), name
+    for comp in billing.plan['components']:
+        assert billing._convert_units(comp['rate_per_unit'], comp['unit'], start, end) == pytest.approx(
+            _old_convert_units(billing, comp['rate_per_unit'], comp['unit'], start, end))
+
+
+def test_leap_year_prorates_over_366_days(billing):
+    start, end = PERIODS[0]
+    charges = billing.calculate_charges(_readings(start, end), start, end)
+    assert charges['Supply'] == round(400.0 * 29 / 366, 2)
+    assert charges['Daily'] == round(0.95 * 29, 2)
+
+
+def test_summer_components_only_in_summer_months(billing):
+    assert 'Summer Demand' in billing.calculate_charges(_readings(*PERIODS[1]), *PERIODS[1])
+    assert 'Summer Demand' not in billing.calculate_charges(_readings(*PERIODS[2]), *PERIODS[2])
+
+
+def test_network_components_use_network_peak_hours(billing):
+    start, end = PERIODS[2]
+    df = _readings(start, end)
+    charges = billing.calculate_charges(df.copy(), start, end)
+    network_peak = df[df['ReadingDateTime'].dt.hour.between(15, 20)]['usage_kwh'].sum()
+    assert charges['Network Peak'] == round(network_peak * 0.081, 2)
+    assert charges['Network Off-Peak'] == round((df['usage_kwh'].sum() - network_peak) * 0.033, 2)
+
+
+def test_batch_pricing_matches_per_bill(billing):
+    summaries = [billing.summarise_usage(_readings(start, end), start, end) for start, end in PERIODS]
+    priced = billing.price_periods(pd.DataFrame(summaries))
+    for (start, end), (_, row) in zip(PERIODS, priced.iterrows()):
+        batch = {name: cost for name, cost in row.items() if not pd.isna(cost)}
+        assert batch == billing.calculate_charges(_readings(start, end), start, end)
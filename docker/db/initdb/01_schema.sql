@@ -1,4 +1,10 @@
 -- Drop existing tables if needed
+DROP TABLE IF EXISTS revenue_dirty_month CASCADE;
+DROP TABLE IF EXISTS revenue_monthly CASCADE;
+DROP TABLE IF EXISTS calc_run_line CASCADE;
+DROP TABLE IF EXISTS bill_run_shard CASCADE;
+DROP TABLE IF EXISTS bill_run CASCADE;
+DROP TABLE IF EXISTS meter_reading_change CASCADE;
 DROP TABLE IF EXISTS invoice CASCADE;
 DROP TABLE IF EXISTS calc_runs CASCADE;
 DROP TABLE IF EXISTS meter_reading CASCADE;
@@ -23,6 +29,8 @@ CREATE TABLE customer (
     address TEXT,
     region_id INT REFERENCES region(id) ON DELETE SET NULL
 );
+-- Bill-run shards select customers by hash range, in id order (core/services/billrun.py)
+CREATE INDEX ix_customer_hash ON customer ((hashint4(id)::bigint), id);
 
 -- 3. Tariff Plans
 -- (High-level grouping, e.g., "Shell Energy TOU Plan")
@@ -47,13 +55,15 @@ CREATE TABLE tariff_versions (
     uploaded_by TEXT NOT NULL,
     effective_from DATE NOT NULL,
     effective_to DATE,
-    created_at TIMESTAMP DEFAULT now()
+    created_at TIMESTAMP DEFAULT now(),
+    content_hash TEXT  -- sha256 of canonical_json, set when uploaded through POST /tariffs
 );
 
 -- Indexes for JSONB queries + effective date filtering
 CREATE INDEX ix_tariff_versions_plan_version ON tariff_versions (tariff_plan_id, version);
 CREATE INDEX ix_tariff_versions_effective ON tariff_versions (effective_from, effective_to);
 CREATE INDEX ix_tariff_versions_jsonb_components ON tariff_versions USING gin (canonical_json);
+CREATE UNIQUE INDEX ux_tariff_versions_plan_content ON tariff_versions (tariff_plan_id, content_hash);
 
 -- 5. Market Operator Fees (with effective validity)
 
@@ -77,8 +87,23 @@ CREATE TABLE meter_reading (
     timestamp TIMESTAMP NOT NULL,
     kwh_used DECIMAL(10,4) NOT NULL
 );
--- Indexes for fast queries on time-series
-CREATE INDEX ix_meter_readings_customer_ts ON meter_reading (customer_id, timestamp);
+-- Indexes for fast queries on time-series; one reading per customer and interval, so ingestion can upsert
+CREATE UNIQUE INDEX ix_meter_readings_customer_ts ON meter_reading (customer_id, timestamp);
+
+-- Day ranges (inclusive) whose readings were added or replaced by ingestion;
+-- consumed by the late-data invalidation pass (core/services/invalidate.py)
+CREATE TABLE meter_reading_change (
+    id BIGSERIAL PRIMARY KEY,
+    customer_id INT REFERENCES customer(id) ON DELETE CASCADE,
+    day_from DATE NOT NULL,
+    day_to DATE NOT NULL,
+    recorded_at TIMESTAMP DEFAULT now(),
+    claimed_at TIMESTAMP,
+    attempts INT NOT NULL DEFAULT 0,
+    last_error TEXT,
+    processed_at TIMESTAMP
+);
+CREATE INDEX ix_meter_reading_change_pending ON meter_reading_change (id) WHERE processed_at IS NULL;
 
 -- 7. Calculation Runs (audit + results summary)
 
@@ -90,11 +115,26 @@ CREATE TABLE calc_runs (
     finished_at TIMESTAMP,
     status TEXT CHECK (status IN ('pending', 'running', 'completed', 'failed')) DEFAULT 'pending',
     result_summary_json JSONB,
-    checksum TEXT
+    checksum TEXT,
+    attempts INT NOT NULL DEFAULT 0,
+    available_at TIMESTAMP DEFAULT now(),
+    last_error TEXT,
+    period_start TIMESTAMP,
+    period_end TIMESTAMP
 );
 
 CREATE INDEX ix_calc_runs_status ON calc_runs (status);
+-- Finds completed runs overlapping changed readings (late-data invalidation)
+CREATE INDEX ix_calc_runs_customer_period ON calc_runs (customer_id, period_start, period_end) WHERE status = 'completed';
+-- Completed runs stored before period_start/period_end existed, backfilled from _meta
+CREATE INDEX ix_calc_runs_no_period ON calc_runs (id) WHERE status = 'completed' AND period_start IS NULL;
+-- Workers claim the oldest runnable pending run (see core/services/worker.py)
+CREATE INDEX ix_calc_runs_claim ON calc_runs (available_at, id) WHERE status = 'pending';
+-- Runs whose worker lease expired (core/services/worker.py --visibility-timeout)
+CREATE INDEX ix_calc_runs_running ON calc_runs (started_at) WHERE status = 'running';
 CREATE INDEX ix_calc_runs_tariff_customer ON calc_runs (tariff_version_id, customer_id);
+-- Keyset pages of a customer's bill history, newest first (GET /customers/{id}/bills/history)
+CREATE INDEX ix_calc_runs_customer_id ON calc_runs (customer_id, id DESC);
 
 -- 8. Invoices (linked to calc_runs for traceability)
 
@@ -106,3 +146,112 @@ CREATE TABLE invoice (
     due_date DATE NOT NULL,
     total_amount DECIMAL(12,2) NOT NULL
 );
+
+-- 9. Bill runs (month-end orchestration, see core/services/billrun.py)
+-- Customers are split into shards by a hash range over hashint4(customer.id);
+-- workers lease shards and checkpoint the last customer id they finished.
+
+CREATE TABLE bill_run (
+    id SERIAL PRIMARY KEY,
+    period_start TIMESTAMP NOT NULL,
+    period_end TIMESTAMP NOT NULL,
+    shard_count INT NOT NULL,
+    status TEXT CHECK (status IN ('running', 'completed')) DEFAULT 'running',
+    created_at TIMESTAMP DEFAULT now(),
+    finished_at TIMESTAMP
+);
+
+CREATE TABLE bill_run_shard (
+    id SERIAL PRIMARY KEY,
+    bill_run_id INT REFERENCES bill_run(id) ON DELETE CASCADE,
+    shard_no INT NOT NULL,
+    hash_from BIGINT NOT NULL,
+    hash_to BIGINT NOT NULL,
+    status TEXT CHECK (status IN ('pending', 'leased', 'completed')) DEFAULT 'pending',
+    lease_owner TEXT,
+    lease_expires_at TIMESTAMP,
+    last_customer_id INT NOT NULL DEFAULT 0,
+    customers_total INT NOT NULL DEFAULT 0,
+    customers_done INT NOT NULL DEFAULT 0,
+    bills_done INT NOT NULL DEFAULT 0,
+    bills_failed INT NOT NULL DEFAULT 0,
+    started_at TIMESTAMP,
+    updated_at TIMESTAMP,
+    finished_at TIMESTAMP,
+    last_error TEXT,
+    UNIQUE (bill_run_id, shard_no)
+);
+
+CREATE INDEX ix_bill_run_shard_lease ON bill_run_shard (bill_run_id, status, lease_expires_at);
+
+-- 10. Calculation lines and monthly revenue (see core/services/revenue.py)
+-- One row per breakdown line of a calc run, written in bulk alongside
+-- calc_runs.result_summary_json.
+
+CREATE TABLE calc_run_line (
+    id BIGSERIAL PRIMARY KEY,
+    calc_run_id INT NOT NULL REFERENCES calc_runs(id) ON DELETE CASCADE,
+    component_id TEXT NOT NULL,
+    category TEXT,
+    units_used DECIMAL(14,4),
+    unit_label TEXT,
+    cost DECIMAL(14,4) NOT NULL
+);
+
+CREATE INDEX ix_calc_run_line_run ON calc_run_line (calc_run_id);
+CREATE INDEX ix_calc_run_line_category_component ON calc_run_line (category, component_id);
+
+-- Monthly totals by plan, category and component over the latest completed
+-- run per (customer, tariff version, period); months of newly completed runs
+-- are marked in revenue_dirty_month and recomputed by the next refresh.
+CREATE TABLE revenue_monthly (
+    month DATE NOT NULL,
+    tariff_plan_id INT NOT NULL,
+    category TEXT NOT NULL,
+    component_id TEXT NOT NULL,
+    bills INT NOT NULL,
+    units_used DECIMAL(16,4),
+    cost DECIMAL(16,4) NOT NULL,
+    PRIMARY KEY (month, tariff_plan_id, category, component_id)
+);
+
+CREATE TABLE revenue_dirty_month (
+    month DATE PRIMARY KEY,
+    marked_at TIMESTAMP
+);
+
+-- Cache invalidation (core/notify.py): every change to tariff plans, versions
+-- and market fees is announced on the cache_invalidation channel when its
+-- transaction commits, so API and worker processes evict exactly what changed.
+CREATE OR REPLACE FUNCTION notify_cache_invalidation() RETURNS trigger AS $$
+DECLARE
+    old_row JSONB := to_jsonb(OLD);
+    new_row JSONB := to_jsonb(NEW);
+    plan_key TEXT := CASE WHEN TG_TABLE_NAME = 'tariff_plan' THEN 'id' ELSE 'tariff_plan_id' END;
+BEGIN
+    PERFORM pg_notify('cache_invalidation', json_build_object(
+        'table', TG_TABLE_NAME,
+        'op', TG_OP,
+        'id', COALESCE(new_row->'id', old_row->'id'),
+        'tariff_plan_ids', (
+            SELECT json_agg(DISTINCT plan_id) FROM (
+                VALUES ((old_row->>plan_key)::INT), ((new_row->>plan_key)::INT)
+            ) AS changed(plan_id) WHERE plan_id IS NOT NULL
+        )
+    )::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER tariff_plan_notify AFTER INSERT OR UPDATE OR DELETE ON tariff_plan
+    FOR EACH ROW EXECUTE FUNCTION notify_cache_invalidation();
+CREATE TRIGGER tariff_versions_notify AFTER INSERT OR UPDATE OR DELETE ON tariff_versions
+    FOR EACH ROW EXECUTE FUNCTION notify_cache_invalidation();
+CREATE TRIGGER market_op_fees_notify AFTER INSERT OR UPDATE OR DELETE ON market_op_fees
+    FOR EACH ROW EXECUTE FUNCTION notify_cache_invalidation();
+CREATE TRIGGER tariff_plan_notify_truncate AFTER TRUNCATE ON tariff_plan
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_invalidation();
+CREATE TRIGGER tariff_versions_notify_truncate AFTER TRUNCATE ON tariff_versions
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_invalidation();
+CREATE TRIGGER market_op_fees_notify_truncate AFTER TRUNCATE ON market_op_fees
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_invalidation();